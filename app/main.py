@@ -1,7 +1,12 @@
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-import os, subprocess, time, json
+from fastapi.responses import HTMLResponse, PlainTextResponse
+import os, subprocess, sys, threading, time, traceback, json, gzip, hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = FastAPI()
 
@@ -13,45 +18,490 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def isOlderThanADay(file):
-    fileTime = os.path.getmtime(file)
-    return ((time.time() - fileTime) / 3600 > 24)
+# Where security_scan.py writes its reports
+REPORT_DIR = os.getenv('SNAP_DATA') or os.getcwd()
+SCAN_COMMAND = ['python3', '%s/bin/security_scan.py' % os.getenv('SNAP')]
+# Minimum number of seconds between the starts of two scans
+SCAN_MIN_INTERVAL = float(os.getenv('SCAN_MIN_INTERVAL', '600'))
+# Scans run in a resident worker (security_scan.py --serve) that keeps the parsed feeds
+# between scans, unless SCAN_RESIDENT=0: then every scan starts a new interpreter
+SCAN_RESIDENT = os.getenv('SCAN_RESIDENT', '1') != '0'
+# Set when the reports are kept up to date by security_scan.py --watch, which scans again as
+# soon as a snap or a feed changes: then the age of the reports does not trigger scans
+SCAN_WATCH = os.getenv('SCAN_WATCH', '0') != '0'
+# Written to ask the watcher for a scan: the server never runs a scan of its own next to it
+SCAN_REQUEST_FILE = os.path.join(REPORT_DIR, 'scan.request')
+
+# Runs security_scan.py in the background, one scan at a time
+# A trigger while a scan runs joins it, unless a rerun is asked for: then a single rerun is
+# queued, however many are asked for. Scans never start closer than minInterval seconds apart
+# When resident, the scans are run by one worker process, started with the first scan and
+# started again if it dies
+class ScanScheduler:
+    def __init__(self, command, directory, minInterval, resident=False):
+        self.command = command
+        self.directory = directory
+        self.minInterval = minInterval
+        self.resident = resident
+        self.process = None
+        self.workerStartup = None
+        self.workerScans = 0
+        self.lastScanSeconds = None
+        self.condition = threading.Condition()
+        self.worker = None
+        self.requested = False
+        self.running = False
+        self.stage = None
+        self.started = None
+        self.lastDuration = None
+        self.lastExitCode = None
+
+    # Returns what became of the trigger: 'started', 'joined', 'queued' or 'scheduled'
+    def trigger(self, rerun=False):
+        with self.condition:
+            if self.running and not rerun:
+                return 'joined'
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name='scan-scheduler', daemon=True)
+                self.worker.start()
+            self.requested = True
+            self.condition.notify()
+            if self.running:
+                return 'queued'
+            if self.started is not None and time.time() < self.started + self.minInterval:
+                return 'scheduled'
+            return 'started'
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.requested:
+                    self.condition.wait()
+                while self.started is not None and time.time() < self.started + self.minInterval:
+                    self.condition.wait(self.started + self.minInterval - time.time())
+                self.requested = False
+                self.running = True
+                self.stage = 'starting'
+                self.started = time.time()
+            exitCode = None
+            try:
+                exitCode = self.scan()
+            except Exception:
+                # The scheduler must outlive a failed scan, or no scan would ever run again
+                print ('The scan failed')
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.running = False
+                    self.stage = None
+                    self.lastDuration = time.time() - self.started
+                    self.lastExitCode = exitCode
+
+    def scan(self):
+        if self.resident:
+            return self.scanInWorker()
+        try:
+            process = subprocess.Popen(self.command, cwd=self.directory, stdout=subprocess.PIPE,
+                universal_newlines=True, errors='replace')
+        except OSError as error:
+            print ('Could not start the scan: %s' % error)
+            return None
+        for line in process.stdout:
+            self.follow(line)
+        return process.wait()
+
+    def follow(self, line):
+        if line.startswith('STAGE: '):
+            self.stage = line[len('STAGE: '):].strip()
+        sys.stdout.write(line)
+
+    # Returns the first line of the worker starting with one of prefixes, following the others
+    # None if the worker exited
+    def readUntil(self, prefixes):
+        for line in self.process.stdout:
+            if line.startswith(prefixes):
+                return line
+            self.follow(line)
+        return None
+
+    def startWorker(self):
+        started = time.time()
+        try:
+            self.process = subprocess.Popen(self.command + ['--serve'], cwd=self.directory,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, errors='replace')
+        except OSError as error:
+            print ('Could not start the scan worker: %s' % error)
+            self.process = None
+            return False
+        if self.readUntil(('READY',)) is None:
+            print ('The scan worker exited with %s before it was ready' % self.process.wait())
+            self.process = None
+            return False
+        self.workerStartup = time.time() - started
+        self.workerScans = 0
+        return True
+
+    # Kills the worker, for one that does not follow the protocol: the next scan starts another
+    def killWorker(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def scanInWorker(self):
+        try:
+            if self.process is None or self.process.poll() is not None:
+                if not self.startWorker():
+                    return None
+            try:
+                self.process.stdin.write('scan\n')
+                self.process.stdin.flush()
+            except OSError:
+                line = None
+            else:
+                line = self.readUntil(('DONE',))
+            if line is None:
+                exitCode = self.process.wait()
+                print ('The scan worker exited with %s' % exitCode)
+                self.process = None
+                return exitCode
+            fields = line.split()
+            exitCode = int(fields[1])
+            self.lastScanSeconds = float(fields[2])
+            self.workerScans += 1
+            return exitCode
+        except Exception:
+            print ('The scan worker failed, killing it')
+            traceback.print_exc()
+            self.killWorker()
+            return None
+
+    def status(self):
+        with self.condition:
+            return {'state': 'running' if self.running else 'idle',
+                'stage': self.stage,
+                'started': self.started,
+                'last_duration': self.lastDuration,
+                'last_exit_code': self.lastExitCode,
+                'queued': self.requested,
+                'worker': {'pid': self.process.pid if self.process is not None else None,
+                    'startup_seconds': self.workerStartup,
+                    'scans': self.workerScans,
+                    'last_scan_seconds': self.lastScanSeconds} if self.resident else None}
+
+scheduler = ScanScheduler(SCAN_COMMAND, REPORT_DIR, SCAN_MIN_INTERVAL, SCAN_RESIDENT)
+
+# A version of a report file, held in memory along with its precompressed variants
+# The gzip variant security_scan.py wrote next to filename is used when it is the one of body
+class ReportBody:
+    def __init__(self, body, mtime, filename=None):
+        self.mtime = mtime
+        self.bodies = {'identity': body}
+        digest = hashlib.sha256(body).hexdigest()
+        gzipped = None
+        if filename is not None:
+            gzipped = self.precompressed(filename, body, digest)
+        if gzipped is None:
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gzipped) < len(body):
+            self.bodies['gzip'] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(body)
+            if len(compressed) < len(body):
+                self.bodies['br'] = compressed
+        self.etag = digest[:32]
+
+    # filename.gz, if filename.sha256 is the hash of body. A scan may be replacing the
+    # sidecars while we read them, so the content of the .gz is checked as well
+    @staticmethod
+    def precompressed(filename, body, digest):
+        try:
+            with open(filename + '.sha256', 'rb') as hashFile:
+                if hashFile.read().decode().strip() != digest:
+                    return None
+            with open(filename + '.gz', 'rb') as gzipFile:
+                gzipped = gzipFile.read()
+            if gzip.decompress(gzipped) == body:
+                return gzipped
+        except (OSError, EOFError, UnicodeDecodeError):
+            pass
+        return None
+
+    # Each encoding is a representation of its own, with its own strong ETag
+    def etagOf(self, encoding):
+        return '"%s"' % self.etag if encoding == 'identity' else '"%s-%s"' % (self.etag, encoding)
+
+    def encodingFor(self, acceptEncoding):
+        accepted = {}
+        for part in acceptEncoding.split(','):
+            fields = part.strip().split(';')
+            quality = 1.0
+            for field in fields[1:]:
+                name, _, value = field.strip().partition('=')
+                if name == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            accepted[fields[0].strip().lower()] = quality
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+    def response(self, request):
+        encoding = self.encodingFor(request.headers.get('accept-encoding', ''))
+        headers = {'ETag': self.etagOf(encoding), 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        ifNoneMatch = request.headers.get('if-none-match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+            # A client may revalidate with the tag of another encoding, the content is the same
+            if '*' in tags or any(self.etagOf(known) in tags for known in self.bodies):
+                return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return HTMLResponse(content=self.bodies[encoding], headers=headers)
+
+# The results.json written by security_scan.py, parsed
+class ScanResults:
+    def __init__(self, body, mtime):
+        self.mtime = mtime
+        results = json.loads(body)
+        self.scanId = results['scan_id']
+        self.horizon = results['horizon']
+        self.summary = dict((key, results[key]) for key in ('scan_id', 'generated', 'versions', 'totals'))
+        # Results written before components were counted do not have them
+        self.summary['components'] = results.get('components', {})
+        # Nor the open USNs per snap and package
+        self.summary['attribution'] = results.get('attribution', {})
+        self.lists = {'usn': results['usns'], 'cve': results['cves']}
+        self.removed = results['removed']
+
+    # The entries of kind ('usn' or 'cve') that match the filters, one page of them
+    # since only keeps what changed after that scan, and adds the entries that were removed
+    def query(self, kind, filters, since, offset, limit):
+        payload = {'scan_id': self.scanId}
+        entries = self.lists[kind]
+        removed = [entry for entry in self.removed if entry['kind'] == kind]
+        if since is not None:
+            # The changes since that scan are not all known anymore: everything is sent again
+            payload['reset'] = since < self.horizon or since > self.scanId
+            if not payload['reset']:
+                entries = [entry for entry in entries if entry['changed'] > since]
+                removed = [entry for entry in removed if entry['changed'] > since]
+        for field, values in filters.items():
+            if values:
+                values = set(value.lower() for value in values.split(','))
+                entries = [entry for entry in entries if str(entry.get(field)).lower() in values]
+                removed = [entry for entry in removed if field not in entry or str(entry[field]).lower() in values]
+        payload['total'] = len(entries)
+        payload['offset'] = offset
+        payload['limit'] = limit
+        payload['items'] = entries[offset:offset + limit]
+        if since is not None and not payload['reset']:
+            payload['removed'] = removed
+        return payload
+
+# A report file, read again only when its mtime or size change
+# parse turns the contents of the file and its mtime into what is served
+class Report:
+    def __init__(self, filename, parse=ReportBody):
+        self.filename = filename
+        self.parse = parse
+        # (mtime_ns, size, ReportBody), replaced as a whole so that concurrent requests
+        # never see the body of one version with the ETag of another
+        self.loaded = None
+
+    # Returns what parse made of the file, or None if the file does not exist
+    def current(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            self.loaded = None
+            return None
+        loaded = self.loaded
+        if loaded is None or (loaded[0], loaded[1]) != (stat.st_mtime_ns, stat.st_size):
+            with open(self.filename, 'rb') as myFile:
+                loaded = (stat.st_mtime_ns, stat.st_size, self.parse(myFile.read(), stat.st_mtime))
+            self.loaded = loaded
+        return loaded[2]
+
+# Request latencies, per route, as a Prometheus histogram
+class LatencyHistogram:
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # route -> [count per bucket, sum, count]
+        self.routes = {}
+
+    def observe(self, route, seconds):
+        with self.lock:
+            entry = self.routes.setdefault(route, [[0] * len(self.BUCKETS), 0.0, 0])
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def lines(self, name):
+        lines = ['# HELP %s Time spent serving requests' % name, '# TYPE %s histogram' % name]
+        with self.lock:
+            for route, (buckets, total, count) in sorted(self.routes.items()):
+                for bound, bucketCount in zip(self.BUCKETS, buckets):
+                    lines.append('%s_bucket{route="%s",le="%s"} %d' % (name, route, bound, bucketCount))
+                lines.append('%s_bucket{route="%s",le="+Inf"} %d' % (name, route, count))
+                lines.append('%s_sum{route="%s"} %f' % (name, route, total))
+                lines.append('%s_count{route="%s"} %d' % (name, route, count))
+        return lines
+
+latencies = LatencyHistogram()
+
+@app.middleware("http")
+async def timeRequests(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route rather than by path, so that unknown paths do not each get their own series
+    route = request.scope.get('route')
+    latencies.observe(route.path if route is not None else 'other', time.perf_counter() - start)
+    return response
+
+def metricLines(name, description, kind, samples):
+    lines = ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, kind)]
+    for labels, value in samples:
+        if value is None:
+            continue
+        labelText = ','.join('%s="%s"' % label for label in labels)
+        lines.append('%s%s %s' % (name, '{%s}' % labelText if labelText else '', value))
+    return lines
+
+reports = {}
+for prefix in ['cve', 'usn']:
+    filename = os.path.join(REPORT_DIR, '%s_stats.php' % prefix)
+    reports[prefix] = Report(filename, lambda body, mtime, filename=filename: ReportBody(body, mtime, filename))
+results = Report(os.path.join(REPORT_DIR, 'results.json'), ScanResults)
+metrics = Report(os.path.join(REPORT_DIR, 'metrics.json'), lambda body, mtime: json.loads(body))
+
+# Largest page the list endpoints return
+MAX_PAGE = 1000
+
+def isOlderThanADay(body):
+    return ((time.time() - body.mtime) / 3600 > 24)
 
 @app.get("/")
 def index():
-    os.chdir(os.getenv('SNAP_DATA'))
-    dict = {}
     needToRefresh = False
     # Case 1: The PHP files were never generated, so there is nothing to show for
-    file_prefixes = ['cve', 'usn']
-    for prefix in file_prefixes:
-        if not os.path.isfile('%s_stats.php' % prefix):
-            dict[prefix] = ''
+    for report in reports.values():
+        body = report.current()
+        if body is None or (not SCAN_WATCH and isOlderThanADay(body)):
             needToRefresh = True
-        else:
-            if isOlderThanADay('%s_stats.php' % prefix):
-                needToRefresh = True
-            with open('%s_stats.php' % prefix, 'r') as myFile:
-                dict[prefix] = myFile.read()
-    print ('now executing in %s' % os.getcwd())
     if needToRefresh:
-        subprocess.Popen(['python3', '%s/bin/security_scan.py' % os.getenv('SNAP')])
+        # The watcher is running its first scan, do not run another one next to it
+        if not SCAN_WATCH:
+            scheduler.trigger()
         return "REFRESHING"
     return "OK"
 
+# Asks for a fresh scan, even if one is running already
+# With a watcher, the scan is 'requested' from it and runs once the current one is done
+@app.post("/scan")
+def scan():
+    if SCAN_WATCH:
+        with open(SCAN_REQUEST_FILE, 'w') as requestFile:
+            requestFile.write('%f\n' % time.time())
+        return {'scan': 'requested'}
+    return {'scan': scheduler.trigger(rerun=True)}
+
+@app.get("/status")
+async def status():
+    return scheduler.status()
+
+# Reports are served from memory, so there is no need to go through the thread pool
 @app.get("/usn")
-def usn():
-    if not os.path.isfile("usn_stats.php"):
+async def usn(request: Request):
+    body = reports['usn'].current()
+    if body is None:
         return "BEING GENERATED"
-    with open("usn_stats.php", "r") as myFile:
-        contents = myFile.read()
-        print ('CONTENTS: %s' % contents)
-        return Response(content=contents)
+    return body.response(request)
 
 @app.get("/cve")
-def cve():
-    if not os.path.isfile("cve_stats.php"):
+async def cve(request: Request):
+    body = reports['cve'].current()
+    if body is None:
+        return "BEING GENERATED"
+    return body.response(request)
+
+# The results of the last scan, as JSON
+# since=[scan_id] only returns what changed after that scan, see ScanResults.query
+@app.get("/api/summary")
+async def apiSummary(version: str = None):
+    current = results.current()
+    if current is None:
         return "BEING GENERATED"
-    with open("cve_stats.php", "r") as myFile:
-        contents = myFile.read()
-        return Response(content=contents, status_code=200)
+    summary = dict(current.summary)
+    if version:
+        summary['versions'] = dict((key, value) for key, value in summary['versions'].items()
+            if key in version.split(','))
+        summary['components'] = dict((key, value) for key, value in summary['components'].items()
+            if key == 'total' or key in version.split(','))
+        summary['attribution'] = dict((key, value) for key, value in summary['attribution'].items()
+            if key == 'total' or key in version.split(','))
+    return summary
+
+@app.get("/api/usns")
+async def apiUsns(version: str = None, severity: str = None, result: str = None, since: int = None,
+        offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE)):
+    current = results.current()
+    if current is None:
+        return "BEING GENERATED"
+    return current.query('usn', {'version': version, 'severity': severity, 'result': result}, since, offset, limit)
+
+@app.get("/api/cves")
+async def apiCves(severity: str = None, since: int = None,
+        offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=MAX_PAGE)):
+    current = results.current()
+    if current is None:
+        return "BEING GENERATED"
+    return current.query('cve', {'severity': severity}, since, offset, limit)
+
+# The figures of the last scan and of the server, in the Prometheus text format
+@app.get("/metrics")
+async def prometheusMetrics():
+    lines = []
+    last = metrics.current()
+    if last is not None:
+        lines += metricLines('oval_scan_last_finished_timestamp_seconds', 'End of the last scan', 'gauge',
+            [((), last['finished'])])
+        lines += metricLines('oval_scan_duration_seconds', 'Duration of the last scan', 'gauge', [((), last['seconds'])])
+        lines += metricLines('oval_scan_stage_duration_seconds', 'Duration of each stage of the last scan', 'gauge',
+            [((('stage', stage),), span['seconds']) for stage, span in last['stage'].items()])
+        lines += metricLines('oval_scan_download_duration_seconds', 'Time spent updating the feeds of each distro',
+            'gauge', [((('distro', distro),), span['seconds']) for distro, span in last['download'].items()])
+        lines += metricLines('oval_scan_evaluation_duration_seconds', 'Time spent evaluating each version', 'gauge',
+            [((('engine', engine), ('version', version)), span['seconds'])
+                for engine in ('oscap', 'native') for version, span in last[engine].items()])
+        lines += metricLines('oval_scan_oscap_cpu_seconds', 'CPU time used by oscap during the last scan', 'gauge',
+            [((), last['oscap_cpu_seconds'])])
+        lines += metricLines('oval_scan_cpu_seconds', 'CPU time used by the last scan itself', 'gauge',
+            [((), last['cpu_seconds'])])
+        lines += metricLines('oval_scan_failed', 'Whether the last scan failed', 'gauge', [((), int(last.get('failed', False)))])
+        lines += metricLines('oval_scan_peak_rss_bytes',
+            'Peak RSS of the scan process since it started and of its largest child so far', 'gauge',
+            [((('process', 'scan'),), last['peak_rss_kb'] * 1024), ((('process', 'child'),), last['children_peak_rss_kb'] * 1024)])
+        lines += metricLines('oval_scan_downloaded_bytes', 'Bytes downloaded by the last scan', 'gauge',
+            [((), last['downloaded_bytes'])])
+        lines += metricLines('oval_scan_versions', 'Versions of the last scan, by origin of their results', 'gauge',
+            [((('origin', 'cache'),), last.get('cached_versions')), ((('origin', 'evaluated'),), last.get('evaluated_versions'))])
+    status = scheduler.status()
+    lines += metricLines('oval_scan_running', 'Whether a scan is running', 'gauge',
+        [((), 1 if status['state'] == 'running' else 0)])
+    if status['worker'] is not None:
+        lines += metricLines('oval_scan_worker_startup_seconds', 'Time the resident scan worker took to be ready',
+            'gauge', [((), status['worker']['startup_seconds'])])
+        lines += metricLines('oval_scan_worker_scans', 'Scans run by the current resident scan worker', 'gauge',
+            [((), status['worker']['scans'])])
+        lines += metricLines('oval_scan_worker_last_scan_seconds', 'Duration of the last scan, as measured by the worker',
+            'gauge', [((), status['worker']['last_scan_seconds'])])
+    lines += latencies.lines('oval_http_request_duration_seconds')
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
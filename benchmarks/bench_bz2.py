@@ -0,0 +1,82 @@
+#!/bin/env python3
+
+# Compares the streaming bz2 decompression of the feeds with the decompression of their
+# blocks in parallel (see bz2par) on a synthetic CVE feed: wall time, CPU time, throughput
+# and identical output.
+#
+#   python3 benchmarks/bench_bz2.py --definitions 50000 --jobs 1,2,4
+#
+# The compressed feed is read from memory in chunks, like a download, and decompressed to a
+# file in the same directory.
+
+import argparse, bz2, hashlib, os, random, resource, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'security-scan'))
+
+from synthetic import writeCVEFeed
+import bz2par
+
+def chunksOf(data, size=bz2par.CHUNK_SIZE):
+	return (data[offset:offset + size] for offset in range(0, len(data), size))
+
+def cpuSeconds():
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+# Decompresses data with jobs threads, 0 meaning the streaming decompression
+def run(data, jobs, output):
+	with open(output, 'w+b') as out:
+		if jobs == 0:
+			bz2par.decompressStream(chunksOf(data), out)
+		else:
+			decompressor = bz2par.ParallelDecompressor(out, jobs)
+			try:
+				for chunk in chunksOf(data):
+					decompressor.feed(chunk)
+				decompressor.finish()
+			finally:
+				decompressor.close()
+	with open(output, 'rb') as result:
+		return hashlib.sha256(result.read()).hexdigest()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark parallel bz2 decompression')
+	parser.add_argument('--definitions', type=int, default=50000)
+	parser.add_argument('--level', type=int, default=9, help='bzip2 block size, in 100k (default: %(default)s)')
+	parser.add_argument('--jobs', default='1,2,4', help='thread counts to compare with the streaming decompression')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--digest-bits', type=int, default=256, help='random bits added after every definition')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as workdir:
+		feed = os.path.join(workdir, 'feed.xml')
+		writeCVEFeed(feed, args.definitions)
+		with open(feed, 'rb') as source:
+			parts = source.read().split(b'</definition>\n')
+		# The synthetic feed is far more repetitive than the real ones: a random digest after
+		# every definition makes it compress about as badly as they do
+		rng = random.Random(0)
+		content = b''.join(part + b'</definition><!-- %x -->\n' % rng.getrandbits(args.digest_bits)
+			for part in parts[:-1]) + parts[-1]
+		data = bz2.compress(content, args.level)
+		size = len(content)
+		print ('Feed: %d definitions, %.1f MB, %.1f MB compressed, %d blocks, %d CPUs' % (args.definitions,
+			size / 1e6, len(data) / 1e6, sum(1 for (bit, magic) in bz2par.findMagics(data) if magic == bz2par.BLOCK_MAGIC),
+			len(os.sched_getaffinity(0))))
+
+		digests = set()
+		output = os.path.join(workdir, 'out.xml')
+		for jobs in [0] + [int(jobs) for jobs in args.jobs.split(',')]:
+			timings = []
+			for repeat in range(args.repeat):
+				(start, cpu) = (time.perf_counter(), cpuSeconds())
+				digests.add(run(data, jobs, output))
+				timings.append((time.perf_counter() - start, cpuSeconds() - cpu))
+			(elapsed, cpu) = min(timings)
+			print ('%-10s %8.3f s %8.3f s CPU %8.1f MB/s' % ('stream' if jobs == 0 else '%d threads' % jobs,
+				elapsed, cpu, size / 1e6 / elapsed))
+		if len(digests) > 1:
+			print ('MISMATCH between the decompressed outputs')
+			sys.exit(1)
+		print ('Outputs are identical')
@@ -0,0 +1,89 @@
+#!/bin/env python3
+
+# Compares the streaming analyzeOscapOciReport against the previous BeautifulSoup
+# implementation on a synthetic oscap report: wall time, peak RSS and identical output.
+#
+#   python3 benchmarks/bench_oscap_report.py --definitions 20000
+#
+# Each parser runs in its own child process, which reports its own peak RSS.
+
+import argparse, json, os, resource, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'security-scan'))
+sys.path.insert(0, os.path.join(HERE, '..', 'snap-manifests'))
+
+from synthetic import writeOscapReport
+
+# The implementation analyzeOscapOciReport had before it was made streaming
+def analyzeOscapOciReportSoup(filename):
+	from bs4 import BeautifulSoup
+	usnMap = {}
+	resultMap = {}
+	xmlFile = open(filename, 'r')
+	contents = xmlFile.read()
+	soup = BeautifulSoup(contents, 'xml')
+	results = soup.find('results')
+	definitions = soup.find('definitions')
+	defs = definitions.find_all('definition')
+
+	resultDefs = results.find_all('definition')
+	for result in resultDefs:
+		resultMap[result['definition_id']] = result['result']
+
+	for definition in defs:
+		title = definition.find('title').text
+		parts = title.split(' -- ')
+		severity = definition.find('severity').text
+		cves = []
+		for cve in definition.find_all('cve'):
+			cves.append(cve.text)
+		usnMap[parts[0]]= {'id':definition['id'],
+			'result': resultMap[definition['id']],
+			'severity': severity, 'cve':cves}
+
+	return usnMap
+
+def runParser(engine, filename, output):
+	if engine == 'soup':
+		usnMap = analyzeOscapOciReportSoup(filename)
+	else:
+		from security_scan import analyzeOscapOciReport
+		usnMap = analyzeOscapOciReport(filename)
+	with open(output, 'w') as out:
+		json.dump(list(usnMap.items()), out)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark oscap report parsing')
+	parser.add_argument('--definitions', type=int, default=20000)
+	parser.add_argument('--engines', default='stream,soup')
+	parser.add_argument('--run', help=argparse.SUPPRESS)
+	parser.add_argument('--report', help=argparse.SUPPRESS)
+	parser.add_argument('--output', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.run:
+		runParser(args.run, args.report, args.output)
+		print (json.dumps({'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+		sys.exit(0)
+
+	with tempfile.TemporaryDirectory() as workdir:
+		report = os.path.join(workdir, 'report.xml')
+		writeOscapReport(report, args.definitions)
+		print ('Report: %d definitions, %.1f MB' % (args.definitions, os.path.getsize(report) / 1e6))
+		outputs = {}
+		for engine in args.engines.split(','):
+			output = os.path.join(workdir, '%s.json' % engine)
+			start = time.perf_counter()
+			child = subprocess.run([sys.executable, __file__, '--run', engine, '--report', report, '--output', output],
+				stdout=subprocess.PIPE, check=True)
+			elapsed = time.perf_counter() - start
+			rss = json.loads(child.stdout.decode().strip().splitlines()[-1])['maxrss_kb']
+			print ('%-8s %8.2f s %10.1f MB peak RSS' % (engine, elapsed, rss / 1024))
+			with open(output) as result:
+				outputs[engine] = result.read()
+		if len(set(outputs.values())) > 1:
+			print ('MISMATCH between engines: %s' % ', '.join(outputs.keys()))
+			sys.exit(1)
+		elif len(outputs) > 1:
+			print ('Outputs are identical')
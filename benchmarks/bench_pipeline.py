@@ -0,0 +1,195 @@
+#!/bin/env python3
+
+# Benchmarks every stage of the scan pipeline on synthetic data of growing size:
+# wall time, peak RSS and throughput per stage, written to a JSON file so that runs of
+# different revisions can be compared.
+#
+#   python3 benchmarks/bench_pipeline.py --sizes 1000,10000,50000,200000 --output before.json
+#   python3 benchmarks/bench_pipeline.py --sizes 1000,10000,50000,200000 --compare before.json
+#
+# Everything runs offline. Each stage runs in its own child process, which reports the
+# time spent in the stage itself (inputs are prepared outside of the timed part), its
+# RSS before the stage and its peak RSS.
+
+import argparse, json, os, platform, resource, shutil, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'security-scan'))
+sys.path.insert(0, os.path.join(HERE, '..', 'snap-manifests'))
+
+from synthetic import writeOscapReport, writeCVEFeed, writeUsnFeed, writePkgFeed, writeManifest, writeSnapTree
+
+# Number of versions (snaps) the per-version stages work on
+VERSIONS = 5
+# Packages in each synthetic snap, and snaps per definition
+SNAP_PACKAGES = 500
+DEFINITIONS_PER_SNAP = 1000
+
+STAGES = ['cve_index', 'component_index', 'oscap_report', 'native_eval', 'generate_data', 'get_totals', 'cve_totals',
+	'compact_data', 'compact_totals', 'compact_cve_totals', 'attribution', 'usn_stats', 'snap_manifest']
+
+# Input files of a size, generated the first time a stage needs them
+def inputFile(workdir, kind, size):
+	filename = os.path.join(workdir, '%s.%d' % (kind, size))
+	if os.path.exists(filename):
+		return filename
+	if kind == 'report':
+		writeOscapReport(filename, size)
+	elif kind == 'cve':
+		writeCVEFeed(filename, size)
+	elif kind == 'usn':
+		writeUsnFeed(filename, size)
+	elif kind == 'pkg':
+		writePkgFeed(filename, size)
+	elif kind == 'manifest':
+		writeManifest(filename, 400)
+	elif kind == 'snaps':
+		writeSnapTree(filename, max(1, size // DEFINITIONS_PER_SNAP), SNAP_PACKAGES)
+	return filename
+
+# One USN map per version: the report's, with the verdicts shifted so that versions differ
+def versionMaps(report):
+	from security_scan import analyzeOscapOciReport
+	usnMap = analyzeOscapOciReport(report)
+	maps = {}
+	for version in range(VERSIONS):
+		maps['snap%d' % version] = dict((usn, dict(data, result='true' if (index + version) % 10 == 0 else 'false'))
+			for index, (usn, data) in enumerate(usnMap.items()))
+	return maps
+
+# The same versions as versionMaps, in the compact form (see compact.py), built without the
+# dict maps so that the baseline RSS of the stages compares the two representations
+def compactMaps(report):
+	from security_scan import analyzeOscapOciReport
+	from compact import Catalog
+	catalog = Catalog()
+	rows = [(data['id'], catalog.add(usn, data['id'], data['severity'], data['cve']))
+		for usn, data in analyzeOscapOciReport(report).items()]
+	maps = [catalog.fromResults(rows, dict((id, 'true' if (index + version) % 10 == 0 else 'false')
+		for index, (id, row) in enumerate(rows))) for version in range(VERSIONS)]
+	return (catalog, maps)
+
+# Runs one stage in this process: returns the number of items it processed, the time it took,
+# and the RSS before it started. The inputs are prepared before the clock starts
+def runStage(stage, size, workdir):
+	import security_scan
+	items = size
+	if stage == 'cve_index':
+		from feed_index import CVEIndex
+		feed = inputFile(workdir, 'cve', size)
+		index = CVEIndex(os.path.join(tempfile.mkdtemp(dir=workdir), 'feed_index.db'))
+		work = lambda: index.load('jammy', feed)
+	elif stage == 'component_index':
+		from feed_index import ComponentIndex
+		feed = inputFile(workdir, 'pkg', size)
+		index = ComponentIndex(os.path.join(tempfile.mkdtemp(dir=workdir), 'feed_index.db'))
+		work = lambda: index.components('jammy', feed)
+	elif stage == 'oscap_report':
+		report = inputFile(workdir, 'report', size)
+		work = lambda: security_scan.analyzeOscapOciReport(report)
+	elif stage == 'native_eval':
+		from oval_eval import OvalEvaluator, readManifest
+		feed = inputFile(workdir, 'usn', size)
+		manifest = readManifest(inputFile(workdir, 'manifest', size))
+		work = lambda: OvalEvaluator(feed).evaluate(manifest)
+	elif stage == 'snap_manifest':
+		import snap_manifest
+		snap_manifest.SNAPDIR = inputFile(workdir, 'snaps', size)
+		snaps = sorted(os.listdir(snap_manifest.SNAPDIR))
+		items = len(snaps) * SNAP_PACKAGES
+		work = lambda: [snap_manifest.parse_snap_manifest(snap) for snap in snaps]
+	elif stage.startswith('compact_'):
+		(catalog, maps) = compactMaps(inputFile(workdir, 'report', size))
+		items = size * VERSIONS
+		if stage == 'compact_data':
+			work = lambda: [catalog.generateData(compactMap) for compactMap in maps]
+		elif stage == 'compact_totals':
+			work = lambda: catalog.generateData(catalog.totals(maps))
+		elif stage == 'compact_cve_totals':
+			work = lambda: catalog.cveTotals(maps)
+	else:
+		maps = versionMaps(inputFile(workdir, 'report', size))
+		items = size * VERSIONS
+		if stage == 'generate_data':
+			work = lambda: [security_scan.generateData(usnMap) for usnMap in maps.values()]
+		elif stage == 'get_totals':
+			work = lambda: security_scan.generateData(security_scan.getTotals(maps))
+		elif stage == 'cve_totals':
+			work = lambda: security_scan.getCVETotalsFromUSNs(maps)
+		elif stage == 'attribution':
+			from oval_eval import OvalEvaluator, readManifest
+			definitionPackages = OvalEvaluator(inputFile(workdir, 'usn', size)).definitionPackages()
+			manifest = readManifest(inputFile(workdir, 'manifest', size))
+			work = lambda: [security_scan.generateAttributionData(usnMap, security_scan.getUsnPackages(usnMap,
+				definitionPackages, security_scan.indexProvenance(manifest))) for usnMap in maps.values()]
+		elif stage == 'usn_stats':
+			results = dict((version, security_scan.generateData(usnMap)) for version, usnMap in maps.items())
+			totals = security_scan.generateData(security_scan.getTotals(maps))
+			filename = os.path.join(workdir, 'usn_stats.php')
+			items = VERSIONS
+			work = lambda: security_scan.generateUSNStats(results, filename, totals)
+	baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	start = time.perf_counter()
+	work()
+	return (items, time.perf_counter() - start, baseline)
+
+def gitRevision():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark the stages of the scan pipeline')
+	parser.add_argument('--sizes', default='1000,10000,50000', help='numbers of definitions, comma separated')
+	parser.add_argument('--stages', default=','.join(STAGES), help='stages to run, comma separated')
+	parser.add_argument('--output', default='bench_pipeline.json', help='where to write the results')
+	parser.add_argument('--compare', help='results of a previous run to compare against')
+	parser.add_argument('--workdir', help='where to keep the generated inputs (default: a temporary directory)')
+	parser.add_argument('--run', help=argparse.SUPPRESS)
+	parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.run:
+		with open(os.devnull, 'w') as devnull:
+			stdout = sys.stdout
+			sys.stdout = devnull
+			(items, seconds, baseline) = runStage(args.run, args.size, args.workdir)
+			sys.stdout = stdout
+		print (json.dumps({'items': items, 'seconds': seconds, 'baseline_rss_kb': baseline,
+			'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+		sys.exit(0)
+
+	previous = {}
+	if args.compare:
+		with open(args.compare) as compareFile:
+			previous = dict(((result['stage'], result['size']), result) for result in json.load(compareFile)['results'])
+
+	workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline.')
+	os.makedirs(workdir, exist_ok=True)
+	results = []
+	print ('%-18s %8s %10s %14s %10s %10s %8s' % ('stage', 'size', 'seconds', 'items/s', 'base MB', 'peak MB', 'vs'))
+	try:
+		for size in [int(size) for size in args.sizes.split(',')]:
+			for stage in args.stages.split(','):
+				child = subprocess.run([sys.executable, __file__, '--run', stage, '--size', str(size), '--workdir', workdir],
+					stdout=subprocess.PIPE, check=True)
+				measure = json.loads(child.stdout.decode().strip().splitlines()[-1])
+				result = {'stage': stage, 'size': size, 'items': measure['items'], 'seconds': measure['seconds'],
+					'items_per_second': measure['items'] / measure['seconds'] if measure['seconds'] else None,
+					'baseline_rss_mb': measure['baseline_rss_kb'] / 1024, 'peak_rss_mb': measure['peak_rss_kb'] / 1024}
+				results.append(result)
+				versus = ''
+				if (stage, size) in previous and previous[(stage, size)]['seconds']:
+					versus = '%.2fx' % (result['seconds'] / previous[(stage, size)]['seconds'])
+				print ('%-18s %8d %10.3f %14.0f %10.1f %10.1f %8s' % (stage, size, result['seconds'],
+					result['items_per_second'] or 0, result['baseline_rss_mb'], result['peak_rss_mb'], versus))
+	finally:
+		if not args.workdir:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+	with open(args.output, 'w') as outputFile:
+		json.dump({'revision': gitRevision(), 'python': platform.python_version(), 'machine': platform.machine(),
+			'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, outputFile, indent=1)
+	print ('Results written to %s' % args.output)
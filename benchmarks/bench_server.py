@@ -0,0 +1,141 @@
+#!/bin/env python3
+
+# Load test of the report endpoints of the server (app/main.py) against the handlers it had
+# before reports were kept in memory: requests per second, latency percentiles and bytes
+# sent, for plain requests, compressed requests and revalidations (If-None-Match).
+#
+#   python3 benchmarks/bench_server.py --seconds 5 --clients 8
+#
+# Both servers run under uvicorn in their own process, on reports generated by security_scan.py
+# from synthetic stats (or on the reports found in --reports).
+
+import argparse, contextlib, http.client, os, shutil, subprocess, sys, tempfile, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'security-scan'))
+sys.path.insert(0, os.path.join(HERE, '..', 'snap-manifests'))
+
+from fastapi import FastAPI, Response
+from synthetic import writeCVEFeed, SEVERITIES
+
+# The handlers the server had before reports were kept in memory
+legacyApp = FastAPI()
+
+@legacyApp.get("/usn")
+def legacyUsn():
+	if not os.path.isfile("usn_stats.php"):
+		return "BEING GENERATED"
+	with open("usn_stats.php", "r") as myFile:
+		contents = myFile.read()
+		print ('CONTENTS: %s' % contents)
+		return Response(content=contents)
+
+@legacyApp.get("/cve")
+def legacyCve():
+	if not os.path.isfile("cve_stats.php"):
+		return "BEING GENERATED"
+	with open("cve_stats.php", "r") as myFile:
+		contents = myFile.read()
+		return Response(content=contents, status_code=200)
+
+SCENARIOS = {
+	'plain': {},
+	'compressed': {'Accept-Encoding': 'gzip, deflate, br'},
+	'revalidate': {'Accept-Encoding': 'gzip, deflate, br'},
+}
+
+def writeReports(directory, versions):
+	from security_scan import generateData, generateUSNStats, generateCVEStats
+	from feed_index import CVEIndex
+	maps = {}
+	for version in range(versions):
+		maps['snap%d' % version] = dict(('USN-%d-1' % index, {'id': 'oval:%d' % index,
+			'result': 'true' if (index + version) % 9 == 0 else 'false',
+			'severity': SEVERITIES[index % len(SEVERITIES)], 'cve': []}) for index in range(2000))
+	results = dict((version, generateData(usnMap)) for version, usnMap in maps.items())
+	totals = generateData(dict(item for usnMap in maps.values() for item in usnMap.items()))
+	generateUSNStats(results, os.path.join(directory, 'usn_stats.php'), totals)
+	feed = os.path.join(directory, 'cve.oval.xml')
+	writeCVEFeed(feed, 2000)
+	cves = CVEIndex(os.path.join(directory, 'feed_index.db'))
+	cves.load('jammy', feed)
+	with contextlib.redirect_stdout(None):
+		generateCVEStats([row[0] for row in cves.db.execute('SELECT cve FROM cves')], cves,
+			os.path.join(directory, 'cve_stats.php'))
+
+def startServer(application, appDir, directory, port):
+	env = dict(os.environ, SNAP_DATA=directory)
+	server = subprocess.Popen([sys.executable, '-m', 'uvicorn', '--app-dir', appDir, '--port', str(port),
+		'--log-level', 'warning', application], cwd=directory, env=env, stdout=subprocess.DEVNULL)
+	for attempt in range(100):
+		try:
+			connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+			connection.request('GET', '/usn')
+			connection.getresponse().read()
+			return server
+		except OSError:
+			time.sleep(0.1)
+	server.kill()
+	raise RuntimeError('%s did not start' % application)
+
+def client(port, path, headers, deadline, latencies, sizes):
+	connection = http.client.HTTPConnection('127.0.0.1', port)
+	while time.perf_counter() < deadline:
+		start = time.perf_counter()
+		connection.request('GET', path, headers=headers)
+		response = connection.getresponse()
+		body = response.read()
+		latencies.append(time.perf_counter() - start)
+		sizes.append(len(body))
+
+def load(port, path, scenario, clients, seconds):
+	headers = dict(SCENARIOS[scenario])
+	if scenario == 'revalidate':
+		connection = http.client.HTTPConnection('127.0.0.1', port)
+		connection.request('GET', path, headers=headers)
+		response = connection.getresponse()
+		response.read()
+		if response.getheader('ETag'):
+			headers['If-None-Match'] = response.getheader('ETag')
+	latencies = []
+	sizes = []
+	deadline = time.perf_counter() + seconds
+	threads = [threading.Thread(target=client, args=(port, path, headers, deadline, latencies, sizes))
+		for index in range(clients)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	latencies.sort()
+	return (len(latencies) / seconds, latencies[len(latencies) // 2] * 1000,
+		latencies[int(len(latencies) * 0.99)] * 1000, sum(sizes) / len(sizes))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Load test the report endpoints of the server')
+	parser.add_argument('--seconds', type=float, default=5)
+	parser.add_argument('--clients', type=int, default=8)
+	parser.add_argument('--versions', type=int, default=5, help='rows of the synthetic USN report')
+	parser.add_argument('--reports', help='directory holding usn_stats.php and cve_stats.php to serve instead')
+	parser.add_argument('--port', type=int, default=4142)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as workdir:
+		if args.reports:
+			for name in ('usn_stats.php', 'cve_stats.php'):
+				shutil.copy(os.path.join(args.reports, name), workdir)
+		else:
+			writeReports(workdir, args.versions)
+		print ('usn_stats.php %d bytes, cve_stats.php %d bytes' % (os.path.getsize(os.path.join(workdir, 'usn_stats.php')),
+			os.path.getsize(os.path.join(workdir, 'cve_stats.php'))))
+		servers = [('legacy', 'bench_server:legacyApp', HERE), ('memory', 'main:app', os.path.join(HERE, '..', 'app'))]
+		print ('%-8s %-5s %-11s %10s %9s %9s %10s' % ('server', 'path', 'scenario', 'req/s', 'p50 ms', 'p99 ms', 'bytes/req'))
+		for name, application, appDir in servers:
+			server = startServer(application, appDir, workdir, args.port)
+			try:
+				for path in ('/usn', '/cve'):
+					for scenario in SCENARIOS.keys():
+						(rate, p50, p99, size) = load(args.port, path, scenario, args.clients, args.seconds)
+						print ('%-8s %-5s %-11s %10.0f %9.2f %9.2f %10.0f' % (name, path, scenario, rate, p50, p99, size))
+			finally:
+				server.terminate()
+				server.wait()
@@ -0,0 +1,74 @@
+#!/bin/env python3
+
+# Differential check of the built-in OVAL evaluator against oscap.
+# Both engines evaluate the same manifests against the same feed and every definition
+# verdict is compared. Without arguments, synthetic fixture feeds and manifests are used:
+#
+#   python3 benchmarks/compare_engines.py --definitions 5000 --manifests 5
+#
+# A real feed and manifests can be given instead:
+#
+#   python3 benchmarks/compare_engines.py --feed oci.com.ubuntu.jammy.usn.oval.xml manifest.core22 manifest.pc-kernel
+#
+# Exits with 1 if the engines disagree on any definition, 2 if oscap is not installed.
+
+import argparse, os, shutil, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'security-scan'))
+sys.path.insert(0, os.path.join(HERE, '..', 'snap-manifests'))
+
+from synthetic import writeUsnFeed, writeManifest
+from oval_eval import OvalEvaluator, readManifest, versionManifest
+from security_scan import analyzeOscapResults, compareResults
+
+def runOscap(feed, manifest, workdir):
+	with open(os.path.join(workdir, 'manifest'), 'w') as manifestFile:
+		manifestFile.write(versionManifest(readManifest(manifest)))
+	report = os.path.join(workdir, 'report.xml')
+	subprocess.run(['oscap', 'oval', 'eval', '--results', report, os.path.abspath(feed)],
+		cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+	return analyzeOscapResults(report)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compare the oscap and built-in OVAL engines')
+	parser.add_argument('--feed', help='USN OVAL feed (default: a synthetic one)')
+	parser.add_argument('--definitions', type=int, default=5000, help='size of the synthetic feed')
+	parser.add_argument('--manifests', type=int, default=5, help='number of synthetic manifests')
+	parser.add_argument('manifest', nargs='*', help='manifest files (default: synthetic ones)')
+	args = parser.parse_args()
+
+	if shutil.which('oscap') is None:
+		print ('oscap is not installed, nothing to compare against')
+		sys.exit(2)
+
+	with tempfile.TemporaryDirectory() as workdir:
+		feed = args.feed
+		if feed is None:
+			feed = os.path.join(workdir, 'oci.com.ubuntu.jammy.usn.oval.xml')
+			writeUsnFeed(feed, args.definitions)
+		manifests = args.manifest
+		if not manifests:
+			for seed in range(args.manifests):
+				manifests.append(os.path.join(workdir, 'manifest.%d' % seed))
+				writeManifest(manifests[-1], 100 + 150 * seed, seed=seed)
+
+		start = time.perf_counter()
+		evaluator = OvalEvaluator(feed)
+		print ('Compiled %s in %.2f s' % (feed, time.perf_counter() - start))
+
+		disagreements = 0
+		for manifest in manifests:
+			start = time.perf_counter()
+			native = evaluator.evaluate(readManifest(manifest))
+			nativeTime = time.perf_counter() - start
+			start = time.perf_counter()
+			oscap = runOscap(feed, manifest, workdir)
+			oscapTime = time.perf_counter() - start
+			mismatches = compareResults(oscap, native)
+			disagreements += len(mismatches)
+			print ('%s: %d definitions, %d true, native %.3f s, oscap %.2f s, %d mismatches' % (os.path.basename(manifest),
+				len(native), list(native.values()).count('true'), nativeTime, oscapTime, len(mismatches)))
+			for mismatch in mismatches[:10]:
+				print ('  %s: oscap=%s native=%s' % mismatch)
+		sys.exit(1 if disagreements else 0)
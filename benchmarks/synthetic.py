@@ -0,0 +1,205 @@
+#!/bin/env python3
+
+# Synthetic inputs for the benchmarks: they look like the real Ubuntu OVAL data
+# (same element names, namespaces and nesting) but are generated offline, at any size.
+
+import os, random
+
+DEFINITIONS_NS = 'http://oval.mitre.org/XMLSchema/oval-definitions-5'
+RESULTS_NS = 'http://oval.mitre.org/XMLSchema/oval-results-5'
+SEVERITIES = ['Critical', 'High', 'Medium', 'Low', 'Negligible', 'Unknown']
+
+def usnId(index):
+	return 'USN-%d-%d' % (1000 + index, 1 + index % 3)
+
+def cveId(index, number):
+	return 'CVE-%d-%d' % (2015 + index % 9, 10000 + 7 * index + number)
+
+def definitionId(distro, index):
+	return 'oval:com.ubuntu.%s:def:%d' % (distro, 1000000 + index)
+
+def writeUsnDefinition(out, distro, index, rng):
+	cves = ''.join(['          <cve href="https://ubuntu.com/security/%s" priority="medium" public="20220101">%s</cve>\n'
+		% (cveId(index, n), cveId(index, n)) for n in range(rng.randint(1, 6))])
+	out.write('    <definition class="patch" id="%s" version="1">\n' % definitionId(distro, index))
+	out.write('      <metadata>\n')
+	out.write('        <title>%s -- synthetic package vulnerabilities</title>\n' % usnId(index))
+	out.write('        <affected family="unix"><platform>Ubuntu</platform></affected>\n')
+	out.write('        <reference source="USN" ref_id="%s" ref_url="https://ubuntu.com/security/notices/%s"/>\n' % (usnId(index), usnId(index)))
+	out.write('        <description>Several security issues were fixed in package%d. %s</description>\n' % (index, 'Lorem ipsum dolor sit amet. ' * 6))
+	out.write('        <advisory from="security@ubuntu.com">\n')
+	out.write('          <severity>%s</severity>\n' % rng.choice(SEVERITIES))
+	out.write('          <issued date="2022-01-01"/>\n')
+	out.write(cves)
+	out.write('        </advisory>\n')
+	out.write('      </metadata>\n')
+	out.write('      <criteria>\n')
+	out.write('        <criterion test_ref="oval:com.ubuntu.%s:tst:%d" comment="Long Term Support"/>\n' % (distro, 1000000 + index))
+	out.write('      </criteria>\n')
+	out.write('    </definition>\n')
+
+# Writes what `oscap oval eval --results` produces: the evaluated definitions,
+# followed by the results section with its system characteristics
+def writeOscapReport(filename, definitions, distro='jammy', seed=0, presentRatio=0.1):
+	rng = random.Random(seed)
+	with open(filename, 'w') as out:
+		out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+		out.write('<oval_results xmlns="%s" xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5">\n' % RESULTS_NS)
+		out.write('  <generator><oval:product_name>cpe:/a:open-scap:oscap</oval:product_name></generator>\n')
+		out.write('  <directives><definition_true reported="true" content="full"/></directives>\n')
+		out.write('  <oval_definitions xmlns="%s">\n' % DEFINITIONS_NS)
+		out.write('   <definitions>\n')
+		for index in range(definitions):
+			writeUsnDefinition(out, distro, index, rng)
+		out.write('   </definitions>\n')
+		out.write('  </oval_definitions>\n')
+		out.write('  <results>\n    <system>\n      <definitions>\n')
+		for index in range(definitions):
+			result = 'true' if rng.random() < presentRatio else 'false'
+			out.write('        <definition definition_id="%s" result="%s" version="1">\n' % (definitionId(distro, index), result))
+			out.write('          <criteria operator="AND" result="%s"><criterion test_ref="oval:com.ubuntu.%s:tst:%d" version="1" result="%s"/></criteria>\n'
+				% (result, distro, 1000000 + index, result))
+			out.write('        </definition>\n')
+		out.write('      </definitions>\n      <tests>\n')
+		for index in range(definitions):
+			out.write('        <test test_id="oval:com.ubuntu.%s:tst:%d" version="1" check_existence="at_least_one_exists" check="at least one" result="false"/>\n' % (distro, 1000000 + index))
+		out.write('      </tests>\n')
+		out.write('      <oval_system_characteristics xmlns="http://oval.mitre.org/XMLSchema/oval-system-characteristics-5">\n')
+		out.write('        <collected_objects>\n')
+		for index in range(definitions):
+			out.write('          <object id="oval:com.ubuntu.%s:obj:%d" version="1" flag="does not exist"/>\n' % (distro, 1000000 + index))
+		out.write('        </collected_objects>\n')
+		out.write('      </oval_system_characteristics>\n')
+		out.write('    </system>\n  </results>\n</oval_results>\n')
+
+# Writes a com.ubuntu.[distro].cve.oval.xml look-alike, with one vulnerability definition per CVE
+def writeCVEFeed(filename, definitions, distro='jammy', seed=0):
+	rng = random.Random(seed)
+	with open(filename, 'w') as out:
+		out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+		out.write('<oval_definitions xmlns="%s" xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5">\n' % DEFINITIONS_NS)
+		out.write('  <generator><oval:product_name>Canonical CVE OVAL Generator</oval:product_name></generator>\n')
+		out.write('  <definitions>\n')
+		out.write('    <definition class="inventory" id="oval:com.ubuntu.%s:def:100" version="1">\n' % distro)
+		out.write('      <metadata><title>Check that Ubuntu is installed.</title><description/></metadata>\n')
+		out.write('    </definition>\n')
+		for index in range(definitions):
+			cve = cveId(index, 0)
+			# Like the real feeds, the id is the CVE number followed by seven zeroes
+			out.write('    <definition class="vulnerability" id="oval:com.ubuntu.%s:def:%s0000000" version="1">\n'
+				% (distro, cve[4:].replace('-', '')))
+			out.write('      <metadata>\n')
+			out.write('        <title>%s on Ubuntu (%s) - %s.</title>\n' % (cve, distro, 'medium'))
+			out.write('        <description>A flaw was found in package%d. %s</description>\n' % (index, 'Lorem ipsum dolor sit amet. ' * 10))
+			out.write('        <advisory>\n')
+			out.write('          <severity>%s</severity>\n' % rng.choice(SEVERITIES))
+			out.write('          <rights>Copyright (C) Canonical Ltd.</rights>\n')
+			out.write('          <public_date>2022-0%d-1%d 12:00:00 UTC</public_date>\n' % (1 + index % 9, index % 10))
+			out.write('          <bug>https://launchpad.net/bugs/%d</bug>\n' % (1900000 + index))
+			out.write('        </advisory>\n')
+			out.write('      </metadata>\n')
+			out.write('      <criteria><criterion test_ref="oval:com.ubuntu.%s:tst:%d" comment="package%d package in %s is affected and needs fixing."/></criteria>\n'
+				% (distro, 2000000 + index, index, distro))
+			out.write('    </definition>\n')
+		out.write('  </definitions>\n')
+		out.write('</oval_definitions>\n')
+
+def packageName(index):
+	return 'package%d' % index
+
+def fixedVersion(index):
+	return '1.%d-0ubuntu%d' % (index % 13, 1 + index % 5)
+
+# Writes a oci.com.ubuntu.[distro].usn.oval.xml look-alike: every definition has a textfilecontent54
+# test matching a few binary packages of the manifest against their fixed version
+def writeUsnFeed(filename, definitions, distro='jammy', seed=0, packages=2000):
+	rng = random.Random(seed)
+	binaries = random.Random(seed + 1)
+	prefix = 'oval:com.ubuntu.%s' % distro
+	with open(filename, 'w') as out:
+		out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+		out.write('<oval_definitions xmlns="%s" xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5"'
+			' xmlns:ind-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#independent">\n' % DEFINITIONS_NS)
+		out.write('  <generator><oval:product_name>Canonical USN OVAL Generator</oval:product_name></generator>\n')
+		out.write('  <definitions>\n')
+		for index in range(definitions):
+			writeUsnDefinition(out, distro, index, rng)
+		out.write('  </definitions>\n  <tests>\n')
+		for index in range(definitions):
+			out.write('    <ind-def:textfilecontent54_test check="at least one" check_existence="at_least_one_exists" id="%s:tst:%d" version="1" comment="Long Term Support">\n'
+				% (prefix, 1000000 + index))
+			out.write('      <ind-def:object object_ref="%s:obj:%d"/>\n' % (prefix, 1000000 + index))
+			out.write('      <ind-def:state state_ref="%s:ste:%d"/>\n' % (prefix, 1000000 + index))
+			out.write('    </ind-def:textfilecontent54_test>\n')
+		out.write('  </tests>\n  <objects>\n')
+		for index in range(definitions):
+			out.write('    <ind-def:textfilecontent54_object id="%s:obj:%d" version="1">\n' % (prefix, 1000000 + index))
+			out.write('      <ind-def:path>.</ind-def:path>\n')
+			out.write('      <ind-def:filename>manifest</ind-def:filename>\n')
+			out.write('      <ind-def:pattern operation="pattern match" datatype="string" var_ref="%s:var:%d" var_check="at least one"/>\n' % (prefix, 1000000 + index))
+			out.write('      <ind-def:instance operation="greater than or equal" datatype="int">1</ind-def:instance>\n')
+			out.write('    </ind-def:textfilecontent54_object>\n')
+		out.write('  </objects>\n  <states>\n')
+		for index in range(definitions):
+			out.write('    <ind-def:textfilecontent54_state id="%s:ste:%d" version="1">\n' % (prefix, 1000000 + index))
+			out.write('      <ind-def:subexpression datatype="debian_evr_string" operation="less than">%s</ind-def:subexpression>\n' % fixedVersion(index))
+			out.write('    </ind-def:textfilecontent54_state>\n')
+		out.write('  </states>\n  <variables>\n')
+		for index in range(definitions):
+			out.write('    <constant_variable id="%s:var:%d" version="1" datatype="string" comment="Binaries">\n' % (prefix, 1000000 + index))
+			for binary in range(binaries.randint(1, 4)):
+				out.write('      <value>^%s(?::\\w+|)\\s+(.*)$</value>\n' % packageName(binaries.randrange(packages)))
+			out.write('    </constant_variable>\n')
+		out.write('  </variables>\n</oval_definitions>\n')
+
+# Writes a oci.com.ubuntu.[distro].pkg.oval.xml look-alike: one definition per source package,
+# with its component and the CVEs of the USNs of writeUsnFeed that are about it
+def writePkgFeed(filename, definitions, distro='jammy', seed=0, packages=500):
+	rng = random.Random(seed)
+	usnsOf = {}
+	for index in range(definitions):
+		usnsOf.setdefault(index % packages, []).append(index)
+	with open(filename, 'w') as out:
+		out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+		out.write('<oval_definitions xmlns="%s" xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5">\n' % DEFINITIONS_NS)
+		out.write('  <generator><oval:product_name>Canonical Package OVAL Generator</oval:product_name></generator>\n')
+		out.write('  <definitions>\n')
+		for package in sorted(usnsOf.keys()):
+			out.write('    <definition class="vulnerability" id="oval:com.ubuntu.%s:def:%d" version="1">\n' % (distro, 3000000 + package))
+			out.write('      <metadata>\n')
+			out.write('        <title>source%d</title>\n' % package)
+			out.write('        <reference source="Package" ref_id="source%d" ref_url="https://launchpad.net/ubuntu/+source/source%d"/>\n' % (package, package))
+			out.write('        <description>Synthetic source package</description>\n')
+			out.write('        <advisory>\n')
+			out.write('          <rights>Copyright (C) Canonical Ltd.</rights>\n')
+			out.write('          <component>%s</component>\n' % rng.choice(['main'] * 6 + ['universe'] * 3 + ['multiverse', 'restricted']))
+			for index in usnsOf[package]:
+				out.write('          <cve href="https://ubuntu.com/security/%s" severity="medium" public="20220101" usns="%s">%s</cve>\n'
+					% (cveId(index, 0), usnId(index)[4:], cveId(index, 0)))
+			out.write('        </advisory>\n')
+			out.write('      </metadata>\n')
+			out.write('      <criteria><criterion test_ref="oval:com.ubuntu.%s:tst:%d" comment="source%d package in %s is affected"/></criteria>\n'
+				% (distro, 3000000 + package, package, distro))
+			out.write('    </definition>\n')
+		out.write('  </definitions>\n')
+		out.write('</oval_definitions>\n')
+
+# Writes a manifest.[version] file like snap_manifest.py does: "package version snap" lines
+def writeManifest(filename, packages, snap='core22', seed=0, universe=2000):
+	rng = random.Random(seed)
+	with open(filename, 'w') as out:
+		for index in sorted(rng.sample(range(universe), min(packages, universe))):
+			out.write('%s %s %s\n' % (packageName(index), fixedVersion(rng.randrange(universe)), snap))
+
+# Writes a /snap look-alike under root: snaps snap0..snapN, each with a `current` revision
+# and a usr/share/snappy/dpkg.yaml listing its packages, like the bases have
+def writeSnapTree(root, snaps, packages, seed=0, universe=2000):
+	rng = random.Random(seed)
+	for snap in range(snaps):
+		directory = os.path.join(root, 'snap%d' % snap, str(100 + snap), 'usr', 'share', 'snappy')
+		os.makedirs(directory)
+		os.symlink(str(100 + snap), os.path.join(root, 'snap%d' % snap, 'current'))
+		with open(os.path.join(directory, 'dpkg.yaml'), 'w') as out:
+			out.write('packages:\n')
+			for index in sorted(rng.sample(range(universe), min(packages, universe))):
+				out.write('- %s=%s\n' % (packageName(index), fixedVersion(rng.randrange(universe))))
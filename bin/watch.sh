@@ -0,0 +1,4 @@
+#!/bin/bash
+cd $SNAP_DATA
+echo Watching from $SNAP_DATA
+exec python3 $SNAP/bin/security_scan.py --watch
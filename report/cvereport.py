@@ -0,0 +1,206 @@
+#!/bin/env python3
+#
+# Copyright (C) 2023 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Python version of cvereport.sh, producing the same cve-list-* and cve-summary-* files.
+# The open CVEs of each manifest are read from the oscap results in one pass, and their
+# priority, packages and description come from a local index of the CVE OVAL feed that
+# oscap evaluates (see feed_index.CVEIndex) instead of one ubuntu.com request per CVE.
+# Once the feeds are downloaded, --offline reports without any network access.
+
+import argparse, json, os, shutil, subprocess, sys, time
+from snap_manifest import main as refreshManifests
+from oval_stream import iterElements
+from feed_index import CVEIndex
+from downloader import OVAL_BASE_URL, downloadFile
+
+GREEN = '\033[38;2;0;255;0m'
+BLUE = '\033[38;2;0;160;200m'
+RED = '\033[38;2;255;0;0m'
+BOLD = '\033[1m'
+RESET = '\033[0m'
+
+DISTROS = {'manifest.core': 'xenial', 'manifest.snapd': 'xenial', 'manifest.core18': 'bionic',
+	'manifest.core20': 'focal', 'manifest.core22': 'jammy'}
+
+# Priorities that are always listed, and those listed only when asked for
+PRIORITIES = ['critical', 'high', 'medium', 'low', 'negligible']
+ALWAYS_LISTED = ['critical', 'high']
+
+def info(message):
+	print ('\033[2G - %sINFO%s: %s' % (BLUE, RESET, message))
+
+def success(message):
+	print ('\033[2G - %sSUCCESS%s: %s' % (GREEN, RESET, message))
+
+def error(message):
+	print ('\033[2G - %sERROR%s: %s' % (RED, RESET, message))
+
+# oval:com.ubuntu.jammy:def:202312345000000 -> CVE-2023-12345
+def cveFromDefinitionId(definitionId):
+	number = definitionId.split(':')[3]
+	return 'CVE-%s-%s' % (number[:4], number[4:-7])
+
+# The ids of the definitions oscap found true, in the order of the results file
+def trueDefinitions(resultFile):
+	return [element.get('definition_id') for path, element in iterElements(resultFile, ['definition'])
+		if 'results' in path and element.get('result') == 'true']
+
+# Makes sure the CVE feed of distro is in ovalDir and indexed, returns its path or None
+def prepareFeed(distro, ovalDir, index, offline):
+	feed = os.path.join(ovalDir, 'oci.com.ubuntu.%s.cve.oval.xml' % distro)
+	if not (offline and os.path.isfile(feed)):
+		info('Downloading OVAL data for %s' % distro)
+		if not downloadFile('%s/oci.com.ubuntu.%s.cve.oval.xml.bz2' % (OVAL_BASE_URL, distro), feed):
+			if not os.path.isfile(feed):
+				info('OVAL data file for %s does not exist. Skipping' % distro)
+				return None
+			info('Could not update the OVAL data for %s, using the local copy' % distro)
+		else:
+			success('Copied OVAL data for %s to %s' % (distro, feed))
+	if not os.path.isfile(feed):
+		info('OVAL data file for %s does not exist. Skipping' % distro)
+		return None
+	index.load(distro, feed)
+	return feed
+
+def processOvalResults(definitionIds, summarySnap, distro, cveReport, cveSummary, args, index):
+	counts = dict((priority, 0) for priority in PRIORITIES)
+	cves = [cveFromDefinitionId(definitionId) for definitionId in definitionIds]
+	index.prefer(distro)
+	details = index.lookup(cves)
+	with open(cveReport, 'a') as reportFile:
+		for cve in cves:
+			print ('CVE: %s' % cve)
+			detail = details.get(cve, {})
+			priority = (detail.get('severity') or '').lower()
+			if priority not in counts:
+				continue
+			counts[priority] += 1
+			if priority not in ALWAYS_LISTED and not getattr(args, priority):
+				continue
+
+			with open(os.path.join(args.dir, '%s.%s.json' % (cve, priority)), 'w') as jsonFile:
+				json.dump({'id': cve, 'priority': priority, 'description': detail.get('description'),
+					'published': detail.get('date'), 'packages': [{'name': name} for name in detail.get('packages', [])]}, jsonFile)
+
+			line = '%s | %s | %s' % (cve, priority, ','.join(detail.get('packages', [])))
+			if args.url:
+				line += ' | <https://ubuntu.com/security/%s>' % cve
+			print ('\033[2G - %s%s%s' % (GREEN, line, RESET))
+			reportFile.write(line + '\n')
+
+	# FIXME: "CVE Summary - xenial" can show up twice (once for snapd, once for core)
+	summary = ('CVE Summary - %s\n' % summarySnap + '\n=============\n' +
+		'Critical CVEs: %d\n' % counts['critical'] + 'High CVEs: %d\n' % counts['high'] +
+		'Medium CVEs: %d\n' % counts['medium'] + 'Low CVEs: %d\n' % counts['low'] +
+		'Neglible CVEs: %d\n' % counts['negligible'])
+	print ('\n\033[2G%s%s' % (BOLD, summary.replace('\n', RESET + '\n', 1)), end='')
+	with open(cveSummary, 'a') as summaryFile:
+		summaryFile.write(summary)
+
+def processManifest(manifestFile, kernelManifest, args, ovalDir, index):
+	print ('\n\033[2GManifest file: %s' % manifestFile)
+	name = os.path.basename(manifestFile)
+	if name == 'manifest.bare':
+		print ('\n\033[2GSkipping manifest.bare; FIXME!')
+		return
+	if name not in DISTROS:
+		print ('Unsupported manifest release: %s' % manifestFile)
+		return
+	distro = DISTROS[name]
+
+	# if kernel release matches the distro then concatenate the two files so that the kernel
+	# CVEs are reported in conjunction with the corresponding core snap.
+	if args.krel == distro and kernelManifest:
+		with open(manifestFile, 'a') as manifest, open(kernelManifest, 'r') as kernel:
+			manifest.write(kernel.read())
+
+	if os.path.lexists('manifest'):
+		os.remove('manifest')
+	os.symlink(manifestFile, 'manifest')
+
+	# FIXME: goes away if .snapd & .core are combined
+	summarySnap = 'snapd' if name == 'manifest.snapd' else distro
+	resultFile = os.path.join(ovalDir, 'oscap-cve-scan-result-%s.xml' % summarySnap)
+	cveReport = os.path.join(args.dir, 'cve-list-%s.txt' % summarySnap)
+	cveSummary = os.path.join(args.dir, 'cve-summary-%s.txt' % summarySnap)
+	reportFile = []
+	if args.html:
+		reportFile = ['--report', os.path.join(ovalDir, 'oscap-cve-scan-report-%s.html' % summarySnap)]
+
+	print ('\n\033[2G%sDownload OVAL Data for CVE scanning to %s%s' % (BOLD, ovalDir, RESET))
+	feed = prepareFeed(distro, ovalDir, index, args.offline)
+	if feed is not None:
+		# Never report on the results of a previous run
+		if os.path.exists(resultFile):
+			os.remove(resultFile)
+		subprocess.run(['oscap', 'oval', 'eval', '--result', resultFile] + reportFile + [feed], stdout=subprocess.DEVNULL)
+		if os.path.isfile(resultFile):
+			processOvalResults(trueDefinitions(resultFile), summarySnap, distro, cveReport, cveSummary, args, index)
+
+	os.remove('manifest')
+
+def parseArguments():
+	parser = argparse.ArgumentParser(description='Report the open CVEs of the snaps of this system')
+	parser.add_argument('-d', '--dir', default='/tmp/core_cvereport', help='directory to store CVE Report Data')
+	parser.add_argument('-k', '--krel', default='none', help='specify kernel release')
+	parser.add_argument('-l', '--low', action='store_true', help="include 'low' priority CVEs")
+	parser.add_argument('-m', '--medium', action='store_true', help="include 'medium' priority CVEs")
+	parser.add_argument('-n', '--neglible', dest='negligible', action='store_true', help="include 'neglibile' priority CVEs")
+	parser.add_argument('-p', '--purge', action='store_true', help='purge existing CVE Report Data Dir')
+	parser.add_argument('-u', '--url', action='store_true', help='output Ubuntu CVE URL')
+	parser.add_argument('-H', '--html', action='store_true', help='generate per core snap HTML reports')
+	parser.add_argument('--offline', action='store_true', help='use the OVAL data already in the report directory, if any')
+	return parser.parse_args()
+
+if __name__ == "__main__":
+	start = time.time()
+	args = parseArguments()
+	args.dir = os.path.abspath(args.dir)
+
+	print ('\n\033[2G%sCreate CVE REPORT Data Directory%s' % (BOLD, RESET))
+	if args.purge:
+		info('Removing existing directory: %s' % args.dir)
+		shutil.rmtree(args.dir, ignore_errors=True)
+		if os.path.isdir(args.dir):
+			error('Could not remove existing directory %s' % args.dir)
+		else:
+			success('Removed existing directory %s' % args.dir)
+
+	# FIXME: these need to be per core snap!!!
+	manifestDir = os.path.join(args.dir, 'manifests')
+	ovalDir = os.path.join(args.dir, 'oval')
+	for directory in (args.dir, manifestDir, ovalDir):
+		try:
+			os.makedirs(directory, exist_ok=True)
+			success('Created directory %s' % directory)
+		except OSError:
+			error('Could not create directory %s' % directory)
+			sys.exit(1)
+
+	print ('\n\033[2G%sOpen Vulnerabilities%s\n' % (BOLD, RESET))
+	os.chdir(manifestDir)
+	refreshManifests()
+	kernels = sorted(name for name in os.listdir('.') if name.startswith('manifest.') and 'kernel' in name)
+	kernelManifest = kernels[0] if kernels else None
+
+	index = CVEIndex(os.path.join(ovalDir, 'feed_index.db'))
+	# snap_manifest.py keeps its cache next to the manifests
+	for name in sorted(os.listdir('.')):
+		if os.path.isfile(name) and name.startswith('manifest.'):
+			processManifest(os.path.join('.', name), kernelManifest, args, ovalDir, index)
+
+	print ('\n%sOVAL CVE Report completed in %s%s\n' % (BOLD, time.strftime('%H:%M:%S', time.gmtime(time.time() - start)), RESET))
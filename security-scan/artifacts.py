@@ -0,0 +1,41 @@
+#!/bin/env python3
+
+# Memoization of what is derived from the feeds of a distro.
+# Several versions map to the same distro (core22 and pc-kernel are both jammy): the feeds of
+# a distro are refreshed, and their data parsed, once per run however many versions use them.
+# What is parsed from a file can also outlive the run (see newRun): it is kept as long as the
+# file keeps the same size and mtime.
+
+import os
+
+class Artifacts:
+	def __init__(self):
+		# (kind, distro) -> ((mtime_ns, size) of the source or None, artifact)
+		self.values = {}
+		self.loads = {}
+		self.hits = {}
+
+	# Returns the artifact of that kind for distro, calling loader() only the first time,
+	# or when source, the file it is parsed from, changed since
+	def get(self, kind, distro, loader, source=None):
+		key = (kind, distro)
+		version = None
+		if source is not None:
+			stat = os.stat(source)
+			version = (stat.st_mtime_ns, stat.st_size)
+		if key in self.values and self.values[key][0] == version:
+			self.hits[kind] = self.hits.get(kind, 0) + 1
+		else:
+			self.loads[kind] = self.loads.get(kind, 0) + 1
+			self.values[key] = (version, loader())
+		return self.values[key][1]
+
+	# Starts another run: the artifacts without a source file are loaded again
+	def newRun(self):
+		self.values = dict((key, value) for key, value in self.values.items() if value[0] is not None)
+		self.loads = {}
+		self.hits = {}
+
+	def summary(self):
+		return ', '.join('%s: %d loaded, %d reused' % (kind, self.loads.get(kind, 0), self.hits.get(kind, 0))
+			for kind in sorted(set(self.loads.keys()) | set(self.hits.keys())))
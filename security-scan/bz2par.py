@@ -0,0 +1,157 @@
+#!/bin/env python3
+
+# Decompression of bz2 data on several cores.
+# A bzip2 stream is a header (BZh1 to BZh9) followed by blocks, each starting with the
+# 48 bit magic 0x314159265359 and its CRC, and ends with the magic 0x177245385090 and the
+# CRC of the stream. Blocks are not byte aligned but they do not depend on each other: each
+# block found is made a stream of its own (BZh9, the block, the end of stream magic and the
+# block CRC as the stream CRC), decompressed by a pool of threads (libbz2 runs without the
+# GIL) and written out in order. Blocks are dispatched as soon as the next magic is seen, so
+# that decompression overlaps the download.
+# The magics can also occur by chance inside compressed data: a block cut at the wrong place
+# fails to decompress (its CRC is checked), and everything is then decompressed again on one
+# core from a spooled copy of the input.
+
+import bz2, collections, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_MAGIC = 0x314159265359
+END_MAGIC = 0x177245385090
+CHUNK_SIZE = 1 << 16
+
+class BlockError(Exception):
+	pass
+
+# For each bit alignment of a 48 bit magic: (shift, bytes it spans, its value and mask over
+# these bytes, the bytes it covers entirely and the index of the first of them)
+def magicPatterns(magic):
+	patterns = []
+	for shift in range(8):
+		size = (shift + 48 + 7) // 8
+		padding = size * 8 - shift - 48
+		value = magic << padding
+		head = 1 if shift else 0
+		tail = size - 1 if padding else size
+		patterns.append((shift, size, value, ((1 << 48) - 1) << padding, value.to_bytes(size, 'big')[head:tail], head))
+	return patterns
+
+PATTERNS = [(magic, pattern) for magic in (BLOCK_MAGIC, END_MAGIC) for pattern in magicPatterns(magic)]
+
+# The magics entirely in data at bit start or after: [(bit, magic)], in order
+def findMagics(data, start=0):
+	found = []
+	for (magic, (shift, size, value, mask, covered, head)) in PATTERNS:
+		index = data.find(covered, start // 8 + head)
+		while index >= 0:
+			byte = index - head
+			if byte * 8 + shift >= start and byte + size <= len(data) and int.from_bytes(data[byte:byte + size], 'big') & mask == value:
+				found.append((byte * 8 + shift, magic))
+			index = data.find(covered, index + 1)
+	return sorted(found)
+
+# Decompresses the block between bits start and end of chunk (its magic to the next one)
+def decompressBlock(chunk, start, end):
+	bits = end - start
+	block = int.from_bytes(chunk, 'big') >> (len(chunk) * 8 - end) & ((1 << bits) - 1)
+	crc = block >> (bits - 80) & 0xffffffff
+	stream = (block << 48 | END_MAGIC) << 32 | crc
+	bits += 80
+	padding = -bits % 8
+	try:
+		return bz2.decompress(b'BZh9' + (stream << padding).to_bytes((bits + padding) // 8, 'big'))
+	except (OSError, ValueError, EOFError) as error:
+		raise BlockError(error)
+
+# Feeds may be made of several concatenated bz2 streams
+def decompressStream(chunks, out):
+	decompressor = bz2.BZ2Decompressor()
+	streams = 0
+	pending = False
+	for chunk in chunks:
+		while chunk:
+			out.write(decompressor.decompress(chunk))
+			pending = True
+			chunk = b''
+			if decompressor.eof:
+				streams += 1
+				pending = False
+				chunk = decompressor.unused_data
+				decompressor = bz2.BZ2Decompressor()
+	if pending or streams == 0:
+		raise EOFError('truncated bz2 payload')
+
+class ParallelDecompressor:
+	def __init__(self, out, jobs):
+		self.out = out
+		self.jobs = jobs
+		self.executor = ThreadPoolExecutor(max_workers=jobs)
+		# Compressed data not dispatched yet, from byte base of the input
+		self.buffer = bytearray()
+		self.base = 0
+		# Bit from which magics are still to be searched
+		self.scanned = 0
+		# Bit of the magic of the block being read, None between streams
+		self.blockStart = None
+		self.streams = 0
+		self.pending = collections.deque()
+
+	def feed(self, chunk):
+		self.buffer += chunk
+		for (bit, magic) in findMagics(self.buffer, self.scanned - self.base * 8):
+			bit += self.base * 8
+			if self.blockStart is not None:
+				self.dispatch(self.blockStart, bit)
+			if magic == BLOCK_MAGIC:
+				self.blockStart = bit
+			else:
+				self.blockStart = None
+				self.streams += 1
+		self.scanned = max(self.scanned, (self.base + len(self.buffer)) * 8 - 47)
+		keep = (self.blockStart if self.blockStart is not None else self.scanned) // 8
+		del self.buffer[:keep - self.base]
+		self.base = keep
+		while self.pending and (self.pending[0].done() or len(self.pending) > 2 * self.jobs):
+			self.out.write(self.pending.popleft().result())
+
+	def dispatch(self, start, end):
+		first = start // 8
+		chunk = bytes(self.buffer[first - self.base:(end + 7) // 8 - self.base])
+		self.pending.append(self.executor.submit(decompressBlock, chunk, start - first * 8, end - first * 8))
+
+	def finish(self):
+		if self.blockStart is not None or self.streams == 0:
+			raise EOFError('truncated bz2 payload')
+		while self.pending:
+			self.out.write(self.pending.popleft().result())
+
+	def close(self):
+		for future in self.pending:
+			future.cancel()
+		self.executor.shutdown()
+
+# Decompresses the bz2 data of chunks (an iterable of bytes) to out, a file opened for
+# writing from its start, on jobs threads. One job decompresses as a stream, without a pool
+# The input is spooled in directory (by default the temporary directory, which can be in RAM)
+def decompress(chunks, out, jobs, directory=None):
+	if jobs <= 1:
+		return decompressStream(chunks, out)
+	chunks = iter(chunks)
+	with tempfile.TemporaryFile(dir=directory) as spool:
+		decompressor = ParallelDecompressor(out, jobs)
+		try:
+			for chunk in chunks:
+				spool.write(chunk)
+				decompressor.feed(chunk)
+			decompressor.finish()
+			return
+		except BlockError:
+			pass
+		finally:
+			decompressor.close()
+		# A magic found by chance cut a block, start over on one core
+		for chunk in chunks:
+			spool.write(chunk)
+		spool.seek(0)
+		out.seek(0)
+		out.truncate()
+		decompressStream(iter(lambda: spool.read(CHUNK_SIZE), b''), out)
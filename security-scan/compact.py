@@ -0,0 +1,191 @@
+#!/bin/env python3
+
+# Compact form of the USN maps (usn -> {id, result, severity, cve}) for scans of many
+# manifests. The USNs and CVEs are interned once in a Catalog: a USN is an index into its
+# columns (definition id, severity) and its CVEs are a slice of one array of CVE indexes
+# (CSR layout: cveStart[usn] to cveStart[usn + 1] in cveEdges).
+# The results of one manifest are then a CompactMap: the bitset of the USNs it has, the
+# bitset of those present ('true') and the rare other results ('error', ...) by index.
+# Merging versions biased toward present (getTotals) is an OR of the bitsets, the stats per
+# severity (generateData) are popcounts against one mask per severity, and the CVE totals
+# (getCVETotalsFromUSNs) are computed over the edge arrays, with numpy when it is available.
+# A USN is assumed to have the same severity and CVEs in every feed: the first seen is kept.
+
+import array
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# The buckets of generateData, in its order, anything else counting as 'Other'
+SEVERITIES = ['Critical', 'High', 'Medium', 'Low', 'Other']
+
+if hasattr(int, 'bit_count'):
+	popcount = int.bit_count
+else:
+	def popcount(bits):
+		return bin(bits).count('1')
+
+def bitsFrom(indexes):
+	bits = bytearray()
+	for index in indexes:
+		byte = index >> 3
+		if byte >= len(bits):
+			bits.extend(bytes(byte + 1 - len(bits)))
+		bits[byte] |= 1 << (index & 7)
+	return int.from_bytes(bits, 'little')
+
+def indexesOf(bits):
+	offset = 0
+	for byte in bits.to_bytes((bits.bit_length() + 7) // 8, 'little'):
+		if byte:
+			for bit in range(8):
+				if byte >> bit & 1:
+					yield offset + bit
+		offset += 8
+
+# The results of one manifest over a Catalog
+class CompactMap:
+	__slots__ = ('known', 'present', 'others')
+
+	def __init__(self, known=0, present=0, others=None):
+		self.known = known
+		self.present = present
+		self.others = others or {}
+
+	def __len__(self):
+		return popcount(self.known)
+
+	def __getstate__(self):
+		return (self.known, self.present, self.others)
+
+	def __setstate__(self, state):
+		(self.known, self.present, self.others) = state
+
+class Catalog:
+	def __init__(self):
+		self.usnIds = []
+		self.usnIndex = {}
+		self.definitionIds = []
+		self.severityNames = []
+		self.severityIndex = {}
+		self.severity = array.array('H')
+		self.cveIds = []
+		self.cveIndex = {}
+		self.cveStart = array.array('I', [0])
+		self.cveEdges = array.array('I')
+		self._masks = (0, None)
+
+	def __len__(self):
+		return len(self.usnIds)
+
+	# Returns the index of usn, adding it if it is new
+	def add(self, usn, id, severity, cves):
+		index = self.usnIndex.get(usn)
+		if index is not None:
+			return index
+		index = self.usnIndex[usn] = len(self.usnIds)
+		self.usnIds.append(usn)
+		self.definitionIds.append(id)
+		if severity not in self.severityIndex:
+			self.severityIndex[severity] = len(self.severityNames)
+			self.severityNames.append(severity)
+		self.severity.append(self.severityIndex[severity])
+		for cve in cves:
+			if cve not in self.cveIndex:
+				self.cveIndex[cve] = len(self.cveIds)
+				self.cveIds.append(cve)
+			self.cveEdges.append(self.cveIndex[cve])
+		self.cveStart.append(len(self.cveEdges))
+		return index
+
+	# Adds the definitions of a feed, as (id, title, severity, [cve, ...]) (see USNIndex.definitions)
+	# and returns the (id, index) rows fromResults needs
+	def addDefinitions(self, definitions):
+		return [(id, self.add(title.split(' -- ')[0], id, severity, cves)) for (id, title, severity, cves) in definitions]
+
+	def _compact(self, results):
+		return CompactMap(bitsFrom(results.keys()),
+			bitsFrom(index for index, result in results.items() if result == 'true'),
+			dict((index, result) for index, result in results.items() if result not in ('true', 'false')))
+
+	# The CompactMap of an oscap (or native) result map: definition id -> result,
+	# as buildUsnMap would join it with the definitions of rows, skipping the same ones
+	def fromResults(self, rows, resultMap):
+		results = {}
+		for (id, index) in rows:
+			result = resultMap.get(id)
+			if result is None:
+				print ('Skipping %s: no result' % id)
+				continue
+			results[index] = result
+		return self._compact(results)
+
+	# Adapters from and to the dict shape of buildUsnMap
+	def fromUsnMap(self, usnMap):
+		return self._compact(dict((self.add(usn, data['id'], data['severity'], data['cve']), data['result'])
+			for usn, data in usnMap.items()))
+
+	def toUsnMap(self, compactMap):
+		usnMap = {}
+		for index in indexesOf(compactMap.known):
+			usnMap[self.usnIds[index]] = {'id': self.definitionIds[index],
+				'result': 'true' if compactMap.present >> index & 1 else compactMap.others.get(index, 'false'),
+				'severity': self.severityNames[self.severity[index]],
+				'cve': [self.cveIds[edge] for edge in self.cveEdges[self.cveStart[index]:self.cveStart[index + 1]]]}
+		return usnMap
+
+	# Same as getTotals: a USN is present if it is present in any of compactMaps, otherwise
+	# it keeps the result it has in the first of them
+	def totals(self, compactMaps):
+		known = 0
+		present = 0
+		others = {}
+		for compactMap in compactMaps:
+			for index, result in compactMap.others.items():
+				if index not in others and not known >> index & 1:
+					others[index] = result
+			known |= compactMap.known
+			present |= compactMap.present
+		return CompactMap(known, present, dict((index, result) for index, result in others.items() if not present >> index & 1))
+
+	# One bitset per entry of SEVERITIES, rebuilt when USNs were added
+	def severityMasks(self):
+		if self._masks[0] != len(self.usnIds):
+			buckets = [SEVERITIES.index(name) if name in SEVERITIES else len(SEVERITIES) - 1 for name in self.severityNames]
+			indexes = [[] for bucket in SEVERITIES]
+			for index, severity in enumerate(self.severity):
+				indexes[buckets[severity]].append(index)
+			self._masks = (len(self.usnIds), [bitsFrom(bucket) for bucket in indexes])
+		return self._masks[1]
+
+	# Same as generateData
+	def generateData(self, compactMap):
+		results = {}
+		for name, mask in zip(SEVERITIES, self.severityMasks()):
+			present = popcount(compactMap.present & mask)
+			results[name] = {'fixed': popcount(compactMap.known & mask) - present, 'present': present}
+		return results
+
+	# Same as getCVETotalsFromUSNs: cve -> True if one of its USNs is present in any of compactMaps
+	def cveTotals(self, compactMaps):
+		merged = self.totals(compactMaps)
+		if numpy is not None and len(self.cveEdges):
+			size = len(self.usnIds)
+			def mask(bits):
+				return numpy.unpackbits(numpy.frombuffer(bits.to_bytes((size + 7) // 8, 'little'), dtype=numpy.uint8),
+					count=size, bitorder='little').astype(bool)
+			usnOfEdge = numpy.repeat(numpy.arange(size), numpy.diff(numpy.array(self.cveStart, dtype=numpy.int64)))
+			edges = numpy.array(self.cveEdges, dtype=numpy.int64)
+			known = numpy.zeros(len(self.cveIds), dtype=bool)
+			known[edges[mask(merged.known)[usnOfEdge]]] = True
+			present = numpy.zeros(len(self.cveIds), dtype=bool)
+			present[edges[mask(merged.present)[usnOfEdge]]] = True
+			return dict((self.cveIds[cve], bool(present[cve])) for cve in numpy.flatnonzero(known).tolist())
+		known = bytearray(len(self.cveIds))
+		present = bytearray(len(self.cveIds))
+		for (bits, flags) in ((merged.known, known), (merged.present, present)):
+			for index in indexesOf(bits):
+				for edge in self.cveEdges[self.cveStart[index]:self.cveStart[index + 1]]:
+					flags[edge] = 1
+		return dict((self.cveIds[cve], bool(present[cve])) for cve in range(len(self.cveIds)) if known[cve])
@@ -0,0 +1,100 @@
+#!/bin/env python3
+
+# Retrieval of the bz2 compressed OVAL feeds
+# - requests are conditional (ETag / Last-Modified from the previous download), a 304 costs no transfer
+# - the body is decompressed while it streams in, into a temporary file renamed over the
+#   destination once complete: memory use is bounded and readers never see a partial feed
+# - with several CPUs the bz2 blocks are decompressed in parallel (see bz2par)
+# - one pooled session is shared by all downloads of a run
+
+import bz2par, json, os, tempfile, time
+
+# Can be pointed at a local server, e.g. OVAL_BASE_URL=http://127.0.0.1:8000
+OVAL_BASE_URL = os.getenv('OVAL_BASE_URL', 'https://security-metadata.canonical.com/oval')
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 60
+# Threads decompressing a feed, one meaning streaming decompression without a pool
+DECOMPRESS_JOBS = int(os.getenv('OVAL_DECOMPRESS_JOBS', '0')) or len(os.sched_getaffinity(0))
+
+session = None
+# Compressed bytes received by this process, for the metrics of the scan
+bytesDownloaded = 0
+
+def getSession():
+	global session
+	if session is None:
+		# Only imported when something has to be downloaded, it takes a while
+		import requests
+		session = requests.Session()
+		session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=2))
+		session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=2))
+	return session
+
+# What we know about the last download of a file is kept next to it, in [file].meta
+def readMeta(filename):
+	try:
+		with open('%s.meta' % filename, 'r') as metaFile:
+			return json.load(metaFile)
+	except (OSError, ValueError):
+		return {}
+
+def writeMeta(filename, meta):
+	with open('%s.meta.tmp' % filename, 'w') as metaFile:
+		json.dump(meta, metaFile)
+	os.replace('%s.meta.tmp' % filename, '%s.meta' % filename)
+
+# Seconds since the file was last downloaded or revalidated against the server
+def age(filename):
+	checked = readMeta(filename).get('checked')
+	if checked is None:
+		checked = os.path.getmtime(filename)
+	return time.time() - checked
+
+# Writes the decompressed content of a bz2 response to out, as it is received
+def decompressResponse(response, out, directory=None):
+	def chunks():
+		global bytesDownloaded
+		for chunk in response.iter_content(CHUNK_SIZE):
+			bytesDownloaded += len(chunk)
+			yield chunk
+	bz2par.decompress(chunks(), out, DECOMPRESS_JOBS, directory)
+
+# Downloads url (a .bz2 file) and stores it decompressed as filename
+# Returns True if filename is now up to date, whether it was transferred or not
+def downloadFile(url, filename, session=None):
+	session = session or getSession()
+	meta = readMeta(filename) if os.path.isfile(filename) else {}
+	headers = {}
+	if meta.get('url') == url:
+		if meta.get('etag'):
+			headers['If-None-Match'] = meta['etag']
+		if meta.get('last_modified'):
+			headers['If-Modified-Since'] = meta['last_modified']
+
+	tmpName = None
+	try:
+		with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+			if response.status_code == 304:
+				print ("%s has not changed on the server" % filename)
+				meta['checked'] = time.time()
+				writeMeta(filename, meta)
+				return True
+			response.raise_for_status()
+
+			directory = os.path.dirname(os.path.abspath(filename))
+			with tempfile.NamedTemporaryFile(dir=directory, prefix='.%s.' % os.path.basename(filename), delete=False) as out:
+				tmpName = out.name
+				decompressResponse(response, out, directory)
+				out.flush()
+				os.fsync(out.fileno())
+			os.replace(tmpName, filename)
+			tmpName = None
+			writeMeta(filename, {'url': url, 'etag': response.headers.get('ETag'),
+				'last_modified': response.headers.get('Last-Modified'), 'checked': time.time()})
+			return True
+	except Exception as e:
+		print (e)
+		return False
+	finally:
+		if tmpName is not None and os.path.exists(tmpName):
+			os.remove(tmpName)
@@ -0,0 +1,223 @@
+#!/bin/env python3
+
+# Persistent index of the data we pull out of the OVAL feeds.
+# The feeds only change about once a day, so what we extract from them is kept in a
+# SQLite database next to them and only rebuilt when the source file changed.
+# A source is considered unchanged when its size and mtime match what we recorded,
+# or, failing that, when its sha256 does (e.g. a re-download of the same content).
+
+import hashlib, json, os, re, sqlite3
+from oval_stream import iterElements, localName, elementText, usnDefinitionInfo
+
+INDEX_FILE = 'feed_index.db'
+# Bump when the extraction logic or the tables change, so existing indexes get rebuilt
+SCHEMA_VERSION = 5
+
+# 'linux package in jammy is affected and needs fixing.' -> 'linux'
+PACKAGE_COMMENT = re.compile(r'^(\S+) package in ')
+
+def fileDigest(filename):
+	digest = hashlib.sha256()
+	with open(filename, 'rb') as source:
+		for chunk in iter(lambda: source.read(1 << 20), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+# Reads a com.ubuntu.[distro].cve.oval.xml file (or its oci. variant) and yields
+# (cve, title, description, severity, date, [package, ...]) for each vulnerability definition
+# The packages are the source packages the criteria of the definition are about
+def iterCVEDefinitions(filename):
+	for path, definition in iterElements(filename, ['definition']):
+		if (definition.get('class') or '').split()[:1] != ['vulnerability']:
+			continue
+		fields = {}
+		packages = []
+		for element in definition.iter():
+			name = localName(element.tag)
+			if name in ('title', 'description', 'severity', 'public_date') and name not in fields:
+				fields[name] = elementText(element)
+			elif name == 'criterion':
+				match = PACKAGE_COMMENT.match(element.get('comment') or '')
+				if match and match.group(1) not in packages:
+					packages.append(match.group(1))
+		title = fields['title'].split(' ')[0]
+		yield (title, title, fields.get('description'), fields.get('severity'), fields.get('public_date'), packages)
+
+class FeedIndex:
+	def __init__(self, filename=INDEX_FILE):
+		self.db = sqlite3.connect(filename)
+		if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+			# The tables may not have the shape we expect: start over, everything gets indexed again
+			self.db.executescript('DROP TABLE IF EXISTS sources; DROP TABLE IF EXISTS cves; DROP TABLE IF EXISTS usns; '
+				'DROP TABLE IF EXISTS packages; DROP TABLE IF EXISTS usn_packages;')
+			self.db.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS sources (kind TEXT, distro TEXT, size INTEGER, mtime_ns INTEGER,
+				sha256 TEXT, schema INTEGER, PRIMARY KEY (kind, distro));
+			CREATE TABLE IF NOT EXISTS cves (cve TEXT, distro TEXT, title TEXT, description TEXT,
+				severity TEXT, date TEXT, packages TEXT, PRIMARY KEY (cve, distro)) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS usns (distro TEXT, seq INTEGER, id TEXT, title TEXT, severity TEXT,
+				cves TEXT, PRIMARY KEY (distro, seq));
+			CREATE TABLE IF NOT EXISTS packages (distro TEXT, cve TEXT, package TEXT, component TEXT, usns TEXT,
+				PRIMARY KEY (distro, cve, package)) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS usn_packages (distro TEXT, id TEXT, packages TEXT, PRIMARY KEY (distro, id)) WITHOUT ROWID;
+		''')
+
+	# Returns True if the indexed data of that kind/distro was extracted from this very file
+	def isCurrent(self, kind, distro, filename):
+		row = self.db.execute('SELECT size, mtime_ns, sha256, schema FROM sources WHERE kind=? AND distro=?',
+			(kind, distro)).fetchone()
+		if row is None or row[3] != SCHEMA_VERSION:
+			return False
+		stat = os.stat(filename)
+		if (row[0], row[1]) == (stat.st_size, stat.st_mtime_ns):
+			return True
+		if row[0] == stat.st_size and row[2] == fileDigest(filename):
+			# Same content, only the timestamp moved: remember it so we do not hash again
+			self.recordSource(kind, distro, filename, row[2])
+			return True
+		return False
+
+	# sha256 of filename, only recomputed when its size or mtime changed
+	def digest(self, filename):
+		if not self.isCurrent('digest', filename, filename):
+			self.recordSource('digest', filename, filename)
+		return self.db.execute("SELECT sha256 FROM sources WHERE kind='digest' AND distro=?", (filename,)).fetchone()[0]
+
+	def recordSource(self, kind, distro, filename, digest=None):
+		stat = os.stat(filename)
+		self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)',
+			(kind, distro, stat.st_size, stat.st_mtime_ns, digest or fileDigest(filename), SCHEMA_VERSION))
+		self.db.commit()
+
+class CVEIndex(FeedIndex):
+	def __init__(self, filename=INDEX_FILE):
+		FeedIndex.__init__(self, filename)
+		# Distros in the order they were loaded: when a CVE is known to several of them,
+		# the last one loaded wins, like it did when everything was merged in one dict
+		self.distros = []
+
+	# Makes the CVEs of com.ubuntu.[distro].cve.oval.xml available, indexing the file if needed
+	def load(self, distro, filename):
+		if self.isCurrent('cve', distro, filename):
+			print ("CVE index for %s is up to date" % distro)
+		else:
+			print ("Indexing CVEs in %s" % filename)
+			with self.db:
+				self.db.execute('DELETE FROM cves WHERE distro=?', (distro,))
+				self.db.executemany('INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?, ?, ?)',
+					((cve, distro, title, description, severity, date, ' '.join(packages))
+						for (cve, title, description, severity, date, packages) in iterCVEDefinitions(filename)))
+			self.recordSource('cve', distro, filename)
+		self.prefer(distro)
+
+	# Gives the CVEs of distro precedence over those of the distros loaded before
+	def prefer(self, distro):
+		if distro in self.distros:
+			self.distros.remove(distro)
+		self.distros.append(distro)
+
+	def _query(self, columns, cves):
+		cves = list(cves)
+		rows = {}
+		priority = dict((distro, rank) for rank, distro in enumerate(self.distros))
+		distroParams = ','.join('?' * len(self.distros))
+		# Stay well below SQLite's limit on host parameters
+		for start in range(0, len(cves), 500):
+			batch = cves[start:start + 500]
+			query = 'SELECT cve, distro, %s FROM cves WHERE cve IN (%s) AND distro IN (%s)' % (
+				columns, ','.join('?' * len(batch)), distroParams)
+			for row in self.db.execute(query, batch + self.distros):
+				if row[0] not in rows or priority[row[1]] > priority[rows[row[0]][1]]:
+					rows[row[0]] = row
+		return rows
+
+	# cve -> severity, for the CVEs we know about. Descriptions are never loaded
+	def severities(self, cves):
+		return dict((cve, row[2]) for cve, row in self._query('severity', cves).items())
+
+	# cve -> {title, description, severity, date, packages}, for the CVEs we know about
+	def lookup(self, cves):
+		return dict((cve, {'title': row[2], 'description': row[3], 'severity': row[4], 'date': row[5],
+			'packages': row[6].split()}) for cve, row in self._query('title, description, severity, date, packages', cves).items())
+
+# Reads a oci.com.ubuntu.[distro].usn.oval.xml file and yields
+# (id, title, severity, [cve, ...]) for each definition, in document order
+def iterUSNDefinitions(filename):
+	for path, definition in iterElements(filename, ['definition']):
+		if path[-1] == 'definitions':
+			yield (definition.get('id'),) + usnDefinitionInfo(definition)
+
+class USNIndex(FeedIndex):
+	# The definitions of oci.com.ubuntu.[distro].usn.oval.xml, as (id, title, severity, [cve, ...]),
+	# indexing the file if needed. These are the definitions oscap copies into its reports
+	def definitions(self, distro, filename):
+		if not self.isCurrent('usn', distro, filename):
+			print ("Indexing USNs in %s" % filename)
+			with self.db:
+				self.db.execute('DELETE FROM usns WHERE distro=?', (distro,))
+				self.db.executemany('INSERT INTO usns VALUES (?, ?, ?, ?, ?, ?)',
+					((distro, seq, id, title, severity, ' '.join(cves))
+						for seq, (id, title, severity, cves) in enumerate(iterUSNDefinitions(filename))))
+			self.recordSource('usn', distro, filename)
+		return [(id, title, severity, cves.split()) for (id, title, severity, cves) in
+			self.db.execute('SELECT id, title, severity, cves FROM usns WHERE distro=? ORDER BY seq', (distro,))]
+
+	# The binary packages each definition of the same feed is about, with the states of their
+	# tests: definition id -> [(package, state operator, [state, ...]), ...] (see
+	# OvalEvaluator.definitionPackages). They are only known once the feed is compiled:
+	# loadEvaluator() returns its OvalEvaluator, only called when the file changed since it
+	# was last indexed
+	def packages(self, distro, filename, loadEvaluator):
+		if not self.isCurrent('usnpkg', distro, filename):
+			print ("Indexing the packages of the USNs in %s" % filename)
+			with self.db:
+				self.db.execute('DELETE FROM usn_packages WHERE distro=?', (distro,))
+				self.db.executemany('INSERT INTO usn_packages VALUES (?, ?, ?)',
+					((distro, id, json.dumps(packages)) for id, packages in loadEvaluator().definitionPackages().items()))
+			self.recordSource('usnpkg', distro, filename)
+		return dict((id, [tuple(entry) for entry in json.loads(packages)]) for (id, packages) in
+			self.db.execute('SELECT id, packages FROM usn_packages WHERE distro=?', (distro,)))
+
+# Reads a oci.com.ubuntu.[distro].pkg.oval.xml file, which has one definition per source package,
+# and yields (package, component, [(cve, [usn, ...]), ...]) for each of them
+# The USNs of the feed have no 'USN-' prefix, it is added here
+def iterPackageDefinitions(filename):
+	for path, definition in iterElements(filename, ['definition']):
+		if path[-1] != 'definitions':
+			continue
+		package = None
+		component = None
+		cves = []
+		for element in definition.iter():
+			name = localName(element.tag)
+			if name == 'title' and package is None:
+				package = elementText(element).strip()
+			elif name == 'component' and component is None:
+				component = elementText(element).strip()
+			elif name == 'cve':
+				cves.append((elementText(element).strip(),
+					['USN-%s' % usn for usn in (element.get('usns') or '').replace(' ', '').split(',') if usn]))
+		if package:
+			yield (package, component, cves)
+
+class ComponentIndex(FeedIndex):
+	# The components of oci.com.ubuntu.[distro].pkg.oval.xml, indexing the file if needed:
+	# ({cve: {(package, component), ...}}, {usn: {component, ...}})
+	def components(self, distro, filename):
+		if not self.isCurrent('pkg', distro, filename):
+			print ("Indexing packages in %s" % filename)
+			with self.db:
+				self.db.execute('DELETE FROM packages WHERE distro=?', (distro,))
+				self.db.executemany('INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)',
+					((distro, cve, package, component, ' '.join(usns))
+						for (package, component, cves) in iterPackageDefinitions(filename) for (cve, usns) in cves))
+			self.recordSource('pkg', distro, filename)
+		cveComponents = {}
+		usnComponents = {}
+		for (cve, package, component, usns) in self.db.execute(
+				'SELECT cve, package, component, usns FROM packages WHERE distro=?', (distro,)):
+			cveComponents.setdefault(cve, set()).add((package, component))
+			for usn in usns.split():
+				usnComponents.setdefault(usn, set()).add(component)
+		return (cveComponents, usnComponents)
@@ -0,0 +1,144 @@
+#!/bin/env python3
+
+# Scores the manifests collected from a fleet of devices in one run:
+#
+#   fleet_scan.py devices/ --output fleet.json
+#
+# devices/ holds one directory per device, each with the manifest.[version] files
+# snap_manifest.py produced on it. Identical manifests are only evaluated once: they are
+# deduplicated by content hash (and distro). The OVAL data of each distro is loaded once,
+# in this process, and shared with the pool of workers evaluating the manifests with oscap,
+# like security_scan.py does, or with the built-in engine (--engine native, see oval_eval),
+# which is faster but is only checked against oscap on the fixtures of its tests.
+# The output has the generateData stats of every version of every device, and the
+# stats of the whole fleet, from getTotals over all the manifests.
+# Results are kept in the compact form (see compact.py): workers send back the bitsets of a
+# manifest instead of its USN map, and the fleet totals are ORs of these bitsets.
+
+import argparse, hashlib, json, os, shutil, subprocess, sys, tempfile, time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from security_scan import VERSIONS, analyzeOscapResults, updateFiles
+from feed_index import USNIndex
+from oval_eval import OvalEvaluator, readManifest, versionManifest
+from compact import Catalog, CompactMap
+
+# The USNs of every distro, and distro -> (OvalEvaluator, catalog rows of its definitions),
+# set before the pool starts so that forked workers share them. The evaluator is None when
+# oscap evaluates the manifests
+catalog = Catalog()
+distroData = {}
+
+def loadDistro(distro, index, engine):
+	feed = 'oci.com.ubuntu.%s.usn.oval.xml' % distro
+	distroData[distro] = (OvalEvaluator(feed) if engine == 'native' else None,
+		catalog.addDefinitions(index.definitions(distro, feed)))
+
+def initWorker(distros, engine):
+	# Only needed where workers are not forked
+	if distros and not distroData:
+		index = USNIndex()
+		for distro in distros:
+			loadDistro(distro, index, engine)
+
+# Runs oscap on a manifest in a scratch directory, like evaluateVersion, and returns its
+# results, None if oscap failed
+def oscapResults(distro, filename):
+	feed = os.path.abspath('oci.com.ubuntu.%s.usn.oval.xml' % distro)
+	with tempfile.TemporaryDirectory(prefix='fleet_scan.') as workdir:
+		with open(os.path.join(workdir, 'manifest'), 'w') as manifestFile:
+			manifestFile.write(versionManifest(readManifest(filename)))
+		report = os.path.join(workdir, 'report.xml')
+		output = subprocess.run(['oscap', 'oval', 'eval', '--results', report, feed], cwd=workdir,
+			stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, errors='replace')
+		if output.returncode != 0 or not os.path.exists(report):
+			print ('oscap failed on %s: %s' % (filename, output.stderr.strip()))
+			return None
+		return analyzeOscapResults(report)
+
+# Returns the CompactMap of a manifest, None if it could not be evaluated
+def evaluateManifest(distro, filename):
+	(evaluator, rows) = distroData[distro]
+	if evaluator is None:
+		results = oscapResults(distro, filename)
+		if results is None:
+			return None
+	else:
+		results = evaluator.evaluate(readManifest(filename))
+	return catalog.fromResults(rows, results)
+
+# Lists the manifests of every device: {device: {version: filename}}
+def findManifests(directory):
+	devices = {}
+	for device in sorted(os.listdir(directory)):
+		path = os.path.join(directory, device)
+		if not os.path.isdir(path):
+			continue
+		for version in VERSIONS.keys():
+			filename = os.path.join(path, 'manifest.%s' % version)
+			if os.path.isfile(filename):
+				devices.setdefault(device, {})[version] = filename
+	return devices
+
+def manifestDigest(filename):
+	with open(filename, 'rb') as manifestFile:
+		return hashlib.sha256(manifestFile.read()).hexdigest()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Scan the manifests of a fleet of devices')
+	parser.add_argument('directory', help='directory holding a directory of manifest.[version] files per device')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+		help='number of worker processes (default: number of CPUs)')
+	parser.add_argument('--engine', choices=['oscap', 'native'], default='oscap',
+		help='evaluate manifests with oscap or with the built-in evaluator (default: %(default)s)')
+	parser.add_argument('--output', default='fleet.json', help='where to write the results')
+	args = parser.parse_args()
+	if args.engine == 'oscap' and shutil.which('oscap') is None:
+		sys.exit('oscap is not installed, install it or use --engine native')
+
+	start = time.time()
+	devices = findManifests(args.directory)
+	# (distro, manifest hash) -> manifest file, and what each device's versions point to
+	unique = {}
+	keys = {}
+	for device, manifests in devices.items():
+		for version, filename in manifests.items():
+			key = (VERSIONS[version], manifestDigest(filename))
+			unique.setdefault(key, filename)
+			keys[(device, version)] = key
+	print ('%d devices, %d manifests, %d unique' % (len(devices), len(keys), len(unique)))
+
+	distros = sorted(set(distro for (distro, digest) in unique.keys()))
+	index = USNIndex()
+	for distro in distros:
+		if not updateFiles(distro):
+			print ('Could not update files for %s, its manifests will be skipped' % distro)
+			continue
+		loadDistro(distro, index, args.engine)
+
+	# Unique manifests are evaluated in the pool, their stats kept, and their results
+	# folded into the fleet totals as they come
+	stats = {}
+	totals = CompactMap()
+	pending = [key for key in unique.keys() if key[0] in distroData]
+	context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+	with ProcessPoolExecutor(max_workers=max(1, args.jobs), mp_context=context,
+			initializer=initWorker, initargs=(list(distroData.keys()), args.engine)) as executor:
+		compactMaps = executor.map(evaluateManifest, [key[0] for key in pending], [unique[key] for key in pending],
+			chunksize=max(1, len(pending) // (4 * max(1, args.jobs))))
+		for key, compactMap in zip(pending, compactMaps):
+			if compactMap is None:
+				continue
+			stats[key] = catalog.generateData(compactMap)
+			totals = catalog.totals([totals, compactMap])
+
+	results = {'devices': {}, 'manifests': len(keys), 'unique_manifests': len(unique),
+		'totals': catalog.generateData(totals)}
+	for (device, version), key in keys.items():
+		if key in stats:
+			results['devices'].setdefault(device, {})[version] = stats[key]
+	results['seconds'] = time.time() - start
+	with open(args.output + '.tmp', 'w') as outputFile:
+		json.dump(results, outputFile)
+	os.replace(args.output + '.tmp', args.output)
+	print ('Fleet scanned in %.1f s, results written to %s' % (results['seconds'], args.output))
@@ -0,0 +1,416 @@
+#!/bin/env python3
+
+# In-process evaluation of the OCI USN OVAL feeds, as an alternative to `oscap oval eval`.
+# The OCI feeds only use textfilecontent54 tests reading the 'manifest' file: each test matches
+# package lines of the manifest and compares the captured version with the fixed one (debian_evr_string).
+# The feed is compiled once (see OvalEvaluator), then a manifest is evaluated with dictionary
+# lookups for the usual '^package(?::\w+|)\s+(.*)$' patterns and a cached version comparator.
+# Results use the same vocabulary as oscap ('true' meaning vulnerable), so they plug into buildUsnMap.
+# Constructs we do not support evaluate to 'error', never to a guess.
+
+import re
+from functools import lru_cache
+from oval_stream import iterElements, localName, elementText
+
+# The pattern the feeds use for a binary package, capturing its version
+PACKAGE_PATTERN = re.compile(r'^\^((?:[A-Za-z0-9_-]|\\.)+)\(\?::\\w\+\|\)\\s\+\(\.\*\)\$$')
+ARCH_SUFFIX = re.compile(r':\w+$')
+
+# Version comparison, as dpkg does it (lib/dpkg/version.c)
+def _order(c):
+	if c.isdigit():
+		return 0
+	if ('a' <= c <= 'z') or ('A' <= c <= 'Z'):
+		return ord(c)
+	if c == '~':
+		return -1
+	return ord(c) + 256
+
+def _verrevcmp(a, b):
+	i = j = 0
+	while i < len(a) or j < len(b):
+		while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+			ac = _order(a[i]) if i < len(a) else 0
+			bc = _order(b[j]) if j < len(b) else 0
+			if ac != bc:
+				return ac - bc
+			i += 1
+			j += 1
+		while i < len(a) and a[i] == '0':
+			i += 1
+		while j < len(b) and b[j] == '0':
+			j += 1
+		firstDiff = 0
+		while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+			if not firstDiff:
+				firstDiff = ord(a[i]) - ord(b[j])
+			i += 1
+			j += 1
+		if i < len(a) and a[i].isdigit():
+			return 1
+		if j < len(b) and b[j].isdigit():
+			return -1
+		if firstDiff:
+			return firstDiff
+	return 0
+
+def _splitVersion(version):
+	epoch, colon, rest = version.partition(':')
+	if not colon:
+		epoch, rest = '0', version
+	upstream, dash, revision = rest.rpartition('-')
+	if not dash:
+		upstream, revision = rest, ''
+	return (int(epoch or 0), upstream, revision)
+
+# Returns <0, 0 or >0 as a is older than, equal to or newer than b
+@lru_cache(maxsize=65536)
+def compareVersions(a, b):
+	(epochA, upstreamA, revisionA) = _splitVersion(a)
+	(epochB, upstreamB, revisionB) = _splitVersion(b)
+	if epochA != epochB:
+		return epochA - epochB
+	return _verrevcmp(upstreamA, upstreamB) or _verrevcmp(revisionA, revisionB)
+
+def compareValues(datatype, operation, value, expected):
+	if datatype == 'debian_evr_string':
+		result = compareVersions(value, expected)
+		comparisons = {'less than': result < 0, 'less than or equal': result <= 0,
+			'greater than': result > 0, 'greater than or equal': result >= 0,
+			'equals': result == 0, 'not equal': result != 0}
+	elif datatype in (None, 'string'):
+		comparisons = {'equals': value == expected, 'not equal': value != expected,
+			'pattern match': re.search(expected, value) is not None}
+	else:
+		return 'error'
+	if operation not in comparisons:
+		return 'error'
+	return 'true' if comparisons[operation] else 'false'
+
+# Combination of results, following the OVAL operator tables
+def combine(operator, results):
+	results = [result for result in results if result != 'not applicable']
+	if not results:
+		return 'not applicable'
+	trues = results.count('true')
+	falses = results.count('false')
+	undecided = len(results) - trues - falses
+	if operator == 'AND':
+		if falses:
+			return 'false'
+		if undecided:
+			return _worst(results)
+		return 'true'
+	if operator == 'OR':
+		if trues:
+			return 'true'
+		if undecided:
+			return _worst(results)
+		return 'false'
+	if operator == 'ONE':
+		if trues > 1:
+			return 'false'
+		if undecided:
+			return _worst(results)
+		return 'true' if trues == 1 else 'false'
+	if operator == 'XOR':
+		if undecided:
+			return _worst(results)
+		return 'true' if trues % 2 else 'false'
+	return 'error'
+
+def _worst(results):
+	for result in ('error', 'unknown', 'not evaluated'):
+		if result in results:
+			return result
+	return 'unknown'
+
+def negate(result, negated):
+	if negated and result in ('true', 'false'):
+		return 'false' if result == 'true' else 'true'
+	return result
+
+# The result of a compiled state (see OvalEvaluator._compileState) for an item
+def stateResult(compiled, item):
+	if compiled is None or compiled['type'] != 'textfilecontent54_state':
+		return 'error'
+	results = []
+	for entity in compiled['entities']:
+		if entity is None:
+			return 'error'
+		(datatype, operation, expected) = entity
+		results.append(compareValues(datatype, operation, item, expected))
+	return combine(compiled['operator'], results)
+
+# Whether the version of a package meets the states a test checks it against (see
+# OvalEvaluator.definitionPackages), a test without states only asking for the package
+def meetsStates(operator, states, version):
+	if not states:
+		return True
+	return combine(operator, [stateResult(state, version) for state in states]) == 'true'
+
+def readManifest(filename):
+	with open(filename, 'r') as manifestFile:
+		return manifestFile.read()
+
+# The manifest the engines evaluate: the "package version" columns of manifest contents
+# The manifests of the snaps have a third column, the snap a package comes from, which the
+# feed patterns ('^package(?::\w+|)\s+(.*)$') would capture along with the version: "5.15.0-91.101
+# pc-kernel", compared as a debian version, has the revision "kernel" and is newer than any
+# 5.15.0 kernel. oscap is given this manifest (see evaluateVersion) and the native engine
+# evaluates it, so that both compare the version alone
+def versionManifest(contents):
+	lines = []
+	for line in contents.splitlines():
+		columns = line.split()
+		if len(columns) >= 2:
+			lines.append('%s %s\n' % (columns[0], columns[1]))
+	return ''.join(lines)
+
+# Indexes manifest contents ("package version [snap]" lines) as package -> [version, ...]
+# Architecture qualifiers (package:arch) are dropped, as the feed patterns accept them
+# The versions are what the usual patterns capture from the lines of versionManifest
+def indexManifest(contents):
+	packages = {}
+	for line in contents.splitlines():
+		columns = line.split()
+		if len(columns) < 2:
+			continue
+		packages.setdefault(ARCH_SUFFIX.sub('', columns[0]), []).append(columns[1])
+	return packages
+
+class OvalEvaluator:
+	# Compiles oci.com.ubuntu.[distro].usn.oval.xml
+	def __init__(self, filename):
+		self.definitions = {}
+		self.tests = {}
+		self.objects = {}
+		self.states = {}
+		self.variables = {}
+		# Id of every definition, test, object, state and variable -> the ids it refers to
+		self.references = {}
+		for path, element in iterElements(filename, parents=['definitions', 'tests', 'objects', 'states', 'variables']):
+			section = path[-1]
+			self.references[element.get('id')] = set(value for child in element.iter()
+				for (attribute, value) in child.attrib.items() if attribute.endswith('_ref'))
+			if section == 'definitions':
+				self.definitions[element.get('id')] = self._compileDefinition(element)
+			elif section == 'tests':
+				self.tests[element.get('id')] = self._compileTest(element)
+			elif section == 'objects':
+				self.objects[element.get('id')] = self._compileObject(element)
+			elif section == 'states':
+				self.states[element.get('id')] = self._compileState(element)
+			elif section == 'variables':
+				if localName(element.tag) == 'constant_variable':
+					self.variables[element.get('id')] = [elementText(value) for value in element
+						if localName(value.tag) == 'value']
+		# Objects looking for known package names are resolved against the manifest index
+		for compiled in self.objects.values():
+			compiled['packages'] = self._objectPackages(compiled)
+
+	def _compileCriteria(self, element):
+		name = localName(element.tag)
+		negated = element.get('negate') == 'true'
+		if name == 'criteria':
+			return ('criteria', element.get('operator', 'AND'), negated,
+				[self._compileCriteria(child) for child in element if localName(child.tag) in ('criteria', 'criterion', 'extend_definition')])
+		if name == 'criterion':
+			return ('criterion', element.get('test_ref'), negated)
+		return ('extend_definition', element.get('definition_ref'), negated)
+
+	def _compileDefinition(self, element):
+		for child in element:
+			if localName(child.tag) == 'criteria':
+				return self._compileCriteria(child)
+		return None
+
+	def _compileTest(self, element):
+		objectRef = None
+		stateRefs = []
+		for child in element:
+			if localName(child.tag) == 'object':
+				objectRef = child.get('object_ref')
+			elif localName(child.tag) == 'state':
+				stateRefs.append(child.get('state_ref'))
+		return {'type': localName(element.tag), 'check': element.get('check', 'all'),
+			'existence': element.get('check_existence', 'at_least_one_exists'),
+			'operator': element.get('state_operator', 'AND'), 'object': objectRef, 'states': stateRefs}
+
+	def _compileObject(self, element):
+		compiled = {'type': localName(element.tag)}
+		for child in element:
+			name = localName(child.tag)
+			if name in ('path', 'filename', 'filepath', 'pattern', 'instance'):
+				compiled[name] = {'value': elementText(child), 'operation': child.get('operation', 'equals'),
+					'var_ref': child.get('var_ref')}
+		return compiled
+
+	def _compileState(self, element):
+		entities = []
+		for child in element:
+			name = localName(child.tag)
+			if name == 'subexpression':
+				entities.append((child.get('datatype'), child.get('operation', 'equals'), elementText(child)))
+			elif name not in ('notes',):
+				entities.append(None)
+		return {'type': localName(element.tag), 'operator': element.get('operator', 'AND'), 'entities': entities}
+
+	def _patterns(self, compiled):
+		pattern = compiled.get('pattern')
+		if pattern is None:
+			return None
+		if pattern['var_ref']:
+			return self.variables.get(pattern['var_ref'])
+		return [pattern['value']]
+
+	# The package names an object looks for, or None if its patterns are not the usual ones
+	def _objectPackages(self, compiled):
+		patterns = self._patterns(compiled)
+		if not patterns:
+			return None
+		packages = []
+		for pattern in patterns:
+			match = PACKAGE_PATTERN.match(pattern)
+			if not match:
+				return None
+			packages.append(re.sub(r'\\(.)', r'\1', match.group(1)))
+		return packages
+
+	def _supportedObject(self, compiled):
+		if compiled['type'] != 'textfilecontent54_object':
+			return False
+		instance = compiled.get('instance')
+		if instance is not None and (instance['operation'], instance['value'].strip()) != ('greater than or equal', '1'):
+			return False
+		if 'filepath' in compiled:
+			return compiled['filepath']['value'].rstrip().endswith('manifest')
+		return compiled.get('filename', {}).get('value', '').strip() == 'manifest'
+
+	# The packages the tests of each definition look for, with the states their versions are
+	# checked against: definition id -> [(package, state operator, [compiled state, ...]), ...]
+	# A version of the package is vulnerable when it meets these states (see meetsStates)
+	# Definitions looking for anything else than the usual package patterns get the packages
+	# of the objects we understand, if any
+	def definitionPackages(self):
+		packages = {}
+		for id in self.definitions.keys():
+			found = []
+			reached = set()
+			pending = [id]
+			while pending:
+				ref = pending.pop()
+				if ref in reached:
+					continue
+				reached.add(ref)
+				test = self.tests.get(ref)
+				if test is not None and test['object'] in self.objects:
+					for package in self.objects[test['object']]['packages'] or ():
+						entry = (package, test['operator'], [self.states.get(state) for state in test['states']])
+						if entry not in found:
+							found.append(entry)
+				pending.extend(self.references.get(ref, ()))
+			packages[id] = sorted(found, key=lambda entry: entry[0])
+		return packages
+
+	# Evaluates a manifest, returns definition id -> result, for every definition of the feed
+	def evaluate(self, manifest):
+		return Evaluation(self, manifest).run()
+
+class Evaluation:
+	def __init__(self, evaluator, manifest):
+		self.evaluator = evaluator
+		self.manifest = versionManifest(manifest)
+		self.packages = indexManifest(manifest)
+		self.itemCache = {}
+		self.testCache = {}
+		self.definitionCache = {}
+
+	def run(self):
+		return dict((id, self.definition(id)) for id in self.evaluator.definitions.keys())
+
+	# The versions captured by an object, or None if the object cannot be evaluated
+	def items(self, objectId):
+		if objectId in self.itemCache:
+			return self.itemCache[objectId]
+		compiled = self.evaluator.objects.get(objectId)
+		items = None
+		if compiled is not None and self.evaluator._supportedObject(compiled):
+			packages = compiled['packages']
+			if packages is not None:
+				items = []
+				for package in packages:
+					items.extend(self.packages.get(package, []))
+			else:
+				patterns = self.evaluator._patterns(compiled)
+				if patterns:
+					items = []
+					for pattern in patterns:
+						for match in re.finditer(pattern, self.manifest, re.MULTILINE):
+							items.append((match.group(1) if match.groups() else match.group(0)) or '')
+		self.itemCache[objectId] = items
+		return items
+
+	def state(self, stateId, item):
+		return stateResult(self.evaluator.states.get(stateId), item)
+
+	def test(self, testId):
+		if testId in self.testCache:
+			return self.testCache[testId]
+		result = self._test(testId)
+		self.testCache[testId] = result
+		return result
+
+	def _test(self, testId):
+		compiled = self.evaluator.tests.get(testId)
+		if compiled is None or compiled['type'] != 'textfilecontent54_test':
+			return 'error'
+		items = self.items(compiled['object'])
+		if items is None:
+			return 'error'
+
+		existence = compiled['existence']
+		if existence in ('at_least_one_exists', 'all_exist') and not items:
+			return 'false'
+		if existence == 'none_exist':
+			return 'true' if not items else 'false'
+		if existence == 'only_one_exists' and len(items) != 1:
+			return 'false'
+		if existence not in ('at_least_one_exists', 'any_exist', 'only_one_exists', 'all_exist'):
+			return 'error'
+		if not compiled['states']:
+			return 'true'
+		if not items:
+			return 'true' if compiled['check'] in ('all', 'none satisfy') else 'false'
+
+		results = [combine(compiled['operator'], [self.state(stateId, item) for stateId in compiled['states']])
+			for item in items]
+		check = compiled['check']
+		if check == 'at least one':
+			return combine('OR', results)
+		if check == 'all':
+			return combine('AND', results)
+		if check == 'only one':
+			return combine('ONE', results)
+		if check == 'none satisfy':
+			return negate(combine('OR', results), True)
+		return 'error'
+
+	def definition(self, definitionId):
+		if definitionId in self.definitionCache:
+			return self.definitionCache[definitionId]
+		# Guards against definitions extending themselves
+		self.definitionCache[definitionId] = 'error'
+		criteria = self.evaluator.definitions.get(definitionId)
+		result = self.criteria(criteria) if criteria is not None else 'error'
+		self.definitionCache[definitionId] = result
+		return result
+
+	def criteria(self, node):
+		kind = node[0]
+		if kind == 'criteria':
+			(kind, operator, negated, children) = node
+			return negate(combine(operator, [self.criteria(child) for child in children]), negated)
+		if kind == 'criterion':
+			return negate(self.test(node[1]), node[2])
+		return negate(self.definition(node[1]), node[2])
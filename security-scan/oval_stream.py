@@ -0,0 +1,77 @@
+#!/bin/env python3
+
+# Streaming helpers for the OVAL documents we deal with (feeds and oscap reports).
+# Those files are big, so instead of building a whole tree we walk them with iterparse
+# and drop every element as soon as it has been looked at: memory stays bounded by
+# the size of the largest element we ask for (typically one definition).
+
+try:
+	from lxml import etree
+	LXML = True
+except ImportError:
+	import xml.etree.ElementTree as etree
+	LXML = False
+
+# '{http://oval.mitre.org/XMLSchema/oval-definitions-5}definition' -> 'definition'
+def localName(tag):
+	if not isinstance(tag, str):
+		# lxml comments and processing instructions
+		return None
+	return tag.rpartition('}')[2]
+
+def elementText(element):
+	return ''.join(element.itertext())
+
+def iterparse(source, events):
+	if LXML:
+		return etree.iterparse(source, events=events, huge_tree=True)
+	return etree.iterparse(source, events=events)
+
+# Yields (ancestors, element) for every element whose local name is in names, or whose
+# parent's local name is in parents (e.g. parents=['tests'] yields every test, whatever its type).
+# ancestors is a tuple with the local names of the enclosing elements, root first.
+# The element is complete (children included) when yielded, and it is removed from
+# the tree right after, so do not keep references to it.
+def iterElements(source, names=(), parents=()):
+	names = set(names)
+	parents = set(parents)
+	stack = []
+	path = []
+	keptDepth = None
+	for event, element in iterparse(source, ('start', 'end')):
+		if event == 'start':
+			if keptDepth is None and (localName(element.tag) in names or (path and path[-1] in parents)):
+				keptDepth = len(stack)
+			stack.append(element)
+			path.append(localName(element.tag))
+			continue
+
+		stack.pop()
+		name = path.pop()
+		# Children of an element we will yield must stay attached until it is done
+		if keptDepth is not None and len(stack) > keptDepth:
+			continue
+		if keptDepth is not None:
+			keptDepth = None
+			yield tuple(path), element
+		if stack:
+			stack[-1].remove(element)
+		else:
+			element.clear()
+
+# Pulls what we report on out of a USN definition element:
+# (title, severity, [cve, ...])
+# Only the first title and severity are considered, the same way BeautifulSoup's find() would
+def usnDefinitionInfo(definition):
+	title = None
+	severity = None
+	cves = []
+	for element in definition.iter():
+		name = localName(element.tag)
+		if name == 'title' and title is None:
+			title = elementText(element)
+		elif name == 'severity' and severity is None:
+			severity = elementText(element)
+		elif name == 'cve':
+			cves.append(elementText(element))
+	return (title, severity, cves)
@@ -0,0 +1,142 @@
+#!/bin/env python3
+
+# Reduces a USN OVAL feed to the definitions that concern the packages of a manifest.
+# The feeds cover the whole archive while a manifest lists a few hundred packages, and oscap
+# evaluates and reports on every definition it is given. A definition is dropped when every
+# manifest object it relies on collects nothing from the manifest: its verdict is then computed
+# by the built-in evaluator (oval_eval) and merged back with the oscap results.
+# Definitions we cannot reason about are always kept.
+# Reduced feeds are cached in trimmed/, keyed by the hashes of the manifest and of the feed.
+# Trimming is opt-in (security_scan.py --trim), as the dropped verdicts are not oscap's.
+
+import glob, json, os, re
+from xml.sax.saxutils import quoteattr
+from oval_stream import etree, LXML, iterparse, localName
+from oval_eval import Evaluation, readManifest
+from feed_index import fileDigest
+
+TRIMMED_DIR = 'trimmed'
+STREAMED_SECTIONS = ('definitions', 'tests', 'objects', 'states', 'variables')
+DEFAULT_PREFIX = 'oval-def'
+
+# All the ids reachable from ids through references
+def closure(references, ids):
+	reached = set()
+	pending = list(ids)
+	while pending:
+		id = pending.pop()
+		if id in reached:
+			continue
+		reached.add(id)
+		pending.extend(references.get(id, ()))
+	return reached
+
+# Splits the definitions of the feed into those oscap must evaluate, and the verdicts
+# of those it does not need to: (ids to keep, {dropped id: result})
+def partitionDefinitions(evaluator, manifest):
+	evaluation = Evaluation(evaluator, manifest)
+	keep = set()
+	dropped = {}
+	for id in evaluator.definitions.keys():
+		objects = [reached for reached in closure(evaluator.references, [id]) if reached in evaluator.objects]
+		if not objects or any(evaluation.items(objectId) != [] for objectId in objects):
+			keep.add(id)
+		else:
+			dropped[id] = evaluation.definition(id)
+	return (keep, dropped)
+
+def _qualifiedName(tag, prefixes):
+	if not tag.startswith('{'):
+		return tag
+	uri, name = tag[1:].split('}', 1)
+	prefix = prefixes.get(uri, '')
+	return '%s:%s' % (prefix, name) if prefix else name
+
+NAMESPACE_DECLARATION = re.compile(rb'\s+xmlns(?::([\w.-]+))?="([^"]*)"')
+
+# Serializes an element on its own, without repeating the namespace declarations of the root
+def _serialize(element, declared):
+	element.tail = None
+	if LXML:
+		data = etree.tostring(element, with_tail=False)
+	else:
+		data = etree.tostring(element)
+	end = data.index(b'>')
+	return NAMESPACE_DECLARATION.sub(lambda match: b'' if (match.group(1) or b'', match.group(2)) in declared
+		else match.group(0), data[:end]) + data[end:]
+
+# Copies source into filename, keeping only the definitions, tests, objects, states and
+# variables whose id is in keep. The document is streamed, one element at a time
+def writeTrimmedDocument(source, keep, filename):
+	prefixes = {}
+	declared = set()
+	stack = []
+	with open(filename, 'wb') as out:
+		out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+		for event, item in iterparse(source, ('start-ns', 'start', 'end')):
+			if event == 'start-ns':
+				(prefix, uri) = item
+				prefixes.setdefault(uri, prefix or '')
+				if not LXML:
+					# ElementTree cannot serialize a lone element with a default namespace,
+					# so that one also gets a prefix, declared on the root as well
+					etree.register_namespace(prefix or DEFAULT_PREFIX, uri)
+				continue
+
+			if event == 'start':
+				stack.append(item)
+				if len(stack) == 1:
+					declarations = [(prefix, uri) for uri, prefix in prefixes.items()]
+					if not LXML:
+						declarations += [(DEFAULT_PREFIX, uri) for uri, prefix in prefixes.items() if prefix == '']
+					declared = set((prefix.encode(), uri.encode()) for prefix, uri in declarations)
+					declarations = ''.join(' xmlns%s=%s' % (':' + prefix if prefix else '', quoteattr(uri))
+						for prefix, uri in declarations)
+					attributes = ''.join(' %s=%s' % (_qualifiedName(key, prefixes), quoteattr(value))
+						for key, value in item.attrib.items())
+					out.write(('<%s%s%s>\n' % (_qualifiedName(item.tag, prefixes), declarations, attributes)).encode())
+				elif len(stack) == 2 and localName(item.tag) in STREAMED_SECTIONS:
+					out.write(('  <%s>\n' % _qualifiedName(item.tag, prefixes)).encode())
+				continue
+
+			stack.pop()
+			if len(stack) == 0:
+				out.write(('</%s>\n' % _qualifiedName(item.tag, prefixes)).encode())
+			elif len(stack) == 1:
+				if localName(item.tag) in STREAMED_SECTIONS:
+					out.write(('  </%s>\n' % _qualifiedName(item.tag, prefixes)).encode())
+				else:
+					# generator and the like are copied as they are
+					out.write(b'  ' + _serialize(item, declared) + b'\n')
+				stack[-1].remove(item)
+			elif len(stack) == 2 and localName(stack[-1].tag) in STREAMED_SECTIONS:
+				if item.get('id') in keep:
+					out.write(b'    ' + _serialize(item, declared) + b'\n')
+				stack[-1].remove(item)
+
+# Returns (reduced feed, {dropped definition id: result}) for the manifest of version,
+# building the reduced feed only if it is not in the cache yet
+# loadEvaluator returns the OvalEvaluator of the feed, it is only called on a cache miss
+# digest returns the sha256 of a file
+def trimFeed(loadEvaluator, feed, manifestFile, version, directory=TRIMMED_DIR, digest=fileDigest):
+	os.makedirs(directory, exist_ok=True)
+	key = '%s-%s-%s' % (version, digest(manifestFile)[:16], digest(feed)[:16])
+	trimmed = os.path.join(directory, '%s.usn.oval.xml' % key)
+	verdicts = os.path.join(directory, '%s.dropped.json' % key)
+	if os.path.exists(trimmed) and os.path.exists(verdicts):
+		print ("Using reduced feed %s" % trimmed)
+		with open(verdicts, 'r') as verdictFile:
+			return (trimmed, json.load(verdictFile))
+
+	evaluator = loadEvaluator()
+	(keep, dropped) = partitionDefinitions(evaluator, readManifest(manifestFile))
+	print ("Reducing %s to %d of %d definitions for %s" % (feed, len(keep), len(keep) + len(dropped), version))
+	# Older reduced feeds for this version are of no use anymore
+	for stale in glob.glob(os.path.join(directory, '%s-*' % version)):
+		os.remove(stale)
+	writeTrimmedDocument(feed, closure(evaluator.references, keep), trimmed + '.tmp')
+	with open(verdicts + '.tmp', 'w') as verdictFile:
+		json.dump(dropped, verdictFile)
+	os.replace(verdicts + '.tmp', verdicts)
+	os.replace(trimmed + '.tmp', trimmed)
+	return (trimmed, dropped)
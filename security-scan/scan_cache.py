@@ -0,0 +1,56 @@
+#!/bin/env python3
+
+# Cache of the per-version scan results, keyed by the content of what produced them:
+# the manifest of the version, the USN feed of its distro, the engine that evaluated it and
+# whether oscap was given a reduced feed (--trim, see oval_trim).
+# When none of these changed since the last scan, the USN map and stats of the version are
+# served from the cache instead of being evaluated again.
+# Only the latest entry of each version is kept, in scan_cache/[version].json
+
+import hashlib, json, os
+
+CACHE_DIR = 'scan_cache'
+# Bump when the content of the USN maps changes, so existing entries are not used anymore
+CACHE_VERSION = 2
+
+class ScanCache:
+	def __init__(self, directory=CACHE_DIR, force=False):
+		self.directory = directory
+		self.force = force
+		self.hits = 0
+		self.misses = 0
+		os.makedirs(directory, exist_ok=True)
+
+	# The verdicts of a reduced feed are meant to be those of the full one, but they come
+	# partly from the built-in evaluator: trimmed results are not served for untrimmed scans
+	def key(self, manifestDigest, feedDigest, engine, trim=False):
+		return hashlib.sha256(('%s %s %s %s %s' % (CACHE_VERSION, manifestDigest, feedDigest, engine,
+			'trim' if trim else 'full')).encode()).hexdigest()
+
+	def _filename(self, version):
+		return os.path.join(self.directory, '%s.json' % version)
+
+	# Returns (USN map, stats) for version if cached under key, None otherwise
+	def get(self, version, key):
+		entry = None
+		if not self.force:
+			try:
+				with open(self._filename(version), 'r') as cacheFile:
+					entry = json.load(cacheFile)
+			except (OSError, ValueError):
+				entry = None
+		if entry is None or entry.get('key') != key:
+			self.misses += 1
+			return None
+		self.hits += 1
+		return (entry['usns'], entry['stats'])
+
+	def put(self, version, key, usnMap, stats):
+		filename = self._filename(version)
+		with open(filename + '.tmp', 'w') as cacheFile:
+			json.dump({'key': key, 'usns': usnMap, 'stats': stats}, cacheFile)
+		os.replace(filename + '.tmp', filename)
+
+	def summary(self):
+		return '%d version(s) served from cache, %d evaluated%s' % (self.hits, self.misses,
+			' (forced)' if self.force else '')
@@ -0,0 +1,160 @@
+#!/bin/env python3
+
+# History of the scans: the USN verdicts of every version, kept across runs in a SQLite
+# database (scan_history.db) so that we can tell when something changed without keeping
+# old reports around.
+# The store is append-only and delta encoded: a scan only records the (version, usn)
+# verdicts that differ from the previous ones, a NULL result meaning the USN is gone from
+# the version. The stats of each version (and their totals) are recorded at every scan.
+# Only the last HISTORY_SCANS scans are kept, and the database is kept under HISTORY_BYTES:
+# older scans are folded into the oldest one kept, which loses what changed before it.
+#
+#   scan_history.py changes 42        what changed since scan 42
+#   scan_history.py trend [version]   fixed/present per severity, scan after scan
+#   scan_history.py first-present     the scan each USN was first seen present in
+
+import argparse, json, sqlite3, time
+
+HISTORY_FILE = 'scan_history.db'
+HISTORY_SCANS = 365
+HISTORY_BYTES = 16 << 20
+# The version the totals of all the versions are recorded under
+TOTALS = 'total'
+
+class ScanHistory:
+	def __init__(self, filename=HISTORY_FILE, keep=HISTORY_SCANS, maxBytes=HISTORY_BYTES):
+		self.keep = keep
+		self.maxBytes = maxBytes
+		self.db = sqlite3.connect(filename)
+		# Only effective on a new database, before any table is created
+		self.db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS scans (scan INTEGER PRIMARY KEY, time REAL);
+			CREATE TABLE IF NOT EXISTS usns (id INTEGER PRIMARY KEY, usn TEXT UNIQUE, severity TEXT);
+			CREATE TABLE IF NOT EXISTS verdicts (scan INTEGER, version TEXT, usn INTEGER, result TEXT,
+				PRIMARY KEY (scan, version, usn)) WITHOUT ROWID;
+			CREATE INDEX IF NOT EXISTS verdicts_usn ON verdicts (version, usn, scan);
+			CREATE INDEX IF NOT EXISTS verdicts_present ON verdicts (usn, version, scan) WHERE result = 'true';
+			CREATE TABLE IF NOT EXISTS stats (scan INTEGER, version TEXT, severity TEXT, fixed INTEGER,
+				present INTEGER, PRIMARY KEY (scan, version, severity)) WITHOUT ROWID;
+		''')
+		self.usnIds = dict(self.db.execute('SELECT usn, id FROM usns'))
+
+	def _usnId(self, usn, severity):
+		if usn not in self.usnIds:
+			self.usnIds[usn] = self.db.execute('INSERT INTO usns (usn, severity) VALUES (?, ?)', (usn, severity)).lastrowid
+		return self.usnIds[usn]
+
+	# The latest verdict of each USN of version: usn id -> result
+	def _state(self, version):
+		state = {}
+		for (usn, result) in self.db.execute('SELECT usn, result FROM verdicts WHERE version=? ORDER BY scan', (version,)):
+			state[usn] = result
+		return dict((usn, result) for usn, result in state.items() if result is not None)
+
+	# Records a scan: the USN maps of the versions scanned (see buildUsnMap), their
+	# generateData stats and the stats of their totals. Versions that were not scanned keep
+	# their verdicts. Returns the number of the scan
+	def record(self, maps, results, totals):
+		with self.db:
+			scan = self.db.execute('INSERT INTO scans (time) VALUES (?)', (time.time(),)).lastrowid
+			for version, usnMap in maps.items():
+				state = self._state(version)
+				rows = []
+				for usn, data in usnMap.items():
+					usnId = self._usnId(usn, data['severity'])
+					if state.pop(usnId, None) != data['result']:
+						rows.append((scan, version, usnId, data['result']))
+				rows.extend((scan, version, usnId, None) for usnId in state.keys())
+				self.db.executemany('INSERT INTO verdicts VALUES (?, ?, ?, ?)', rows)
+			for version, stats in list(results.items()) + [(TOTALS, totals)]:
+				self.db.executemany('INSERT INTO stats VALUES (?, ?, ?, ?, ?)',
+					((scan, version, severity, counts['fixed'], counts['present']) for severity, counts in stats.items()))
+		self.prune()
+		return scan
+
+	def size(self):
+		(pages, free, pageSize) = [self.db.execute('PRAGMA %s' % pragma).fetchone()[0]
+			for pragma in ('page_count', 'freelist_count', 'page_size')]
+		return (pages - free) * pageSize
+
+	# Drops the scans beyond the retention limits
+	def prune(self):
+		scans = [row[0] for row in self.db.execute('SELECT scan FROM scans ORDER BY scan DESC')]
+		keep = self.keep
+		while len(scans) > 1:
+			if len(scans) > keep:
+				self._fold(scans[keep - 1])
+				scans = scans[:keep]
+			if self.size() <= self.maxBytes:
+				break
+			keep = max(1, len(scans) * 9 // 10)
+		self.db.execute('PRAGMA incremental_vacuum')
+
+	# Forgets the scans before oldest. The verdicts they recorded are only kept where they
+	# are still the latest ones as of oldest, so the verdicts of every scan kept are unchanged
+	def _fold(self, oldest):
+		with self.db:
+			self.db.execute('DELETE FROM scans WHERE scan < ?', (oldest,))
+			self.db.execute('DELETE FROM stats WHERE scan < ?', (oldest,))
+			self.db.execute('''DELETE FROM verdicts WHERE scan < :oldest AND (result IS NULL OR scan < (
+				SELECT MAX(scan) FROM verdicts AS later WHERE later.version = verdicts.version
+					AND later.usn = verdicts.usn AND later.scan <= :oldest))''', {'oldest': oldest})
+
+	def scans(self):
+		return self.db.execute('SELECT scan, time FROM scans ORDER BY scan').fetchall()
+
+	# The verdicts that changed after scan since, in the order they changed:
+	# [{scan, version, usn, severity, result}], result being None for the USNs that are gone
+	def changes(self, since, version=None):
+		query = 'SELECT scan, version, usns.usn, severity, result FROM verdicts JOIN usns ON usns.id = verdicts.usn WHERE scan > ?'
+		params = [since]
+		if version is not None:
+			query += ' AND version = ?'
+			params.append(version)
+		return [dict(zip(('scan', 'version', 'usn', 'severity', 'result'), row))
+			for row in self.db.execute(query + ' ORDER BY scan, version, verdicts.usn', params)]
+
+	# The stats of version at every scan kept: [(scan, time, {severity: {fixed, present}})]
+	def trend(self, version=TOTALS):
+		trend = []
+		for (scan, scanTime, severity, fixed, present) in self.db.execute('''SELECT scans.scan, time, severity, fixed, present
+				FROM stats JOIN scans ON scans.scan = stats.scan WHERE version = ? ORDER BY scans.scan''', (version,)):
+			if not trend or trend[-1][0] != scan:
+				trend.append((scan, scanTime, {}))
+			trend[-1][2][severity] = {'fixed': fixed, 'present': present}
+		return trend
+
+	# The scan each USN was first seen present in (since the oldest scan kept):
+	# {(version, usn): scan}, for one USN or all of them
+	# Verdicts folded into the oldest scan kept keep the scan they were recorded in, which is
+	# no longer in the history: they count as seen in the oldest scan kept
+	def firstPresent(self, usn=None):
+		query = "SELECT version, usns.usn, MAX(MIN(scan), (SELECT MIN(scan) FROM scans)) FROM verdicts JOIN usns ON usns.id = verdicts.usn WHERE result = 'true'"
+		params = []
+		if usn is not None:
+			query += ' AND usns.usn = ?'
+			params.append(usn)
+		return dict(((version, usn), scan) for (version, usn, scan) in self.db.execute(query + ' GROUP BY version, verdicts.usn', params))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Query the history of the scans')
+	parser.add_argument('--file', default=HISTORY_FILE, help='history database (default: %(default)s)')
+	commands = parser.add_subparsers(dest='command', required=True)
+	changes = commands.add_parser('changes', help='verdicts changed since a scan')
+	changes.add_argument('since', type=int)
+	changes.add_argument('--version')
+	trend = commands.add_parser('trend', help='fixed and present USNs per severity, scan after scan')
+	trend.add_argument('version', nargs='?', default=TOTALS)
+	firstPresent = commands.add_parser('first-present', help='the scan each USN was first seen present in')
+	firstPresent.add_argument('--usn')
+	args = parser.parse_args()
+
+	history = ScanHistory(args.file)
+	if args.command == 'changes':
+		output = history.changes(args.since, args.version)
+	elif args.command == 'trend':
+		output = [{'scan': scan, 'time': scanTime, 'stats': stats} for (scan, scanTime, stats) in history.trend(args.version)]
+	else:
+		output = [{'version': version, 'usn': usn, 'scan': scan} for (version, usn), scan in sorted(history.firstPresent(args.usn).items())]
+	print (json.dumps(output, indent=1))
@@ -1,80 +1,84 @@
 #!/bin/env python3
 
-from bs4 import BeautifulSoup
-import shutil, subprocess, os, requests, bz2, time
+# The modules that parse and download the feeds take a while to import, which matters on
+# small boards: they are only imported when a scan needs them, so that --help is quick and
+# a scan with nothing to evaluate does not pay for lxml or requests
+import argparse, atexit, gzip, hashlib, json, resource, subprocess, os, sys, time, traceback
+from contextlib import contextmanager
 from datetime import datetime
-from snap_manifest import main as refreshManifests
 
 # This updates files if necessary
-def updateFiles(version):
-	def downloadFile(url, file):
-		# Can I download it?
-		try:
-			response = requests.get(url)
-			if os.path.isfile(file):
-				os.remove(file)
-			open("%s" % file, 'wb').write(bz2.decompress(response.content))
-			if not os.path.isfile(file):
-				return False
-			return True
-		except Exception as e:
-			print (e)
-			return False
-
+def updateFiles(version, session=None):
+	from downloader import OVAL_BASE_URL, age, downloadFile
 
 	def getFile(filename):
+		url = '%s/%s.bz2' % (OVAL_BASE_URL, filename)
 		# Is the file present?
 		if (os.path.isfile(filename)):
-			# Has it been updated within the last 24 hours?
-			if (time.time() - os.path.getmtime(filename) < 86400):
+			# Has it been checked within the last 24 hours?
+			if (age(filename) < 86400):
 				print ("%s exists and has been updated during last 24 hours" % filename)
 				return True
 			else:
-				if not downloadFile('https://security-metadata.canonical.com/oval/%s.bz2' % filename, filename):
+				if not downloadFile(url, filename, session):
 					print ("%s could not be retrieved, but there is an old copy locally, analysis will still proceed" % filename)
 		else:
-			if not downloadFile('https://security-metadata.canonical.com/oval/%s' % filename, filename):
+			if not downloadFile(url, filename, session):
 				print ("%s could not be retrieved, and there is no local copy, analysis will stop" % filename)
 				return False
 		return True
 				
-	# We have two files to update
-	# oci.com.ubuntu.[version].pkg.oval.xml
-	# oci.com.ubuntu.[version].usn.oval.xml
-	pkgFile = "oci.com.ubuntu.%s.pkg.oval.xml" % version
-	usnFile = "oci.com.ubuntu.%s.usn.oval.xml" % version
-	cveFile = "com.ubuntu.%s.cve.oval.xml" % version
-	return (getFile(pkgFile) and getFile(usnFile) and getFile(cveFile))
+	return all(getFile(filename) for filename in feedFiles(version))
+
+# We have three files to update
+# oci.com.ubuntu.[version].pkg.oval.xml
+# oci.com.ubuntu.[version].usn.oval.xml
+# com.ubuntu.[version].cve.oval.xml
+def feedFiles(version):
+	return ["oci.com.ubuntu.%s.pkg.oval.xml" % version, "oci.com.ubuntu.%s.usn.oval.xml" % version,
+		"com.ubuntu.%s.cve.oval.xml" % version]
+
+# Joins definitions, as (id, title, severity, [cve, ...]), with their oscap result
+# into a USN map: usn -> {id, result, severity, cve}
+# Definitions without a result (a report from another feed, or a truncated one) are skipped
+def buildUsnMap(definitions, resultMap):
+	usnMap = {}
+	for (id, title, severity, cves) in definitions:
+		result = resultMap.get(id)
+		if result is None:
+			print ('Skipping %s: no result' % id)
+			continue
+		parts = title.split(' -- ')
+		usnMap[parts[0]]= {'id':id,
+			'result': result,
+			'severity': severity, 'cve':cves}
+	return usnMap
 
 # Analyze the output from command
 # oscap oval eval --results report.xml oci.com.ubuntu.[version].usn.oval.xml
 # in presence of the proper manifest file
+# The report is streamed: definitions come first in the file, results last, so we keep
+# the (small) metadata of each definition and join it with its result at the end
 def analyzeOscapOciReport(filename):
-	usnMap = {}
+	from oval_stream import iterElements, usnDefinitionInfo
 	resultMap = {}
-	xmlFile = open(filename, 'r')
-	contents = xmlFile.read()
-	soup = BeautifulSoup(contents, 'xml')
-	results = soup.find('results')
-	definitions = soup.find('definitions')
-	defs = definitions.find_all('definition')
-
-	resultDefs = results.find_all('definition')
-	for result in resultDefs:
-		resultMap[result['definition_id']] = result['result']
-
-	for definition in defs:
-		title = definition.find('title').text
-		parts = title.split(' -- ')
-		severity = definition.find('severity').text
-		cves = []
-		for cve in definition.find_all('cve'):
-			cves.append(cve.text)
-		usnMap[parts[0]]= {'id':definition['id'], 
-			'result': resultMap[definition['id']],
-			'severity': severity, 'cve':cves}
-
-	return usnMap
+	definitions = []
+	for path, element in iterElements(filename, ['definition']):
+		if 'results' in path:
+			resultMap[element.get('definition_id')] = element.get('result')
+		elif path[-1] == 'definitions':
+			definitions.append((element.get('id'),) + usnDefinitionInfo(element))
+	return buildUsnMap(definitions, resultMap)
+
+# Only reads the results of an oscap report: definition id -> result
+# The definitions themselves are the ones of the USN feed, see USNIndex
+def analyzeOscapResults(filename):
+	from oval_stream import iterElements
+	resultMap = {}
+	for path, element in iterElements(filename, ['definition']):
+		if 'results' in path:
+			resultMap[element.get('definition_id')] = element.get('result')
+	return resultMap
 
 
 # This function takes the dictionary we generated from an oscap report
@@ -126,11 +130,65 @@ def getCVETotalsFromUSNs(dict):
 					cves[cve] = False
 	return cves
 
+# Replaces filename with data (bytes) so that readers see the old or the new content, never
+# part of it: the data goes to a temporary file, is flushed to disk, then renamed over filename
+def writeAtomically(filename, data):
+	with open(filename + '.tmp', 'wb') as tmpFile:
+		tmpFile.write(data)
+		tmpFile.flush()
+		os.fsync(tmpFile.fileno())
+	os.replace(filename + '.tmp', filename)
+	directory = os.open(os.path.dirname(filename) or '.', os.O_RDONLY)
+	try:
+		os.fsync(directory)
+	finally:
+		os.close(directory)
+
+# Writes a rendered report with filename.gz, for the server to send as is to the clients
+# accepting gzip, and filename.sha256, the hash of the report. The report is renamed last:
+# the server only uses the sidecars when they match the report it read
+def writeReport(filename, content):
+	data = content.encode()
+	writeAtomically(filename + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+	writeAtomically(filename + '.sha256', hashlib.sha256(data).hexdigest().encode())
+	writeAtomically(filename, data)
+
+# The reports, rendered in memory with str.format
+REPORT_FOOTER = ('<tr><td colspan="6" style="background-color: #111;" width="100%"><h3><center>Last updated on '
+	'{updated}</center></h3></td></tr></table>')
+USN_STATS_TEMPLATE = ('<table border="0" width="100%" padding="3" spacing="10">\n'
+	'   <tr>\n'
+	"       <th style='background-color: #111;' width='100%'><h2><img src='security.svg' height='30'>&nbsp;&nbsp;USN on the system & fixes (Beta)</h2></th>\n"
+	'   </tr><tr><td valign="top">\n'
+	'      <div class="tableFixHead">'
+	'      <table border="0" width="100%">'
+	'<thead> <tr>'
+	'      <th>Source</th><th>Critical</th><th>High</th><th>Medium</th><th>Low</th><th>Other</th>\n'
+	'   </tr></thead><tbody><tr>\n'
+	'      <td><b>Total</b></td>{totals}\n'
+	'   </tr>\n'
+	'{rows}'
+	'</tbody></table></td></tr>' + REPORT_FOOTER)
+USN_STATS_ROW = '   <tr>\n      <td><b>{version}</b></td>{cells}\n   </tr>\n'
+USN_STATS_CELL = "<td><font color='grey'><b>{total}</b></font><br>{fixed} fixed ({percentage})</td>"
+CVE_STATS_TEMPLATE = ('<table border="0" width="100%" padding="3" spacing="10">\n'
+	'   <tr>\n'
+	"       <th style='background-color: #111;' width='100%'><h2><img src='security.svg' height='30'>&nbsp;&nbsp;CVEs this system is protected against (Beta)</h2></th>\n"
+	'   </tr><tr><td valign="top">\n'
+	'      <div class="tableFixHead">'
+	'      <table border="0" width="100%">'
+	'<thead> <tr>'
+	'      <th><h3>Critical</h3></th><th><h3>High</h3></th><th><h3>Medium</h3></th><th><h3>Low</h3></th>\n'
+	'   </tr></thead>\n'
+	'   <tbody><tr>\n'
+	'   <td align="center"><h3>{critical}</h3></td><td align="center"><h3>{high}</h3></td><td align="center"><h3>{medium}</h3></td><td align="center"><h3>{low}</h3></td>'
+	'</tr></tbody></table></td></tr>' + REPORT_FOOTER)
+
 # This function generates an HTML report that is essentially a table
 # showing the vulnerabilities + fixed metrics
 def generateUSNStats(dicts, filename, totals):
 	def printResultLine(dict):
-		myString = ""
+		cells = []
 		for key in dict.keys():
 			total = int(dict[key]['fixed']) + int(dict[key]['present'])
 			fixed = int(dict[key]['fixed'])
@@ -139,337 +197,525 @@ def generateUSNStats(dicts, filename, totals):
 				percentage = '%.1f%%' % (100 * fixed/total)
 			except ZeroDivisionError:
 				percentage = '-'
-			myString += "<td><font color='grey'><b>%s</b></font><br>%s fixed (%s)</td>" % (total, fixed, percentage)
-		return myString
-
-	with open(filename, 'w') as htmlFile:
-		#svg = '<svg width="16" height="16" viewBox="0 0 16 16" fill="none"><path fill-rule="evenodd" clip-rule="evenodd" d="M11.0738 3.0246C10.1673 2.72243 9.14268 2.04756 8 1C7.04053 1.98649 6.0124 2.66253 4.91563 3.02812C3.81885 3.39372 2.84698 3.38434 2 3L2.58477 9.01727C2.81947 11.8337 7 15 8 15L8.22808 14.9953C8.89351 14.9677 13.1869 11.7576 13.4152 9.01727L14 3C12.9557 3.31857 11.9803 3.32677 11.0738 3.0246ZM7.91889 3.08225L8.031 2.991L8.14723 3.08114C8.99972 3.72847 9.81311 4.18551 10.5995 4.44762L10.8808 4.53358C11.2578 4.63839 11.642 4.70402 12.0323 4.73106L12.323 4.744L11.9223 8.87218L11.9036 9.01558C11.7672 9.79921 11.0439 10.8781 9.94163 11.9464C9.44337 12.4293 8.90405 12.8742 8.43048 13.2037L8.31427 13.283C8.2391 13.3334 8.16875 13.3784 8.10468 13.4176L8.035 13.458L8.00489 13.4441C7.88312 13.3844 7.73462 13.3002 7.56968 13.1954C7.09092 12.891 6.54589 12.461 6.04049 11.9792L5.82924 11.7724C4.79787 10.736 4.144 9.66559 4.07959 8.8927L3.68 4.787L4.03684 4.75824C4.47846 4.70726 4.93023 4.6044 5.38997 4.45115C6.28031 4.15437 7.12373 3.696 7.91889 3.08225Z"/></svg>'
-		htmlFile.write('<table border="0" width="100%" padding="3" spacing="10">\n')
-		htmlFile.write('   <tr>\n')
-		htmlFile.write("       <th style='background-color: #111;' width='100%'><h2><img src='security.svg' height='30'>&nbsp;&nbsp;USN on the system & fixes (Beta)</h2></th>\n")
-		htmlFile.write('   </tr><tr><td valign="top">\n')
-		htmlFile.write('      <div class="tableFixHead">')
-		htmlFile.write('      <table border="0" width="100%">')
-		htmlFile.write('<thead> <tr>')
-		htmlFile.write('      <th>Source</th><th>Critical</th><th>High</th><th>Medium</th><th>Low</th><th>Other</th>\n')
-		htmlFile.write('   </tr></thead><tbody><tr>\n')
-		htmlFile.write('      <td><b>Total</b></td>%s\n' % printResultLine(totals))
-		htmlFile.write('   </tr>\n')
-		for version in dicts.keys():
-			htmlFile.write('   <tr>\n')
-			htmlFile.write('      <td><b>%s</b></td>%s\n' % (version, printResultLine(dicts[version])))
-			htmlFile.write('   </tr>\n')
-		htmlFile.write('</tbody></table></td></tr>')
-		htmlFile.write('<tr><td colspan="6" style="background-color: #111;" width="100%"><h3><center>Last updated on ' + datetime.now().strftime("%Y-%m-%d %H:%M") + '</center></h3></td></tr></table>' )
-
-def analyzeCVEFile(filename, dict):
-	print ("Indexing CVEs in %s" % filename)
-	xmlFile = open(filename, 'r')
-	contents = xmlFile.read()
-	soup = BeautifulSoup(contents, 'lxml')
-	definitions_meta = soup.find('definitions')
-	# For each definition
-	classes = []
-	definitions = definitions_meta.find_all("definition")
-	
-	for definition in definitions:
-		if definition['class'][0] == 'vulnerability':
-			title = definition.find('title').text.split(' ')[0]
-			description = definition.find('description').text
-			severity = definition.find('severity').text
-			date = definition.find('public_date').text
-			dict[title] = {"title":title, "description":description, "severity": severity, "date": date}
-	return dict
-
-# This function takes a list of CVEs that are relevant, then looks them up in a dict
+			cells.append(USN_STATS_CELL.format(total=total, fixed=fixed, percentage=percentage))
+		return ''.join(cells)
+
+	rows = ''.join(USN_STATS_ROW.format(version=version, cells=printResultLine(dicts[version])) for version in dicts.keys())
+	writeReport(filename, USN_STATS_TEMPLATE.format(totals=printResultLine(totals), rows=rows,
+		updated=datetime.now().strftime("%Y-%m-%d %H:%M")))
+
+# This function takes a list of CVEs that are relevant, then looks up their severity in the CVE index
 # It then generates a table of CVEs that have been taken care of
 def generateCVEStats(relevant_cves, cve_info, filename):
 	severity_stats = {'critical':0, 'high':0, 'medium':0, 'low':0, 'negligible':0}
+	severities = cve_info.severities(relevant_cves)
 	for cve in relevant_cves:
 		try:
-			severity_stats[cve_info[cve]['severity'].lower()] += 1
+			severity_stats[severities[cve].lower()] += 1
 		except:
 			print ('Skipping %s' % cve)
 
-	with open(filename, 'w') as htmlFile:
-		htmlFile.write('<table border="0" width="100%" padding="3" spacing="10">\n')
-		htmlFile.write('   <tr>\n')
-		htmlFile.write("       <th style='background-color: #111;' width='100%'><h2><img src='security.svg' height='30'>&nbsp;&nbsp;CVEs this system is protected against (Beta)</h2></th>\n")
-		htmlFile.write('   </tr><tr><td valign="top">\n')
-		htmlFile.write('      <div class="tableFixHead">')
-		htmlFile.write('      <table border="0" width="100%">')
-		htmlFile.write('<thead> <tr>')
-		htmlFile.write('      <th><h3>Critical</h3></th><th><h3>High</h3></th><th><h3>Medium</h3></th><th><h3>Low</h3></th>\n')
-		htmlFile.write('   </tr></thead>\n')
-		htmlFile.write('   <tbody><tr>\n')
-		htmlFile.write('   <td align="center"><h3>%s</h3></td><td align="center"><h3>%s</h3></td><td align="center"><h3>%s</h3></td><td align="center"><h3>%s</h3></td>' % (severity_stats['critical'], severity_stats['high'], severity_stats['medium'], severity_stats['low']))
-		htmlFile.write('</tr></tbody></table></td></tr>')
-		htmlFile.write('<tr><td colspan="6" style="background-color: #111;" width="100%"><h3><center>Last updated on ' + datetime.now().strftime("%Y-%m-%d %H:%M") + '</center></h3></td></tr></table>' )
-		
-		'''htmlFile.write('<table border="0" width="100%" padding="3" spacing="10">\n')
-		htmlFile.write('   <tr>\n')
-		htmlFile.write("       <th style='background-color: #111;' width='100%'><h2><img src='security.svg' height='30'>&nbsp;&nbsp;USN on the system & fixes</h2></th>\n")
-		htmlFile.write('   </tr><tr><td valign="top">\n')
-		htmlFile.write('      <div class="tableFixHead">')
-		htmlFile.write('      <table border="0" width="100%">')
-		htmlFile.write('<thead> <tr>')
-		htmlFile.write('      <th>CVE</th><th>Severity</th><th>Date</th>\n')
-		htmlFile.write('   </tr></thead>\n')
-		htmlFile.write('   <tbody>\n')
-		for cve in relevant_cves:
-			try:
-				mickey = cve_info[cve]
-				htmlFile.write('   <tr>\n')
-				#print (cve_info[cve])
-				htmlFile.write('      <td><b>%s</b></td><td>%s</td><td>%s</td>\n' % (cve, cve_info[cve]['severity'], cve_info[cve]['date']))
-				htmlFile.write('   </tr>\n')
-			except Exception:
-				print ('skipped CVE %s' % cve)
-				pass
-		htmlFile.write('</tbody></table></td></tr>')
-		htmlFile.write('<tr><td colspan="6" style="background-color: #111;" width="100%"><h3><center>Last updated on ' + datetime.now().strftime("%Y-%m-%d %H:%M") + '</center></h3></td></tr></table>' )
-		'''
-
-'''# This takes an OCI PCK file and returns a dictionary as follows:
-# Package -> {{usn->[cve]}, component}
-def analyzePkgFile(filename):
-	# At this point in time, the file manifest should be relative to the version we selected
-	# This file lists all packages used (last column)
-	# We need that info to limit the size of our pkgMap to what is relevant to us
-	relevantPkg = []
-	with open('manifest', 'r') as manifestFile:
-		lines = manifestFile.readlines()
-		for line in lines:
-			columns = line.replace('\n','').split(' ')
-			relevantPkg.append(columns[0])
-	pkgMap = {}
-	xmlFile = open(filename, 'r')
-	contents = xmlFile.read()
-	soup = BeautifulSoup(contents, 'xml')
-	definitions = soup.find_all('definitions')
-	for definition in definitions:
-		package = definition.find('title').text
-		if not package in relevantPkg:
-			continue
-		component = definition.find('component').text
-		usn = {}
-		for cve in definition.find_all('cve'):
-			if 'usns' in cve.attrs.keys():
-				for usnEntry in cve['usns'].replace(' ','').split(','):
-					if usnEntry in usn.keys():
-						usn[usnEntry].append(cve.text)
-					else:
-						usn[usnEntry] = [cve.text]
-
-		pkgMap[package] = {'usn':usn, 'component':component}
-
-	return pkgMap
-
-# This takes a pkg file and turns it into the following dict:
-# usn -> component
-def analyzePkgFileFromUsn(filename):	
-	pkgMap = {}
-	xmlFile = open(filename, 'r')
-	contents = xmlFile.read()
-	soup = BeautifulSoup(contents, 'xml')
-	definitions = soup.find_all('definitions')
-	for definition in definitions:
-		package = definition.find('title').text
-		component = definition.find('component').text
-		for cve in definition.find_all('cve'):
-			if 'usns' in cve.attrs.keys():
-				for usnEntry in cve['usns'].replace(' ','').split(','):
-					if usnEntry in pkgMap.keys() and pkgMap[usnEntry] != component:
-						print ('%s is affecting two components: %s, %s' % (usnEntry, pkgMap[usnEntry], component))
-					else:
-						pkgMap[usnEntry] = component
-
-	return pkgMap
-
-
-# This takes a pkg file and turns it into the following dict:
-# cve -> [{package, [component]}]
-def analyzeComponents(filename):	
-	cveMap = {}
-	xmlFile = open(filename, 'r')
-	contents = xmlFile.read()
-	soup = BeautifulSoup(contents, 'xml')
-	definitions = soup.find_all('definitions')
-	for definition in definitions:
-		package = definition.find('title').text
-		component = definition.find('component').text
-		for cve in definition.find_all('cve'):
-			if cve.text in cveMap.keys():
-				found = False
-				for entry in cveMap[cve.text]:
-					if entry['package'] == package:
-						if not component in entry['component']:
-							entry['component'].append(component)
-						found = True
-						break
-				if not found:
-					cveMap[cve.text].append({'package':package, 'component':[component]})
-			else:
-				cveMap[cve.text] = [{'package':package, 'component':[component]}]
-
-	return cveMap
-
-# This cross-references two maps to associate fixes and components:
-def crossReferenceUsnComponents(oscap, pkg):
-	resultMap = {'main':{'fixed':0, 'present':0}, 
-			'universe':{'fixed':0, 'present':0}, 
-			'multiverse':{'fixed':0, 'present':0},
-			'other':{'fixed':0, 'present':0}}
-
-	for entry in oscap.keys():
-		# Entry is USN- prefixed. Our pkg file does not have this prefix
-		# Adjust
-		entry = entry[4:]
-		if not entry in pkg.keys():
-			print ("%s could not be found in pkg map" % entry)
-		else:
-			dict = None
-			if pkg[entry] == 'main':
-				dict = resultMap['main']
-			elif pkg[entry] == 'universe':
-				dict = resultMap['universe']
-			elif pkg[entry] == 'multiverse':
-				dict = resultMap['multiverse']
-			else:
-				dict = resultMap['other']
-			if oscap['USN-%s' % entry]['result'] == 'true':
-				dict['present'] += 1
-			else:
-				dict['fixed'] += 1
-	return resultMap
-
-# This cross-references two maps to associate fixes and components:
-def crossReferenceComponents(oscap, pkg):
-	resultMap = {'main':{'fixed':0, 'present':0}, 
-			'universe':{'fixed':0, 'present':0}, 
-			'multiverse':{'fixed':0, 'present':0},
-			'other':{'fixed':0, 'present':0}}
-
-	# Interim map: cve-> {component-> result}
-	interimMap = {}
-
-	for entry in oscap.values():
-		result = entry['result']
-		for cve in entry['cve']:
-			if not cve in pkg.keys():
-				#print ("ERROR: %s not found in pkg keys" % (cve))
-				# Shove them straight to Others
-				if result == 'true':
-					resultMap['other']['fixed'] += 1
-				else:
-					resultMap['other']['fixed'] += 1
-				continue
-			# If 1 result is true, then bug is still present
-			if cve in interimMap.keys():
-				for package in pkg[cve]:
-					for component in package['component']:
-						if component in interimMap[cve].keys():
-							if result == 'true':
-								interimMap[cve][component] = True
-							else:
-								pass # Should ensure 1 CVE answer, and True by default
-						else:
-							# New component
-							if result == 'true':
-								interimMap[cve][component] = True
-							else:
-								interimMap[cve][component] = False
-			else:
-				# New CVE
-				interimMap[cve] = {}
-				for package in pkg[cve]:
-					for component in package['component']:
-						if result == 'true':
-							interimMap[cve][component] = True
-						else:
-							interimMap[cve][component] = False
-		
-	# Now that we have an interim map, score the results
-	for entry in interimMap.values():
-		for component in entry.keys():
-			if entry[component]:
-				resultMap[component]['present'] += 1
+	writeReport(filename, CVE_STATS_TEMPLATE.format(updated=datetime.now().strftime("%Y-%m-%d %H:%M"), **severity_stats))
+
+# Number of scans removed entries are remembered for, in results.json
+RESULTS_HORIZON = 100
+
+# This function writes the results of the scan as JSON, for the consumers of the server API:
+# the stats of each version, the USN verdicts of each version and the CVEs fixed.
+# Every USN verdict and CVE records the scan it last changed in, and the entries that
+# disappeared are remembered for a while, so that consumers can fetch only what changed
+# since the scan they last saw. components has the stats per component of each version and
+# of their totals (under 'total'), attribution the open USNs per snap and package the same way
+# and usnPackages the packages each open USN of a version comes from (see getUsnPackages)
+def generateResults(filename, dicts, totals, maps, fixedCves, cve_info, components, attribution, usnPackages):
+	previous = {}
+	try:
+		with open(filename, 'r') as jsonFile:
+			previous = json.load(jsonFile)
+	except (OSError, ValueError):
+		pass
+	scanId = previous.get('scan_id', 0) + 1
+
+	def track(entries, previousEntries, key):
+		known = dict((key(entry), entry) for entry in previousEntries)
+		for entry in entries:
+			old = known.pop(key(entry), None)
+			if old is not None and all(old.get(field) == value for field, value in entry.items()):
+				entry['changed'] = old['changed']
 			else:
-				resultMap[component]['fixed'] += 1
-
-	return resultMap
-'''
+				entry['changed'] = scanId
+		return known.keys()
+
+	usns = []
+	for version in maps.keys():
+		for usn, data in maps[version].items():
+			entry = {'version': version, 'usn': usn, 'id': data['id'], 'result': data['result'],
+				'severity': data['severity'], 'cve': data['cve']}
+			if usn in usnPackages.get(version, {}):
+				entry['packages'] = [{'package': package, 'version': packageVersion, 'snap': snap}
+					for (package, packageVersion, snap) in sorted(usnPackages[version][usn], key=str)]
+			usns.append(entry)
+	cves = []
+	details = cve_info.lookup(fixedCves)
+	for cve in sorted(fixedCves):
+		cves.append({'cve': cve, 'severity': details.get(cve, {}).get('severity'), 'date': details.get(cve, {}).get('date')})
+
+	# An entry removed earlier and present again is no longer removed
+	present = set(('usn', entry['version'], entry['usn']) for entry in usns) | set(('cve', None, entry['cve']) for entry in cves)
+	removed = [entry for entry in previous.get('removed', []) if entry['changed'] > scanId - RESULTS_HORIZON
+		and (entry['kind'], entry.get('version'), entry['key']) not in present]
+	for (version, usn) in track(usns, previous.get('usns', []), lambda entry: (entry['version'], entry['usn'])):
+		removed.append({'kind': 'usn', 'version': version, 'key': usn, 'changed': scanId})
+	for cve in track(cves, previous.get('cves', []), lambda entry: entry['cve']):
+		removed.append({'kind': 'cve', 'key': cve, 'changed': scanId})
+
+	results = {'scan_id': scanId,
+		'generated': datetime.now().strftime("%Y-%m-%d %H:%M"),
+		# The oldest scan the changes can be asked since, older ones need a full download
+		'horizon': max(previous.get('horizon', scanId - 1), scanId - RESULTS_HORIZON),
+		'versions': dicts,
+		'totals': totals,
+		'components': components,
+		'attribution': attribution,
+		'usns': usns,
+		'cves': cves,
+		'removed': removed}
+	writeAtomically(filename, json.dumps(results, separators=(',', ':')).encode())
+
+# The components fixes are counted for, any other one (restricted, ...) counting as 'other'
+COMPONENTS = ['main', 'universe', 'multiverse', 'other']
+
+# Finds the components of the USNs of a USN map, from the index of the pkg feed (see ComponentIndex):
+# those the feed lists the USN under or, failing that, those of the packages its CVEs are about
+# Returns usn -> {component, ...}
+def getUsnComponents(usnMap, cveComponents, usnComponents):
+	components = {}
+	for usn, data in usnMap.items():
+		found = usnComponents.get(usn)
+		if not found:
+			found = set(component for cve in data['cve'] for (package, component) in cveComponents.get(cve, ()))
+		components[usn] = set(component if component in COMPONENTS else 'other' for component in found) or {'other'}
+	return components
+
+# Same as generateData, per component instead of per severity
+# A USN touching several components counts in each of them
+def generateComponentData(dict, components):
+	results = {}
+	for component in COMPONENTS:
+		results[component] = {'fixed':0, 'present':0}
+	for usn, data in dict.items():
+		key = 'present' if data['result'] == 'true' else 'fixed'
+		for component in components[usn]:
+			results[component][key] += 1
+	return results
 
+# Indexes the contents of a manifest ("package version snap" lines, see snap_manifest.py) by
+# package: package -> [(version, snap), ...], architecture qualifiers being dropped
+def indexProvenance(contents):
+	from oval_eval import ARCH_SUFFIX
+	provenance = {}
+	for line in contents.splitlines():
+		columns = line.split()
+		if len(columns) < 2:
+			continue
+		provenance.setdefault(ARCH_SUFFIX.sub('', columns[0]), []).append((columns[1], columns[2] if len(columns) > 2 else None))
+	return provenance
+
+# Finds where the open USNs of a USN map come from, joining the packages of their definitions
+# (see USNIndex.packages) with the provenance of the manifest (see indexProvenance)
+# Only the versions that meet the states of the definition are blamed: a snap that ships the
+# package at a fixed version is not where the USN comes from
+# Returns usn -> {(package, version, snap), ...} for the USNs that are present
+def getUsnPackages(usnMap, definitionPackages, provenance):
+	from oval_eval import meetsStates
+	found = {}
+	for usn, data in usnMap.items():
+		if data['result'] == 'true':
+			found[usn] = set((package, version, snap) for (package, operator, states) in definitionPackages.get(data['id'], ())
+				for (version, snap) in provenance.get(package, ()) if meetsStates(operator, states, version))
+	return found
+
+# USNs whose packages are not in the manifest (definitions we cannot read) are attributed to this
+UNATTRIBUTED = '(unattributed)'
+
+# The open USNs per snap and per package, by severity like generateData:
+# {'snaps': {snap: {severity: count}}, 'packages': {package: {severity: count}}}
+# A USN coming from several snaps (or packages) counts in each of them
+def generateAttributionData(dict, usnPackages):
+	tables = {'snaps': {}, 'packages': {}}
+	for usn, found in usnPackages.items():
+		severity = dict[usn]['severity'] if dict[usn]['severity'] in ('Critical', 'High', 'Medium', 'Low') else 'Other'
+		for (table, names) in (('snaps', set(snap or UNATTRIBUTED for (package, version, snap) in found)),
+				('packages', set(package for (package, version, snap) in found))):
+			for name in names or [UNATTRIBUTED]:
+				counts = tables[table].setdefault(name, {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0, 'Other': 0})
+				counts[severity] += 1
+	return tables
+
+# Runs oscap for one version and analyzes its report
+# Each version gets its own scratch directory holding the 'manifest' file oscap reads,
+# so that several versions can be evaluated at the same time
+# feed is the OVAL document to evaluate, the full USN feed of the distro by default
+# Returns (oscap stderr, results of the report, usage), the results being None if oscap failed or did not
+# produce a report, and usage the wall time of the evaluation and the CPU time oscap used
+def evaluateVersion(version, distro, feed=None):
+	start = time.perf_counter()
+	from oval_eval import readManifest, versionManifest
+	workdir = os.path.abspath('scan.%s' % version)
+	os.makedirs(workdir, exist_ok=True)
+	# Without the snap column, which the feed patterns would take for part of the version
+	with open(os.path.join(workdir, 'manifest'), 'w') as manifestFile:
+		manifestFile.write(versionManifest(readManifest('manifest.%s' % version)))
+	report = os.path.abspath('report_%s.xml' % version)
+	feed = feed or 'oci.com.ubuntu.%s.usn.oval.xml' % distro
+	# The report of the previous scan must not pass for the results of this one
+	if os.path.exists(report):
+		os.remove(report)
+	before = resource.getrusage(resource.RUSAGE_CHILDREN)
+	output = subprocess.run(['oscap', 'oval', 'eval', '--results', report, os.path.abspath(feed)],
+		cwd=workdir, stderr=subprocess.PIPE)
+	after = resource.getrusage(resource.RUSAGE_CHILDREN)
+	usage = {'cpu_seconds': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)}
+	resultMap = None
+	if output.returncode == 0 and os.path.exists(report):
+		resultMap = analyzeOscapResults(report)
+	usage['seconds'] = time.perf_counter() - start
+	return (output.stderr, resultMap, usage)
+
+# Lists the definitions two engines do not agree on, as (definition id, oscap result, native result)
+def compareResults(oscapResults, nativeResults):
+	mismatches = []
+	for id in oscapResults.keys() | nativeResults.keys():
+		if oscapResults.get(id) != nativeResults.get(id):
+			mismatches.append((id, oscapResults.get(id), nativeResults.get(id)))
+	return sorted(mismatches)
+
+# Writes the log of the scan, one JSON object per line, through a buffer flushed at exit
+# Besides messages, it records timed spans (stages, downloads, evaluation of each version)
+# and keeps their figures for the metrics file the server exposes at /metrics
 class Logger:
-	def __init__(self):
+	def __init__(self, filename='log'):
 		print ('logger reset')
-		self.filePtr = open('log', 'w')
-		self.filePtr.close()
+		self.filePtr = open(filename, 'w', buffering=1 << 16)
+		atexit.register(self.close)
+		self.started = time.time()
+		# A resident worker runs several scans: the figures of this one are the differences
+		self.usage = resource.getrusage(resource.RUSAGE_SELF)
+		self.downloaded = downloadedBytes()
+		self.metrics = {'stage': {}, 'download': {}, 'oscap': {}, 'native': {}}
+		self.currentStage = None
+
+	def record(self, event, **fields):
+		self.filePtr.write(json.dumps(dict({'time': round(time.time(), 3), 'event': event}, **fields)) + '\n')
 
 	def write(self, msg):
-		self.filePtr = open('log', 'a')
 		print ('LOG: %s' % msg)
-		self.filePtr.writelines('%s\n' % msg)
-		self.filePtr.close()
+		self.record('message', msg=msg)
 
-if __name__ == "__main__":
+	# Records a span of kind that took seconds: a stage, the download of the files of a distro,
+	# or the evaluation of a version by oscap or the native engine
+	def recordSpan(self, kind, name, seconds, **fields):
+		self.metrics[kind][name] = dict({'seconds': seconds}, **fields)
+		self.record('span', kind=kind, name=name, seconds=round(seconds, 6), **fields)
+
+	@contextmanager
+	def span(self, kind, name, **fields):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.recordSpan(kind, name, time.perf_counter() - start, **fields)
+
+	# Ends the current stage, if any, and starts the next one
+	# Stages are announced on stdout too, for whoever runs the scan (the server reports it in /status)
+	def stage(self, name):
+		if self.currentStage is not None:
+			self.recordSpan('stage', self.currentStage[0], time.perf_counter() - self.currentStage[1])
+		self.currentStage = (name, time.perf_counter()) if name is not None else None
+		if name is not None:
+			print ('STAGE: %s' % name, flush=True)
+
+	# Ends the last stage and writes the figures of the scan to filename, along with figures
+	def finish(self, filename, **figures):
+		self.stage(None)
+		this = resource.getrusage(resource.RUSAGE_SELF)
+		children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		# ru_maxrss is the peak of the whole process: in a resident worker, the peak of the
+		# largest scan it ran so far, not necessarily of this one. Same for the children
+		metrics = dict(self.metrics, started=self.started, finished=time.time(),
+			seconds=time.time() - self.started,
+			peak_rss_kb=this.ru_maxrss, children_peak_rss_kb=children.ru_maxrss,
+			cpu_seconds=this.ru_utime + this.ru_stime - self.usage.ru_utime - self.usage.ru_stime,
+			oscap_cpu_seconds=sum(usage['cpu_seconds'] for usage in self.metrics['oscap'].values()),
+			downloaded_bytes=downloadedBytes() - self.downloaded, **figures)
+		self.record('metrics', **metrics)
+		writeAtomically(filename, json.dumps(metrics).encode())
+
+	def close(self):
+		if not self.filePtr.closed:
+			self.filePtr.close()
+		atexit.unregister(self.close)
+
+# Bytes downloaded so far by this process (see downloader), which may not have downloaded anything
+def downloadedBytes():
+	downloader = sys.modules.get('downloader')
+	return downloader.bytesDownloaded if downloader is not None else 0
+
+# What a scan can hand over to the next one when they run in the same process (see serve):
+# the feed indexes, and what was parsed from the feeds, kept as long as the feeds do not change
+class ScanState:
+	def __init__(self):
+		from feed_index import CVEIndex, USNIndex, ComponentIndex
+		from artifacts import Artifacts
+		self.cves = CVEIndex()
+		self.usns = USNIndex()
+		self.packages = ComponentIndex()
+		self.artifacts = Artifacts()
+
+# The manifests we know how to scan, and the distro of the feeds each is evaluated against
+VERSIONS = {'core18':'bionic', 'core20':'focal', 'core22':'jammy', 'snapd':'xenial', 'pc-kernel': 'jammy'}
+
+def parseArguments():
+	from scan_history import HISTORY_SCANS
+	parser = argparse.ArgumentParser(description='Scan the snaps of this system against the Ubuntu OVAL data')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+		help='maximum number of oscap evaluations running at the same time (default: number of CPUs)')
+	parser.add_argument('--engine', choices=['oscap', 'native', 'compare'], default='oscap',
+		help='evaluate manifests with oscap, with the built-in evaluator, or with both, logging any disagreement '
+			'(the oscap results are the ones reported)')
+	parser.add_argument('--trim', action='store_true',
+		help='give oscap feeds reduced to the packages of each manifest, the verdicts of the definitions left out '
+			'being the ones of the built-in evaluator (only with --engine oscap)')
+	parser.add_argument('--force', action='store_true',
+		help='evaluate every version, even those whose manifest and feed did not change since the last scan')
+	parser.add_argument('--history-scans', type=int, default=HISTORY_SCANS,
+		help='number of scans kept in the scan history (default: %(default)s)')
+	parser.add_argument('--serve', action='store_true',
+		help='stay resident and run a scan for every "scan" line read on stdin (see serve)')
+	parser.add_argument('--snaps-dir',
+		help='scan the .snap files of this directory (e.g. those of an image) instead of the installed snaps')
+	parser.add_argument('-o', '--output',
+		help='where to write the manifests, feeds and reports of a scan of .snap files (required with --snaps-dir, '
+			'must not be the report directory of the installed snaps)')
+	parser.add_argument('--watch', action='store_true',
+		help='stay resident and scan again as soon as a snap is refreshed, installed or removed, '
+			'or a feed is updated (see watch)')
+	return parser.parse_args()
+
+# Scans the versions present in the current directory and writes the reports there
+# state is what the previous scan of this process left, if any
+# changes is what changed since the previous scan, in watch mode (see watch): then the
+# manifests are only refreshed when snaps changed and the feeds are not checked for updates,
+# instead of refreshing whatever is older than a given age. The versions whose manifest and
+# feed did not change keep their cached results
+# The log and metrics.json are written whether the scan succeeds or not: a resident worker
+# (see serve and watch) carries on after a failed scan, and must not keep its log open
+def runScan(args, state=None, changes=None):
+	logger = Logger()
+	figures = {'failed': True}
+	try:
+		figures = scanStages(logger, args, state, changes)
+	finally:
+		try:
+			logger.finish('metrics.json', **figures)
+		finally:
+			logger.close()
+
+# The stages of runScan, logged to logger, returning the figures of the scan for metrics.json
+def scanStages(logger, args, state, changes):
+	from scan_cache import ScanCache
+	from scan_history import ScanHistory
+	state = state or ScanState()
 	print ("Security scan executing from %s" % os.getcwd())
-	versions = {'core18':'bionic', 'core20':'focal', 'core22':'jammy', 'snapd':'xenial', 'pc-kernel': 'jammy'}
-	cves = {}
+	versions = dict(VERSIONS)
+	cves = state.cves
+	usns = state.usns
+	packages = state.packages
+	artifacts = state.artifacts
+	artifacts.newRun()
+	# The comparison of the engines is the point of compare mode, so it never uses the cache
+	cache = ScanCache(force=args.force or args.engine == 'compare')
 	maps = {}
 	results = {}
 	components = {}
-	logger = Logger()
 
-	# Run this if the manifests files are either non-existent or older than 24 hours
-	for key in versions.keys():
-		if not os.path.exists('manifest.%s' % key) or (time.time() - os.path.getmtime('manifest.%s' % key) > 8640):
+	logger.stage('manifests')
+	if args.snaps_dir:
+		# The snap files are what is scanned, whatever manifests are there already
+		logger.write('Reading the manifests of the snap files in %s' % args.snaps_dir)
+		from snap_manifest import main as refreshManifests
+		refreshManifests(args.snaps_dir, args.jobs)
+	elif changes is not None:
+		logger.write('Scanning again for %s' % changes)
+		if changes.snaps or changes.everything or changes.requested:
 			logger.write('Refreshing manifest files')
+			from snap_manifest import main as refreshManifests
 			refreshManifests()
-			break
+	else:
+		# Run this if the manifests files are either non-existent or older than 24 hours
+		for key in versions.keys():
+			if not os.path.exists('manifest.%s' % key) or (time.time() - os.path.getmtime('manifest.%s' % key) > 8640):
+				logger.write('Refreshing manifest files')
+				from snap_manifest import main as refreshManifests
+				refreshManifests()
+				break
+
+	def fetchFiles(distro):
+		# In watch mode the feeds are kept up to date by watch(), only missing ones are downloaded
+		if changes is not None and all(os.path.isfile(filename) for filename in feedFiles(distro)):
+			return True
+		with logger.span('download', distro):
+			return updateFiles(distro)
 
+	logger.stage('feeds')
+	pending = []
 	for version in versions.keys():
+		distro = versions[version]
 		# Ensure we have the files we need
-		if not updateFiles(versions[version]):
+		if not artifacts.get('files', distro, lambda: fetchFiles(distro)):
 			logger.write("Could not update files for version %s, analysis for this version will be skipped" % version)
 			continue
 
-		cves = analyzeCVEFile("com.ubuntu.%s.cve.oval.xml" % versions[version], cves)
-		print (cves)
-		# First, make sure that the right manifest file gets copied as manifest
+		artifacts.get('cves', distro, lambda: cves.load(distro, "com.ubuntu.%s.cve.oval.xml" % distro))
+		cves.prefer(distro)
 
 		# First jump over any versions we do not need
 		if not os.path.exists('manifest.%s' % version):
 			print ('Version %s not present, continuing' % version)
 			continue
-
-		shutil.copy('manifest.%s' % version, 'manifest')
-		
-		# Run the oscap tool
-		output = subprocess.run(['oscap', 'oval', 'eval', '--results', 'report_%s.xml' % version, 'oci.com.ubuntu.%s.usn.oval.xml' % versions[version]], stderr=subprocess.PIPE)	
-		logger.write('oscap stderr: %s' % output.stderr)
-		
-
-		# You should now have a report_[version].xml report to send for analysis
-		if os.path.exists('report_%s.xml' % version):
-			logger.write('analyzing Oscap OCI')
-			maps[version] = analyzeOscapOciReport('report_%s.xml' % version)
-			logger.write('generating data')
+		pending.append(version)
+
+	# Versions whose manifest and feed did not change since the last scan keep their results
+	cached = {}
+	cacheKeys = {}
+	for version in pending:
+		feed = "oci.com.ubuntu.%s.usn.oval.xml" % versions[version]
+		cacheKeys[version] = cache.key(usns.digest('manifest.%s' % version), usns.digest(feed),
+			'native' if args.engine == 'native' else 'oscap', trim=args.engine == 'oscap' and args.trim)
+		entry = cache.get(version, cacheKeys[version])
+		if entry is not None:
+			cached[version] = entry
+	stale = [version for version in pending if version not in cached]
+
+	def loadEvaluator(distro):
+		from oval_eval import OvalEvaluator
+		feed = "oci.com.ubuntu.%s.usn.oval.xml" % distro
+		return artifacts.get('evaluator', distro, lambda: OvalEvaluator(feed), source=feed)
+
+	logger.stage('evaluation')
+	# oscap only needs to see the definitions that concern the packages of each manifest
+	# The verdicts of the others come from the built-in evaluator: comparing the engines
+	# needs oscap to evaluate everything
+	feeds = {}
+	dropped = {}
+	if args.engine == 'oscap' and args.trim:
+		from oval_trim import trimFeed
+		for version in stale:
+			distro = versions[version]
+			(feeds[version], dropped[version]) = trimFeed(lambda: loadEvaluator(distro),
+				"oci.com.ubuntu.%s.usn.oval.xml" % distro, 'manifest.%s' % version, version, digest=usns.digest)
+
+	# Run the oscap tool for all versions, several at a time if we are allowed to
+	evaluations = {}
+	if args.engine != 'native':
+		if args.jobs > 1 and len(stale) > 1:
+			from concurrent.futures import ProcessPoolExecutor
+			with ProcessPoolExecutor(max_workers=min(args.jobs, len(stale))) as executor:
+				futures = dict((version, executor.submit(evaluateVersion, version, versions[version], feeds.get(version)))
+					for version in stale)
+				for version in stale:
+					evaluations[version] = futures[version].result()
+		else:
+			for version in stale:
+				evaluations[version] = evaluateVersion(version, versions[version], feeds.get(version))
+		for version in stale:
+			(stderr, resultMap, usage) = evaluations[version]
+			logger.recordSpan('oscap', version, usage['seconds'], cpu_seconds=usage['cpu_seconds'])
+			evaluations[version] = (stderr, resultMap)
+			# Put back the verdicts of the definitions oscap did not have to evaluate
+			if resultMap is not None and version in dropped:
+				merged = dict(dropped[version])
+				merged.update(resultMap)
+				evaluations[version] = (stderr, merged)
+
+	# Or evaluate the manifests ourselves, the feed being compiled once per distro
+	if args.engine != 'oscap':
+		from oval_eval import readManifest
+		for version in stale:
+			distro = versions[version]
+			with logger.span('native', version):
+				resultMap = loadEvaluator(distro).evaluate(readManifest('manifest.%s' % version))
+			if args.engine == 'native':
+				evaluations[version] = (None, resultMap)
+			elif evaluations[version][1] is not None:
+				mismatches = compareResults(evaluations[version][1], resultMap)
+				logger.write('Engines disagree on %d definitions for %s%s' % (len(mismatches), version,
+					''.join(['\n  %s: oscap=%s native=%s' % mismatch for mismatch in mismatches[:20]])))
+
+	logger.stage('reports')
+	# Results are merged in the order of the versions map, however the evaluations completed
+	for version in pending:
+		if version in cached:
+			(maps[version], results[version]) = cached[version]
+			logger.write('using cached results for %s' % version)
+			continue
+		(stderr, resultMap) = evaluations[version]
+		distro = versions[version]
+		if stderr is not None:
+			logger.write('oscap stderr for %s: %s' % (version, stderr))
+
+		# You should now have a report_[version].xml report analyzed
+		if resultMap is not None:
+			feed = "oci.com.ubuntu.%s.usn.oval.xml" % distro
+			definitions = artifacts.get('definitions', distro, lambda: usns.definitions(distro, feed), source=feed)
+			maps[version] = buildUsnMap(definitions, resultMap)
+			logger.write('generating data for %s' % version)
 			results[version] = generateData(maps[version])
-			''' Reactivate when (if) we can (or should) resume work on components (main, universe, etc).
-			Code works but doesn't tell us something particularly helpful - probably the wrong analysis
-			components[version] = crossReferenceComponents(maps[version], analyzeComponents('oci.com.ubuntu.%s.pkg.oval.xml' % versions[version]))
-			print (components[version])'''
-			
-
-			#componentsMap = crossReferenceUsnComponents(maps[version], analyzePkgFileFromUsn('oci.com.ubuntu.%s.pkg.oval.xml' % versions[version]))
-			#print (componentsMap)
+			cache.put(version, cacheKeys[version], maps[version], results[version])
 		else:
-			print ('File report_%s.xml was not created by the oscap tool, analysis incomplete')
+			print ('File report_%s.xml was not created by the oscap tool or oscap failed, analysis incomplete' % version)
 			break
 
+	# Fixes per component, the pkg feed of each distro being indexed once
+	usnComponents = {}
+	for version in maps.keys():
+		distro = versions[version]
+		feed = "oci.com.ubuntu.%s.pkg.oval.xml" % distro
+		usnComponents[version] = getUsnComponents(maps[version], *artifacts.get('components', distro,
+			lambda: packages.components(distro, feed), source=feed))
+		components[version] = generateComponentData(maps[version], usnComponents[version])
+
+	# The snaps and packages the open USNs come from, the packages of the definitions of each
+	# distro being indexed once
+	logger.stage('attribution')
+	from oval_eval import readManifest
+	usnPackages = {}
+	attribution = {}
+	for version in maps.keys():
+		distro = versions[version]
+		feed = "oci.com.ubuntu.%s.usn.oval.xml" % distro
+		definitionPackages = artifacts.get('packages', distro, lambda: usns.packages(distro, feed, lambda: loadEvaluator(distro)),
+			source=feed)
+		usnPackages[version] = getUsnPackages(maps[version], definitionPackages, indexProvenance(readManifest('manifest.%s' % version)))
+		attribution[version] = generateAttributionData(maps[version], usnPackages[version])
+
+	logger.write('Per-distro artifacts: %s' % artifacts.summary())
+	logger.write('Result cache: %s' % cache.summary())
+
+	logger.stage('render')
 	# Generate totals
-	totals = generateData(getTotals(maps))
+	totalMap = getTotals(maps)
+	totals = generateData(totalMap)
+	totalComponents = {}
+	for version in usnComponents.keys():
+		for usn, found in usnComponents[version].items():
+			totalComponents.setdefault(usn, set()).update(found)
+	components['total'] = generateComponentData(totalMap, totalComponents)
+	totalPackages = {}
+	for version in usnPackages.keys():
+		for usn, found in usnPackages[version].items():
+			totalPackages.setdefault(usn, set()).update(found)
+	attribution['total'] = generateAttributionData(totalMap, totalPackages)
 	generateUSNStats(results, 'usn_stats.php', totals)
 
 	# Generate CVE list
@@ -482,8 +728,103 @@ if __name__ == "__main__":
 			final_list.append(entry)
 
 	generateCVEStats(final_list, cves, "cve_stats.php")
+	generateResults('results.json', results, totals, maps, final_list, cves, components, attribution, usnPackages)
+	scan = ScanHistory(keep=max(1, args.history_scans)).record(maps, results, totals)
+	logger.write('Recorded scan %d in the scan history' % scan)
+
+	return {'failed': False, 'versions': len(pending), 'cached_versions': cache.hits, 'evaluated_versions': cache.misses}
+
+# Resident worker, for the server (app/main.py): runs a scan every time a 'scan' line is read
+# on stdin, the modules being imported and the feeds parsed once for all of them (see ScanState).
+# The server is told on stdout when the worker is ready and when each scan is done:
+#   READY <seconds since started>
+#   DONE <exit code> <seconds the scan took>
+def serve(args, started):
+	import downloader, oval_eval, oval_trim, scan_cache, snap_manifest
+	state = ScanState()
+	print ('READY %.3f' % (time.time() - started), flush=True)
+	for line in sys.stdin:
+		if line.strip() != 'scan':
+			continue
+		start = time.time()
+		exitCode = 0
+		try:
+			runScan(args, state)
+		except Exception:
+			traceback.print_exc(file=sys.stdout)
+			exitCode = 1
+			# Do not trust what a failed scan left behind
+			state = ScanState()
+		print ('DONE %d %.3f' % (exitCode, time.time() - start), flush=True)
+
+# Watch mode: scans once, then again only when a snap is refreshed, installed or removed, or
+# when a feed is replaced (see snap_watch). The feeds are still checked against the server
+# once they were last checked FEED_MAX_AGE seconds ago, like updateFiles does, but a scan only
+# follows when one of them was actually updated
+FEED_MAX_AGE = 86400
+# How long to wait before checking the feeds again after a check that left one missing or
+# out of date (the server could not be reached, ...)
+FEED_RETRY = 3600
+# Written in the scan directory to ask the watcher for a scan (see app/main.py)
+SCAN_REQUEST = 'scan.request'
+
+def watch(args):
+	import snap_manifest
+	from downloader import age
+	from snap_watch import ScanWatcher
+	distros = sorted(set(VERSIONS.values()))
+	feeds = [filename for distro in distros for filename in feedFiles(distro)]
+	watcher = ScanWatcher(snap_manifest.SNAPDIR, os.getcwd(), feeds, SCAN_REQUEST)
+	print ('Watching %s and the feeds in %s' % (snap_manifest.SNAPDIR, os.getcwd()), flush=True)
+
+	# Returns when the feeds were checked
+	def checkFeeds():
+		for distro in distros:
+			updateFiles(distro)
+		return time.time()
+
+	# The first scan covers whatever the first check downloads
+	lastCheck = checkFeeds()
+	watcher.drain()
+	state = ScanState()
+	changes = None
+	failed = False
+	while True:
+		start = time.time()
+		try:
+			runScan(args, state, changes)
+			failed = False
+		except Exception:
+			traceback.print_exc(file=sys.stdout)
+			# Do not trust what a failed scan left behind, the next one starts over
+			state = ScanState()
+			failed = True
+		print ('Scan done in %.3f seconds' % (time.time() - start), flush=True)
+
+		changes = None
+		while not changes:
+			if all(os.path.isfile(filename) for filename in feeds):
+				due = FEED_MAX_AGE - max(age(filename) for filename in feeds)
+			else:
+				due = 0
+			# A failed download does not make a feed any younger: wait FEED_RETRY after a check
+			# before the next one, rather than checking again every minute
+			timeout = max(60, due, lastCheck + FEED_RETRY - time.time())
+			changes = watcher.wait(timeout)
+			if not changes:
+				lastCheck = checkFeeds()
+		changes.everything = changes.everything or failed
 
-	#print (maps)
-
-	#for entry in components.keys():
-	#	print ("%s: %s" % (entry, components[entry]))
+if __name__ == "__main__":
+	started = time.time()
+	args = parseArguments()
+	if args.serve:
+		serve(args, started)
+	elif args.watch:
+		watch(args)
+	else:
+		if args.snaps_dir:
+			from snap_manifest import audit_output_dir
+			args.snaps_dir = os.path.abspath(args.snaps_dir)
+			os.chdir(audit_output_dir(args.output))
+		runScan(args)
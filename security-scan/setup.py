@@ -8,4 +8,5 @@ setup(
     author_email='eduardo.barretto@canonical.com',
     description='A tool to generate OCI OVAL manifests for an Ubuntu Core system',
     scripts=["security_scan.py"],
+    py_modules=["oval_stream", "feed_index", "downloader", "artifacts", "oval_eval", "oval_trim", "scan_cache", "fleet_scan", "compact", "scan_history", "snap_watch", "bz2par"],
 )
@@ -0,0 +1,161 @@
+#!/bin/env python3
+
+# Watches what a scan depends on, so that a resident scanner (security_scan.py --watch) scans
+# again when something changed instead of polling mtimes:
+# - the `current` symlink of every snap in SNAPDIR, which snapd replaces when a snap is
+#   refreshed or reverted, and SNAPDIR itself for the snaps being installed or removed
+# - the OVAL feeds in the scan directory, which the downloader replaces by renaming
+# - a request file in the scan directory, which the server writes when a scan is asked for
+# inotify is used through ctypes, libc has had its wrappers since glibc 2.9
+# Events come in bursts (a refresh replaces several snaps, a download several feeds): they are
+# collected until none came for DEBOUNCE seconds, or for DEBOUNCE_MAX seconds at most
+
+import ctypes, ctypes.util, errno, os, select, struct, time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of NUL padded name
+EVENT = struct.Struct('iIII')
+
+DEBOUNCE = 2.0
+DEBOUNCE_MAX = 30.0
+
+class Inotify:
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+		if self.fd < 0:
+			error = ctypes.get_errno()
+			raise OSError(error, 'inotify_init1: %s' % os.strerror(error))
+		# Watch descriptor -> path watched
+		self.paths = {}
+
+	def fileno(self):
+		return self.fd
+
+	# Returns the watch descriptor of path, None if path is not a directory (any longer)
+	def addWatch(self, path, mask):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask | IN_ONLYDIR)
+		if wd < 0:
+			error = ctypes.get_errno()
+			if error in (errno.ENOENT, errno.ENOTDIR):
+				return None
+			raise OSError(error, 'inotify_add_watch %s: %s' % (path, os.strerror(error)))
+		self.paths[wd] = path
+		return wd
+
+	# Waits up to timeout seconds (None: forever) for events and returns them as
+	# [(path watched, mask, name)], path being None when events were lost (IN_Q_OVERFLOW)
+	def read(self, timeout=None):
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return []
+		data = os.read(self.fd, 1 << 16)
+		events = []
+		offset = 0
+		while offset < len(data):
+			(wd, mask, cookie, length) = EVENT.unpack_from(data, offset)
+			offset += EVENT.size
+			events.append((self.paths.get(wd), mask, os.fsdecode(data[offset:offset + length].rstrip(b'\0'))))
+			offset += length
+			# The watch is gone, its directory was removed
+			if mask & IN_IGNORED:
+				self.paths.pop(wd, None)
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+# What changed since the last scan: the snaps installed, removed or whose revision changed,
+# and the feeds replaced. everything is set when events were lost, requested when a scan
+# was asked for
+class Changes:
+	def __init__(self):
+		self.snaps = set()
+		self.feeds = set()
+		self.everything = False
+		self.requested = False
+
+	def __bool__(self):
+		return self.everything or self.requested or bool(self.snaps) or bool(self.feeds)
+
+	def __str__(self):
+		if self.everything:
+			return 'everything'
+		parts = []
+		if self.requested:
+			parts.append('request')
+		if self.snaps:
+			parts.append('snaps %s' % ' '.join(sorted(self.snaps)))
+		if self.feeds:
+			parts.append('feeds %s' % ' '.join(sorted(self.feeds)))
+		return ', '.join(parts)
+
+class ScanWatcher:
+	# feeds are the names of the files watched in feedDir, request the name of the file
+	# written there to ask for a scan
+	def __init__(self, snapDir, feedDir, feeds, request=None):
+		self.inotify = Inotify()
+		self.snapDir = snapDir
+		self.feedDir = feedDir
+		self.feeds = set(feeds)
+		self.request = request
+		self.inotify.addWatch(feedDir, IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE)
+		if self.inotify.addWatch(snapDir, IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM) is not None:
+			for name in os.listdir(snapDir):
+				self.watchSnap(name)
+
+	# Files in SNAPDIR (README) are not watched, addWatch only takes directories
+	def watchSnap(self, name):
+		self.inotify.addWatch(os.path.join(self.snapDir, name), IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM)
+
+	def collect(self, events, changes):
+		for (path, mask, name) in events:
+			if mask & IN_Q_OVERFLOW:
+				changes.everything = True
+			elif path == self.snapDir:
+				if mask & (IN_CREATE | IN_MOVED_TO):
+					self.watchSnap(name)
+				changes.snaps.add(name)
+			elif path == self.feedDir:
+				if name in self.feeds:
+					changes.feeds.add(name)
+				elif name == self.request and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+					changes.requested = True
+			elif path is not None and name == 'current':
+				changes.snaps.add(os.path.basename(path))
+
+	# Blocks until something changed, or for timeout seconds (None: forever), and returns
+	# the Changes, empty if nothing changed in time
+	def wait(self, timeout=None):
+		deadline = None if timeout is None else time.monotonic() + timeout
+		changes = Changes()
+		while not changes:
+			remaining = None if deadline is None else deadline - time.monotonic()
+			if remaining is not None and remaining <= 0:
+				return changes
+			self.collect(self.inotify.read(remaining), changes)
+		settled = time.monotonic() + DEBOUNCE_MAX
+		while time.monotonic() < settled:
+			events = self.inotify.read(max(0, min(DEBOUNCE, settled - time.monotonic())))
+			if not events:
+				break
+			self.collect(events, changes)
+		return changes
+
+	# Forgets the events already there, for changes a full scan is about to cover anyway
+	def drain(self):
+		events = self.inotify.read(0)
+		while events:
+			self.collect(events, Changes())
+			events = self.inotify.read(0)
+
+	def close(self):
+		self.inotify.close()
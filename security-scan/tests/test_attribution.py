@@ -0,0 +1,55 @@
+#!/bin/env python3
+
+# Tests of the attribution of the open USNs to the snaps and packages they come from: only
+# the versions that are still vulnerable are blamed, whether the packages of the definitions
+# come from the evaluator or from the feed index.
+#
+#   python3 -m pytest -q tests
+
+import os, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from oval_eval import OvalEvaluator, readManifest
+from feed_index import USNIndex
+from security_scan import getUsnPackages, indexProvenance
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+FEED = os.path.join(FIXTURES, 'oci.com.ubuntu.jammy.usn.oval.xml')
+# core20 ships a fixed libc6 next to the vulnerable one of core22
+MANIFEST = readManifest(os.path.join(FIXTURES, 'manifest.jammy')) + 'libc6:amd64 2.35-0ubuntu3.5 core20\n'
+
+def definitionId(number):
+	return 'oval:com.ubuntu.jammy:def:%d' % (1000000 + number)
+
+class AttributionTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.evaluator = OvalEvaluator(FEED)
+		results = cls.evaluator.evaluate(MANIFEST)
+		cls.usnMap = dict(('USN-%d-1' % (6000 + number), {'id': definitionId(number), 'result': results[definitionId(number)]})
+			for number in range(1, 12))
+
+	def assertAttribution(self, definitionPackages):
+		found = getUsnPackages(self.usnMap, definitionPackages, indexProvenance(MANIFEST))
+		self.assertEqual(found['USN-6001-1'], {('libc6', '2.35-0ubuntu3.1', 'core22')})
+		# libssl3 is at a fixed version, only libexpat1 is to blame
+		self.assertEqual(found['USN-6008-1'], {('libexpat1', '2.4.7-1ubuntu0.2', 'core22')})
+		self.assertEqual(found['USN-6003-1'], {('linux-image-5.15.0-91-generic', '5.15.0-91.101', 'pc-kernel')})
+		# Found through a pattern, the package is not known
+		self.assertEqual(found['USN-6004-1'], set())
+		self.assertNotIn('USN-6002-1', found)
+
+	def testEvaluator(self):
+		self.assertAttribution(self.evaluator.definitionPackages())
+
+	def testIndex(self):
+		with tempfile.TemporaryDirectory() as workdir:
+			index = USNIndex(os.path.join(workdir, 'feed_index.db'))
+			self.assertAttribution(index.packages('jammy', FEED, lambda: self.evaluator))
+			# Read back from the index, without the evaluator
+			self.assertAttribution(index.packages('jammy', FEED, None))
+
+if __name__ == "__main__":
+	unittest.main()
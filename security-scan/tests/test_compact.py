@@ -0,0 +1,62 @@
+#!/bin/env python3
+
+# Tests of the compact USN maps (compact.py) against the dict ones of security_scan: the
+# results of a report go through fromResults and buildUsnMap alike, including a report
+# that has no result for some of the definitions of the feed.
+#
+#   python3 -m pytest -q tests
+
+import os, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from compact import Catalog
+from feed_index import iterUSNDefinitions
+from oval_eval import OvalEvaluator, readManifest
+from security_scan import analyzeOscapResults, buildUsnMap, generateData
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+FEED = os.path.join(FIXTURES, 'oci.com.ubuntu.jammy.usn.oval.xml')
+MANIFEST = os.path.join(FIXTURES, 'manifest.jammy')
+MISSING = 'oval:com.ubuntu.jammy:def:1000001'
+
+# The results section of an oscap report, with the results of resultMap
+def writeReport(filename, resultMap):
+	with open(filename, 'w') as report:
+		report.write('<oval_results xmlns="http://oval.mitre.org/XMLSchema/oval-results-5">\n'
+			'<results><system><definitions>\n')
+		for id, result in resultMap.items():
+			report.write('<definition definition_id="%s" result="%s" version="1"/>\n' % (id, result))
+		report.write('</definitions></system></results>\n</oval_results>\n')
+
+class CatalogTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.definitions = list(iterUSNDefinitions(FEED))
+		cls.results = OvalEvaluator(FEED).evaluate(readManifest(MANIFEST))
+
+	def assertSameAsUsnMap(self, resultMap):
+		catalog = Catalog()
+		compactMap = catalog.fromResults(catalog.addDefinitions(self.definitions), resultMap)
+		usnMap = buildUsnMap(self.definitions, resultMap)
+		self.assertEqual(catalog.toUsnMap(compactMap), usnMap)
+		self.assertEqual(catalog.generateData(compactMap), generateData(usnMap))
+		return compactMap
+
+	def testResults(self):
+		compactMap = self.assertSameAsUsnMap(self.results)
+		self.assertEqual(len(compactMap), len(self.definitions))
+
+	# A truncated report, or one of another feed: the definitions without a result are skipped
+	def testMissingResult(self):
+		resultMap = dict((id, result) for id, result in self.results.items() if id != MISSING)
+		with tempfile.TemporaryDirectory() as workdir:
+			report = os.path.join(workdir, 'report.xml')
+			writeReport(report, resultMap)
+			self.assertEqual(analyzeOscapResults(report), resultMap)
+			compactMap = self.assertSameAsUsnMap(analyzeOscapResults(report))
+		self.assertEqual(len(compactMap), len(self.definitions) - 1)
+
+if __name__ == "__main__":
+	unittest.main()
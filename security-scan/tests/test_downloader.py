@@ -0,0 +1,149 @@
+#!/bin/env python3
+
+# Tests of the downloader against a local HTTP server (http.server on 127.0.0.1): conditional
+# requests, truncated payloads that must leave the previous feed in place and no temporary
+# file behind, and payloads made of several bz2 streams, decompressed on one core and on
+# several.
+#
+#   python3 -m pytest -q tests
+
+import bz2, os, random, sys, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import downloader
+from downloader import downloadFile, readMeta
+
+ETAG = '"feed-1"'
+LAST_MODIFIED = 'Mon, 04 Dec 2023 10:00:00 GMT'
+
+# Serves the payloads of the server it belongs to: path -> (body, headers), and records
+# the headers of every request
+class FeedHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		self.server.requests.append(dict(self.headers.items()))
+		if self.path not in self.server.payloads:
+			self.send_error(404)
+			return
+		(body, headers) = self.server.payloads[self.path]
+		if 'ETag' in headers and self.headers.get('If-None-Match') == headers['ETag']:
+			self.send_response(304)
+			self.end_headers()
+			return
+		self.send_response(200)
+		# A truncated transfer announces more than it sends
+		self.send_header('Content-Length', str(headers.get('Content-Length', len(body))))
+		for name, value in headers.items():
+			if name != 'Content-Length':
+				self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+		self.close_connection = True
+
+	def log_message(self, format, *args):
+		pass
+
+class DownloaderTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+		cls.server.payloads = {}
+		cls.server.requests = []
+		cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+		cls.thread.start()
+		cls.base = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		import requests
+		self.session = requests.Session()
+		self.workdir = tempfile.TemporaryDirectory()
+		self.filename = os.path.join(self.workdir.name, 'feed.xml')
+		self.server.payloads.clear()
+		self.server.requests.clear()
+		self.jobs = downloader.DECOMPRESS_JOBS
+
+	def tearDown(self):
+		downloader.DECOMPRESS_JOBS = self.jobs
+		self.session.close()
+		self.workdir.cleanup()
+
+	def serve(self, body, **headers):
+		self.server.payloads['/feed.xml.bz2'] = (body, dict((name.replace('_', '-'), value) for name, value in headers.items()))
+		return self.base + '/feed.xml.bz2'
+
+	def read(self):
+		with open(self.filename, 'rb') as feed:
+			return feed.read()
+
+	def temporaryFiles(self):
+		return [name for name in os.listdir(self.workdir.name) if name.startswith('.feed.xml.')]
+
+	def testConditional(self):
+		url = self.serve(bz2.compress(b'<feed>1</feed>\n'), ETag=ETAG, Last_Modified=LAST_MODIFIED)
+		self.assertTrue(downloadFile(url, self.filename, self.session))
+		self.assertEqual(self.read(), b'<feed>1</feed>\n')
+		meta = readMeta(self.filename)
+		self.assertEqual((meta['url'], meta['etag'], meta['last_modified']), (url, ETAG, LAST_MODIFIED))
+		self.assertNotIn('If-None-Match', self.server.requests[0])
+
+		mtime = os.stat(self.filename).st_mtime_ns
+		checked = meta['checked']
+		self.assertTrue(downloadFile(url, self.filename, self.session))
+		self.assertEqual(self.server.requests[1].get('If-None-Match'), ETAG)
+		self.assertEqual(self.server.requests[1].get('If-Modified-Since'), LAST_MODIFIED)
+		# Not transferred again, only revalidated
+		self.assertEqual(os.stat(self.filename).st_mtime_ns, mtime)
+		self.assertGreaterEqual(readMeta(self.filename)['checked'], checked)
+
+		# A new version of the feed is downloaded
+		self.serve(bz2.compress(b'<feed>2</feed>\n'), ETag='"feed-2"')
+		self.assertTrue(downloadFile(url, self.filename, self.session))
+		self.assertEqual(self.read(), b'<feed>2</feed>\n')
+		self.assertEqual(readMeta(self.filename)['etag'], '"feed-2"')
+
+	def testNotFound(self):
+		self.assertFalse(downloadFile(self.base + '/missing.bz2', self.filename, self.session))
+		self.assertFalse(os.path.exists(self.filename))
+
+	def assertKeepsOldFeed(self, url):
+		with open(self.filename, 'wb') as feed:
+			feed.write(b'<feed>old</feed>\n')
+		for jobs in (1, 2):
+			downloader.DECOMPRESS_JOBS = jobs
+			self.assertFalse(downloadFile(url, self.filename, self.session))
+			self.assertEqual(self.read(), b'<feed>old</feed>\n')
+			self.assertEqual(self.temporaryFiles(), [])
+
+	# The bz2 data stops before its end, the transfer itself being complete
+	def testTruncatedPayload(self):
+		data = bz2.compress(b'<feed>new</feed>\n' * 1000)
+		self.assertKeepsOldFeed(self.serve(data[:len(data) // 2]))
+
+	# The connection is closed before the announced length was sent
+	def testTruncatedTransfer(self):
+		data = bz2.compress(b'<feed>new</feed>\n' * 1000)
+		self.assertKeepsOldFeed(self.serve(data[:len(data) // 2], Content_Length=len(data)))
+
+	def testMultiStream(self):
+		rng = random.Random(0)
+		# Several blocks in each stream, so that the parallel decompression has work to share
+		parts = [b''.join(b'<definition id="%d">%x</definition>\n' % (index, rng.getrandbits(64)) for index in range(start, start + 20000))
+			for start in (0, 20000, 40000)]
+		url = self.serve(b''.join(bz2.compress(part, 1) for part in parts))
+		for jobs in (1, 2, 4):
+			downloader.DECOMPRESS_JOBS = jobs
+			if os.path.exists(self.filename):
+				os.remove(self.filename)
+			self.assertTrue(downloadFile(url, self.filename, self.session))
+			self.assertEqual(self.read(), b''.join(parts), '%d jobs' % jobs)
+			self.assertEqual(self.temporaryFiles(), [])
+
+if __name__ == "__main__":
+	unittest.main()
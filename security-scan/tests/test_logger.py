@@ -0,0 +1,72 @@
+#!/bin/env python3
+
+# Tests of the log and metrics.json of runScan, for scans that succeed and scans that fail:
+# a resident worker runs many of them, none may leave its log open.
+#
+#   python3 -m pytest -q tests
+
+import argparse, json, os, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import security_scan
+
+class RunScanTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.workdir.name)
+		self.loggers = []
+		logger = security_scan.Logger
+		def newLogger(*args):
+			self.loggers.append(logger(*args))
+			return self.loggers[-1]
+		patcher = mock.patch.object(security_scan, 'Logger', newLogger)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.workdir.cleanup()
+
+	def readLog(self):
+		with open('log', 'r') as log:
+			return [json.loads(line) for line in log]
+
+	def readMetrics(self):
+		with open('metrics.json', 'r') as metrics:
+			return json.load(metrics)
+
+	def testSucceeded(self):
+		def scanStages(logger, args, state, changes):
+			logger.stage('manifests')
+			return {'failed': False, 'versions': 0}
+		with mock.patch.object(security_scan, 'scanStages', scanStages):
+			security_scan.runScan(argparse.Namespace())
+		self.assertTrue(self.loggers[0].filePtr.closed)
+		metrics = self.readMetrics()
+		self.assertEqual((metrics['failed'], metrics['versions']), (False, 0))
+		self.assertIn('manifests', metrics['stage'])
+		self.assertEqual(self.readLog()[-1]['event'], 'metrics')
+
+	def testFailed(self):
+		def scanStages(logger, args, state, changes):
+			logger.stage('feeds')
+			logger.write('about to fail')
+			raise RuntimeError('scan failed')
+		with mock.patch.object(security_scan, 'scanStages', scanStages):
+			for scan in range(2):
+				with self.assertRaises(RuntimeError):
+					security_scan.runScan(argparse.Namespace())
+		self.assertTrue(all(logger.filePtr.closed for logger in self.loggers))
+		self.assertEqual(len(self.loggers), 2)
+		metrics = self.readMetrics()
+		self.assertTrue(metrics['failed'])
+		# The stage the scan failed in is timed too
+		self.assertIn('feeds', metrics['stage'])
+		self.assertEqual([record['event'] for record in self.readLog()], ['message', 'span', 'metrics'])
+
+if __name__ == "__main__":
+	unittest.main()
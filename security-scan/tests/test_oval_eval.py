@@ -0,0 +1,120 @@
+#!/bin/env python3
+
+# Tests of the built-in OVAL evaluator: version ordering against dpkg's, and the verdicts on
+# a small USN feed (fixtures/oci.com.ubuntu.jammy.usn.oval.xml) for a manifest covering the
+# cases that matter (fixtures/manifest.jammy): architecture qualifiers, tildes, epochs,
+# letters against '+', equal versions, a package found through a pattern that does not
+# name it, and the pc-kernel snap, whose name has a '-' in it.
+# The verdicts are checked against fixtures/expected.json and against oscap: the installed
+# one if there is one, else the report it produced, fixtures/oscap-report.xml, if recorded.
+# RECORD_OSCAP_REPORT=1 records that report with the installed oscap.
+#
+#   python3 -m pytest -q tests
+
+import json, os, shutil, subprocess, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from oval_eval import OvalEvaluator, compareVersions, indexManifest, meetsStates, readManifest, versionManifest
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+FEED = os.path.join(FIXTURES, 'oci.com.ubuntu.jammy.usn.oval.xml')
+MANIFEST = os.path.join(FIXTURES, 'manifest.jammy')
+EXPECTED = os.path.join(FIXTURES, 'expected.json')
+OSCAP_REPORT = os.path.join(FIXTURES, 'oscap-report.xml')
+
+# Evaluates the fixture manifest with oscap, like evaluateVersion, and returns its results
+def runOscap(report):
+	from security_scan import analyzeOscapResults
+	with tempfile.TemporaryDirectory() as workdir:
+		with open(os.path.join(workdir, 'manifest'), 'w') as manifestFile:
+			manifestFile.write(versionManifest(readManifest(MANIFEST)))
+		subprocess.run(['oscap', 'oval', 'eval', '--results', report, FEED], cwd=workdir,
+			stdout=subprocess.DEVNULL, check=True)
+	return analyzeOscapResults(report)
+
+class CompareVersionsTest(unittest.TestCase):
+	def assertOrdered(self, versions):
+		for older, newer in zip(versions, versions[1:]):
+			self.assertLess(compareVersions(older, newer), 0, '%s < %s' % (older, newer))
+			self.assertGreater(compareVersions(newer, older), 0, '%s > %s' % (newer, older))
+
+	def testTilde(self):
+		# A tilde sorts before anything, even the end of the version
+		self.assertOrdered(['1.0~~', '1.0~~a', '1.0~', '1.0~rc1', '1.0~rc2', '1.0', '1.0a'])
+
+	def testEpoch(self):
+		self.assertOrdered(['2.0', '1:0.9', '1:1.0', '2:0.1'])
+		self.assertEqual(compareVersions('0:1.0-1', '1.0-1'), 0)
+
+	def testRevision(self):
+		self.assertOrdered(['1.0', '1.0-1', '1.0-2', '1.0-9', '1.0-10', '1.0.1-1'])
+		self.assertOrdered(['2.35-0ubuntu3.1', '2.35-0ubuntu3.4', '2.35-0ubuntu3.10'])
+		self.assertOrdered(['5.15.0-91.101', '5.15.0-92.102', '5.15.0-100.110'])
+		self.assertEqual(compareVersions('1.0', '1.0-0'), 0)
+
+	def testLettersBeforeOtherCharacters(self):
+		self.assertOrdered(['1.2', '1.2a', '1.2z', '1.2+dfsg', '1.2.1'])
+		self.assertOrdered(['1.2a-1', '1.2+dfsg-1'])
+
+	def testNumbers(self):
+		self.assertEqual(compareVersions('1.01', '1.1'), 0)
+		self.assertOrdered(['1.9', '1.10', '1.100'])
+
+	# What the feed patterns capture from a line of a snap manifest, if the snap column is kept
+	def testSnapColumn(self):
+		self.assertGreater(compareVersions('5.15.0-91.101 pc-kernel', '5.15.0-92.102'), 0)
+
+class ManifestTest(unittest.TestCase):
+	def testVersionManifest(self):
+		self.assertEqual(versionManifest('libc6:amd64 2.35-0ubuntu3.1 core22\n\nlinux-image-5.15.0-91-generic  5.15.0-91.101 pc-kernel\n'),
+			'libc6:amd64 2.35-0ubuntu3.1\nlinux-image-5.15.0-91-generic 5.15.0-91.101\n')
+
+	def testIndexManifest(self):
+		packages = indexManifest(readManifest(MANIFEST))
+		self.assertEqual(packages['libc6'], ['2.35-0ubuntu3.1'])
+		self.assertEqual(packages['linux-image-5.15.0-91-generic'], ['5.15.0-91.101'])
+
+class OvalEvaluatorTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.evaluator = OvalEvaluator(FEED)
+		with open(EXPECTED, 'r') as expectedFile:
+			cls.expected = json.load(expectedFile)
+
+	def testVerdicts(self):
+		self.assertEqual(self.evaluator.evaluate(readManifest(MANIFEST)), self.expected)
+
+	# The snap column does not take part in the verdicts, whether the objects name their
+	# package (USN-6003-1) or match it with a pattern (USN-6004-1)
+	def testSnapColumnIgnored(self):
+		manifest = readManifest(MANIFEST)
+		self.assertEqual(self.evaluator.evaluate(versionManifest(manifest)), self.evaluator.evaluate(manifest))
+
+	def testDefinitionPackages(self):
+		packages = self.evaluator.definitionPackages()
+		self.assertEqual([package for (package, operator, states) in packages['oval:com.ubuntu.jammy:def:1000008']],
+			['libexpat1', 'libssl3'])
+		self.assertEqual(packages['oval:com.ubuntu.jammy:def:1000004'], [])
+		(package, operator, states) = packages['oval:com.ubuntu.jammy:def:1000001'][0]
+		self.assertTrue(meetsStates(operator, states, '2.35-0ubuntu3.1'))
+		self.assertFalse(meetsStates(operator, states, '2.35-0ubuntu3.4'))
+
+	def testAgreesWithOscap(self):
+		if shutil.which('oscap') is not None:
+			if os.getenv('RECORD_OSCAP_REPORT') == '1':
+				oscapResults = runOscap(OSCAP_REPORT)
+			else:
+				with tempfile.TemporaryDirectory() as workdir:
+					oscapResults = runOscap(os.path.join(workdir, 'report.xml'))
+		elif os.path.exists(OSCAP_REPORT):
+			from security_scan import analyzeOscapResults
+			oscapResults = analyzeOscapResults(OSCAP_REPORT)
+		else:
+			self.skipTest('oscap is not installed and no report of it was recorded')
+		self.assertEqual(oscapResults, self.expected)
+		self.assertEqual(self.evaluator.evaluate(readManifest(MANIFEST)), oscapResults)
+
+if __name__ == "__main__":
+	unittest.main()
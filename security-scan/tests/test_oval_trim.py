@@ -0,0 +1,62 @@
+#!/bin/env python3
+
+# Tests of the feeds reduced to the packages of a manifest (oval_trim): the reduced document
+# must parse, hold everything its definitions refer to, and give the verdicts of the full feed
+# once the dropped ones are merged back.
+#
+#   python3 -m pytest -q tests
+
+import os, sys, tempfile, unittest
+import xml.etree.ElementTree as ElementTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from oval_eval import OvalEvaluator, readManifest
+from oval_trim import trimFeed
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+FEED = os.path.join(FIXTURES, 'oci.com.ubuntu.jammy.usn.oval.xml')
+# A few packages of manifest.jammy: most definitions of the feed are dropped
+MANIFEST = os.path.join(FIXTURES, 'manifest.trim')
+
+class TrimFeedTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.evaluator = OvalEvaluator(FEED)
+
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		(self.trimmed, self.dropped) = trimFeed(lambda: self.evaluator, FEED, MANIFEST, 'core22',
+			directory=self.workdir.name)
+
+	def tearDown(self):
+		self.workdir.cleanup()
+
+	def testPartition(self):
+		kept = set(OvalEvaluator(self.trimmed).definitions.keys())
+		self.assertEqual(kept, set('oval:com.ubuntu.jammy:def:%d' % id for id in (1000001, 1000003, 1000007)))
+		self.assertEqual(kept | set(self.dropped.keys()), set(self.evaluator.definitions.keys()))
+		self.assertFalse(kept & set(self.dropped.keys()))
+
+	# Every test, object, state and variable referred to is in the reduced document
+	def testReferences(self):
+		ElementTree.parse(self.trimmed)
+		trimmed = OvalEvaluator(self.trimmed)
+		for id, references in trimmed.references.items():
+			self.assertLessEqual(references, set(trimmed.references.keys()), id)
+		self.assertEqual(sum(len(section) for section in (trimmed.definitions, trimmed.tests, trimmed.objects,
+			trimmed.states, trimmed.variables)), len(trimmed.references))
+
+	def testVerdicts(self):
+		manifest = readManifest(MANIFEST)
+		merged = dict(self.dropped)
+		merged.update(OvalEvaluator(self.trimmed).evaluate(manifest))
+		self.assertEqual(merged, self.evaluator.evaluate(manifest))
+
+	def testCached(self):
+		self.assertEqual(trimFeed(None, FEED, MANIFEST, 'core22', directory=self.workdir.name),
+			(self.trimmed, self.dropped))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,73 @@
+#!/bin/env python3
+
+# Tests of the writing of the reports (writeAtomically, writeReport): a report replaces the
+# previous one as a whole, and its .gz and .sha256 sidecars match the report written.
+#
+#   python3 -m pytest -q tests
+
+import gzip, hashlib, os, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from security_scan import writeAtomically, writeReport
+
+class WriteReportTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		self.filename = os.path.join(self.workdir.name, 'usn_stats.php')
+
+	def tearDown(self):
+		self.workdir.cleanup()
+
+	def read(self, filename):
+		with open(filename, 'rb') as inputFile:
+			return inputFile.read()
+
+	def assertReport(self, content):
+		data = self.read(self.filename)
+		self.assertEqual(data, content.encode())
+		self.assertEqual(gzip.decompress(self.read(self.filename + '.gz')), data)
+		self.assertEqual(self.read(self.filename + '.sha256').decode(), hashlib.sha256(data).hexdigest())
+		self.assertEqual(sorted(os.listdir(self.workdir.name)), ['usn_stats.php', 'usn_stats.php.gz', 'usn_stats.php.sha256'])
+
+	def testSidecars(self):
+		writeReport(self.filename, '<table>é</table>\n')
+		self.assertReport('<table>é</table>\n')
+		writeReport(self.filename, '<table>2</table>\n')
+		self.assertReport('<table>2</table>\n')
+
+	# The same report gives the same .gz, for the ETags of the server not to change
+	def testReproducible(self):
+		writeReport(self.filename, '<table/>\n')
+		compressed = self.read(self.filename + '.gz')
+		writeReport(self.filename, '<table/>\n')
+		self.assertEqual(self.read(self.filename + '.gz'), compressed)
+
+	# A write that fails before the rename leaves the previous content in place
+	def testFailedWrite(self):
+		writeAtomically(self.filename, b'old\n')
+		with mock.patch('os.fsync', side_effect=OSError('disk full')):
+			with self.assertRaises(OSError):
+				writeAtomically(self.filename, b'new\n')
+		self.assertEqual(self.read(self.filename), b'old\n')
+
+	# The report is renamed last: if writing it fails, the report read still is the old one,
+	# which the server can tell does not match the new sidecars
+	def testReportRenamedLast(self):
+		writeReport(self.filename, 'old\n')
+		replace = os.replace
+		def failOnReport(source, target):
+			if target == self.filename:
+				raise OSError('disk full')
+			replace(source, target)
+		with mock.patch('os.replace', failOnReport):
+			with self.assertRaises(OSError):
+				writeReport(self.filename, 'new\n')
+		self.assertEqual(self.read(self.filename), b'old\n')
+		self.assertEqual(gzip.decompress(self.read(self.filename + '.gz')), b'new\n')
+		self.assertNotEqual(self.read(self.filename + '.sha256').decode(), hashlib.sha256(b'old\n').hexdigest())
+
+if __name__ == "__main__":
+	unittest.main()
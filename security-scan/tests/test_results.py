@@ -0,0 +1,102 @@
+#!/bin/env python3
+
+# Tests of results.json (generateResults) over successive scans: the scan each entry last
+# changed in, the entries removed since an earlier scan, which are forgotten after
+# RESULTS_HORIZON scans or when they come back, and the horizon the changes are known since.
+#
+#   python3 -m pytest -q tests
+
+import json, os, sys, tempfile, unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import security_scan
+from security_scan import generateResults
+
+# The CVE index, as far as generateResults uses it
+class CVEInfo:
+	def lookup(self, cves):
+		return dict((cve, {'severity': 'medium', 'date': '2023-12-01'}) for cve in cves)
+
+def usnEntry(result, cve):
+	return {'id': 'oval:com.ubuntu.jammy:def:1', 'result': result, 'severity': 'Medium', 'cve': [cve]}
+
+class GenerateResultsTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		self.filename = os.path.join(self.workdir.name, 'results.json')
+
+	def tearDown(self):
+		self.workdir.cleanup()
+
+	# Writes the results of a scan of core22 with usns (usn -> result) and returns them
+	def scan(self, usns, fixedCves=()):
+		maps = {'core22': dict((usn, usnEntry(result, 'CVE-%s' % usn)) for usn, result in usns.items())}
+		usnPackages = {'core22': dict((usn, {('libc6', '2.35-0ubuntu3.1', 'core22')}) for usn, result in usns.items()
+			if result == 'true')}
+		generateResults(self.filename, {'core22': {}}, {}, maps, list(fixedCves), CVEInfo(), {}, {}, usnPackages)
+		with open(self.filename, 'r') as results:
+			return json.load(results)
+
+	def changed(self, results):
+		return dict((entry['usn'], entry['changed']) for entry in results['usns'])
+
+	def removed(self, results):
+		return sorted((entry['kind'], entry.get('version'), entry['key'], entry['changed']) for entry in results['removed'])
+
+	def testFirstScan(self):
+		results = self.scan({'USN-1': 'true', 'USN-2': 'false'}, ['CVE-USN-2'])
+		self.assertEqual((results['scan_id'], results['horizon']), (1, 0))
+		self.assertEqual(self.changed(results), {'USN-1': 1, 'USN-2': 1})
+		self.assertEqual(results['removed'], [])
+		self.assertEqual([entry['cve'] for entry in results['cves']], ['CVE-USN-2'])
+		self.assertEqual(results['usns'][0]['packages'], [{'package': 'libc6', 'version': '2.35-0ubuntu3.1', 'snap': 'core22'}])
+		self.assertNotIn('packages', results['usns'][1])
+
+	def testUnchanged(self):
+		self.scan({'USN-1': 'true', 'USN-2': 'false'}, ['CVE-USN-2'])
+		results = self.scan({'USN-1': 'true', 'USN-2': 'false'}, ['CVE-USN-2'])
+		self.assertEqual((results['scan_id'], results['horizon']), (2, 0))
+		self.assertEqual(self.changed(results), {'USN-1': 1, 'USN-2': 1})
+		self.assertEqual(results['cves'][0]['changed'], 1)
+
+	def testChanged(self):
+		self.scan({'USN-1': 'true', 'USN-2': 'false', 'USN-3': 'true'}, ['CVE-USN-2'])
+		results = self.scan({'USN-1': 'false', 'USN-2': 'false'}, ['CVE-USN-1'])
+		self.assertEqual(self.changed(results), {'USN-1': 2, 'USN-2': 1})
+		self.assertEqual(self.removed(results), [('cve', None, 'CVE-USN-2', 2), ('usn', 'core22', 'USN-3', 2)])
+		# The removed entries are still listed by the next scans, with the scan they were removed in
+		results = self.scan({'USN-1': 'false', 'USN-2': 'false'}, ['CVE-USN-1'])
+		self.assertEqual(self.removed(results), [('cve', None, 'CVE-USN-2', 2), ('usn', 'core22', 'USN-3', 2)])
+
+	def testRemovedThenPresent(self):
+		self.scan({'USN-1': 'true', 'USN-3': 'true'}, ['CVE-USN-2'])
+		self.scan({'USN-1': 'true'})
+		results = self.scan({'USN-1': 'true', 'USN-3': 'true'}, ['CVE-USN-2'])
+		self.assertEqual(results['removed'], [])
+		self.assertEqual(self.changed(results), {'USN-1': 1, 'USN-3': 3})
+		self.assertEqual(results['cves'][0]['changed'], 3)
+
+	def testHorizon(self):
+		with mock.patch.object(security_scan, 'RESULTS_HORIZON', 3):
+			self.scan({'USN-1': 'true', 'USN-3': 'true'})
+			results = self.scan({'USN-1': 'true'})
+			self.assertEqual(self.removed(results), [('usn', 'core22', 'USN-3', 2)])
+			for scanId in (3, 4):
+				results = self.scan({'USN-1': 'true'})
+				self.assertEqual(results['horizon'], max(0, scanId - 3))
+				self.assertEqual(self.removed(results), [('usn', 'core22', 'USN-3', 2)])
+			# Removed 3 scans ago: asking for the changes since scan 1 or earlier needs a full download
+			results = self.scan({'USN-1': 'true'})
+			self.assertEqual((results['scan_id'], results['horizon'], results['removed']), (5, 2, []))
+
+	# A results.json that cannot be read starts the scans over
+	def testUnreadable(self):
+		with open(self.filename, 'w') as results:
+			results.write('{')
+		self.assertEqual(self.scan({'USN-1': 'true'})['scan_id'], 1)
+
+if __name__ == "__main__":
+	unittest.main()
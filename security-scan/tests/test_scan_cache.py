@@ -0,0 +1,85 @@
+#!/bin/env python3
+
+# Tests of the cache of the per-version results (scan_cache): an entry is served as long as
+# the manifest, the feed, the engine and --trim are those it was stored with, keyed the way
+# runScan keys it, with the digests of the feed index.
+#
+#   python3 -m pytest -q tests
+
+import os, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from feed_index import USNIndex
+from scan_cache import ScanCache
+
+USN_MAP = {'USN-6001-1': {'id': 'oval:com.ubuntu.jammy:def:1000001', 'result': 'true', 'severity': 'Medium',
+	'cve': ['CVE-2023-4911']}}
+STATS = {'Medium': {'fixed': 0, 'present': 1}}
+
+class ScanCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		self.manifest = self.path('manifest.core22')
+		self.feed = self.path('oci.com.ubuntu.jammy.usn.oval.xml')
+		self.writeFile(self.manifest, 'libc6:amd64 2.35-0ubuntu3.1 core22\n')
+		self.writeFile(self.feed, '<oval_definitions/>\n')
+		self.index = USNIndex(self.path('feed_index.db'))
+		self.cache = self.newCache()
+		self.cache.put('core22', self.key(), USN_MAP, STATS)
+
+	def tearDown(self):
+		self.workdir.cleanup()
+
+	def path(self, name):
+		return os.path.join(self.workdir.name, name)
+
+	def writeFile(self, filename, contents):
+		with open(filename, 'w') as outputFile:
+			outputFile.write(contents)
+
+	def newCache(self, force=False):
+		return ScanCache(self.path('scan_cache'), force=force)
+
+	def key(self, engine='oscap', trim=False):
+		return self.cache.key(self.index.digest(self.manifest), self.index.digest(self.feed), engine, trim=trim)
+
+	def testHit(self):
+		cache = self.newCache()
+		self.assertEqual(cache.get('core22', self.key()), (USN_MAP, STATS))
+		self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+	def testManifestChanged(self):
+		self.writeFile(self.manifest, 'libc6:amd64 2.35-0ubuntu3.4 core22\n')
+		cache = self.newCache()
+		self.assertIsNone(cache.get('core22', self.key()))
+		self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+	def testFeedChanged(self):
+		self.writeFile(self.feed, '<oval_definitions><definitions/></oval_definitions>\n')
+		self.assertIsNone(self.newCache().get('core22', self.key()))
+
+	# Rewriting the same content does not invalidate anything
+	def testFeedTouched(self):
+		self.writeFile(self.feed, '<oval_definitions/>\n')
+		os.utime(self.feed, (0, 0))
+		self.assertEqual(self.newCache().get('core22', self.key()), (USN_MAP, STATS))
+
+	def testEngineAndTrim(self):
+		cache = self.newCache()
+		self.assertIsNone(cache.get('core22', self.key(engine='native')))
+		self.assertIsNone(cache.get('core22', self.key(trim=True)))
+		# Each version only keeps its latest entry
+		cache.put('core22', self.key(trim=True), USN_MAP, STATS)
+		self.assertEqual(cache.get('core22', self.key(trim=True)), (USN_MAP, STATS))
+		self.assertIsNone(cache.get('core22', self.key()))
+
+	def testForce(self):
+		self.assertIsNone(self.newCache(force=True).get('core22', self.key()))
+
+	def testOtherVersion(self):
+		self.assertIsNone(self.newCache().get('core20', self.key()))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,98 @@
+#!/bin/env python3
+
+# Tests of the scan history (scan_history): only the verdicts that changed are recorded, the
+# history can be asked what changed since a scan, the trend of the stats and when each USN
+# was first seen present, and folding old scans keeps the verdicts of the scans kept.
+#
+#   python3 -m pytest -q tests
+
+import os, sys, tempfile, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from scan_history import TOTALS, ScanHistory
+from security_scan import generateData
+
+def usnMap(verdicts):
+	return dict((usn, {'id': 'oval:%s' % usn, 'result': result, 'severity': 'High', 'cve': []})
+		for usn, result in verdicts.items())
+
+class ScanHistoryTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.TemporaryDirectory()
+		self.history = self.open()
+
+	def tearDown(self):
+		self.history.db.close()
+		self.workdir.cleanup()
+
+	def open(self, **limits):
+		return ScanHistory(os.path.join(self.workdir.name, 'scan_history.db'), **limits)
+
+	# Records a scan of versions: version -> {usn: result}
+	def record(self, history=None, **versions):
+		maps = dict((version, usnMap(verdicts)) for version, verdicts in versions.items())
+		results = dict((version, generateData(usns)) for version, usns in maps.items())
+		return (history or self.history).record(maps, results, generateData(dict((usn + version, data)
+			for version, usns in maps.items() for usn, data in usns.items())))
+
+	def changes(self, since, version=None, history=None):
+		return [(change['scan'], change['version'], change['usn'], change['result'])
+			for change in (history or self.history).changes(since, version)]
+
+	def testDeltas(self):
+		self.assertEqual(self.record(core22={'USN-1': 'true', 'USN-2': 'false'}, core20={'USN-1': 'true'}), 1)
+		self.assertEqual(self.record(core22={'USN-1': 'false', 'USN-2': 'false', 'USN-3': 'true'}, core20={}), 2)
+		# core20 was not scanned: it keeps its verdicts
+		self.assertEqual(self.record(core22={'USN-1': 'false', 'USN-3': 'true'}), 3)
+		self.assertEqual(self.changes(1), [(2, 'core20', 'USN-1', None), (2, 'core22', 'USN-1', 'false'),
+			(2, 'core22', 'USN-3', 'true'), (3, 'core22', 'USN-2', None)])
+		self.assertEqual(self.changes(2, 'core20'), [])
+		self.assertEqual(self.changes(3), [])
+		# Unchanged verdicts are not recorded again
+		self.assertEqual(self.history.db.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0], 7)
+
+	def testTrend(self):
+		self.record(core22={'USN-1': 'true', 'USN-2': 'false'})
+		self.record(core22={'USN-1': 'false', 'USN-2': 'false'})
+		trend = self.history.trend('core22')
+		self.assertEqual([scan for (scan, scanTime, stats) in trend], [1, 2])
+		self.assertEqual([stats['High'] for (scan, scanTime, stats) in trend],
+			[{'fixed': 1, 'present': 1}, {'fixed': 2, 'present': 0}])
+		self.assertEqual(self.history.trend(TOTALS)[0][2]['High'], {'fixed': 1, 'present': 1})
+
+	def testFirstPresent(self):
+		self.record(core22={'USN-1': 'false', 'USN-2': 'true'})
+		self.record(core22={'USN-1': 'true', 'USN-2': 'true'})
+		self.record(core22={'USN-1': 'false', 'USN-2': 'true'})
+		self.record(core22={'USN-1': 'true', 'USN-2': 'true'})
+		self.assertEqual(self.history.firstPresent(), {('core22', 'USN-1'): 2, ('core22', 'USN-2'): 1})
+		self.assertEqual(self.history.firstPresent('USN-1'), {('core22', 'USN-1'): 2})
+
+	# Folding the oldest scans keeps the verdicts of the others, and the USNs present before
+	# the oldest scan kept count as first seen in it
+	def testFold(self):
+		history = self.open(keep=2)
+		self.record(history, core22={'USN-1': 'true', 'USN-2': 'true', 'USN-3': 'false'})
+		self.record(history, core22={'USN-1': 'false', 'USN-2': 'true'})
+		self.record(history, core22={'USN-1': 'false', 'USN-2': 'true', 'USN-4': 'true'})
+		self.assertEqual([scan for (scan, scanTime) in history.scans()], [2, 3])
+		self.assertEqual(history.firstPresent(), {('core22', 'USN-2'): 2, ('core22', 'USN-4'): 3})
+		self.assertEqual(self.changes(2, history=history), [(3, 'core22', 'USN-4', 'true')])
+		self.record(history, core22={'USN-2': 'true', 'USN-4': 'true'})
+		self.assertEqual(self.changes(3, history=history), [(4, 'core22', 'USN-1', None)])
+		self.assertEqual([scan for (scan, scanTime, stats) in history.trend('core22')], [3, 4])
+		history.db.close()
+
+	def testMaxBytes(self):
+		history = self.open(maxBytes=0)
+		for scan in range(3):
+			self.record(history, core22=dict(('USN-%d' % usn, 'true') for usn in range(scan + 1)))
+		# Over the limit whatever is kept: only the last scan is left
+		self.assertEqual([scan for (scan, scanTime) in history.scans()], [3])
+		self.assertEqual(history.firstPresent(), {('core22', 'USN-0'): 3, ('core22', 'USN-1'): 3, ('core22', 'USN-2'): 3})
+		history.db.close()
+
+if __name__ == "__main__":
+	unittest.main()
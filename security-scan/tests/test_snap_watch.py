@@ -0,0 +1,114 @@
+#!/bin/env python3
+
+# Tests of ScanWatcher on a temporary snap directory and scan directory: snapd replacing the
+# `current` symlink of a snap, snaps installed and removed, the downloader renaming a feed
+# into place, the server asking for a scan, and a burst of these collapsing into one Changes.
+#
+#   python3 -m pytest -q tests
+
+import os, shutil, sys, tempfile, threading, time, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import snap_watch
+from snap_watch import ScanWatcher
+
+FEED = 'oci.com.ubuntu.jammy.usn.oval.xml'
+REQUEST = 'scan.request'
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is only available on Linux')
+class ScanWatcherTest(unittest.TestCase):
+	def setUp(self):
+		self.debounce = snap_watch.DEBOUNCE
+		snap_watch.DEBOUNCE = 0.3
+		self.workdir = tempfile.TemporaryDirectory()
+		self.snapDir = os.path.join(self.workdir.name, 'snap')
+		self.feedDir = os.path.join(self.workdir.name, 'data')
+		os.makedirs(self.feedDir)
+		for snap in ('core22', 'pc-kernel'):
+			self.installSnap(snap, '1')
+		# Files in the snap directory are not snaps
+		with open(os.path.join(self.snapDir, 'README'), 'w') as readme:
+			readme.write('snaps\n')
+		self.watcher = ScanWatcher(self.snapDir, self.feedDir, [FEED], REQUEST)
+
+	def tearDown(self):
+		self.watcher.close()
+		self.workdir.cleanup()
+		snap_watch.DEBOUNCE = self.debounce
+
+	def installSnap(self, snap, revision):
+		os.makedirs(os.path.join(self.snapDir, snap, revision))
+		os.symlink(revision, os.path.join(self.snapDir, snap, 'current'))
+
+	# Like snapd: the new revision is mounted, then `current` is replaced by a rename
+	def refreshSnap(self, snap, revision):
+		os.makedirs(os.path.join(self.snapDir, snap, revision))
+		os.symlink(revision, os.path.join(self.snapDir, snap, 'current.new'))
+		os.rename(os.path.join(self.snapDir, snap, 'current.new'), os.path.join(self.snapDir, snap, 'current'))
+
+	# Like the downloader: the feed is written to a temporary file, renamed into place
+	def replaceFeed(self, name):
+		with open(os.path.join(self.feedDir, name + '.tmp'), 'w') as feed:
+			feed.write('<oval_definitions/>\n')
+		os.rename(os.path.join(self.feedDir, name + '.tmp'), os.path.join(self.feedDir, name))
+
+	def assertChanges(self, changes, snaps=(), feeds=(), requested=False):
+		self.assertEqual((changes.snaps, changes.feeds, changes.requested, changes.everything),
+			(set(snaps), set(feeds), requested, False))
+
+	def testNothing(self):
+		changes = self.watcher.wait(0.1)
+		self.assertFalse(changes)
+
+	def testRefresh(self):
+		self.refreshSnap('pc-kernel', '2')
+		self.assertChanges(self.watcher.wait(5), snaps=['pc-kernel'])
+		self.assertFalse(self.watcher.wait(0.1))
+
+	def testInstall(self):
+		self.installSnap('lxd', '10')
+		self.assertChanges(self.watcher.wait(5), snaps=['lxd'])
+		# The new snap is watched as well
+		self.refreshSnap('lxd', '11')
+		self.assertChanges(self.watcher.wait(5), snaps=['lxd'])
+
+	def testRemove(self):
+		shutil.rmtree(os.path.join(self.snapDir, 'core22'))
+		self.assertChanges(self.watcher.wait(5), snaps=['core22'])
+		self.assertFalse(self.watcher.wait(0.1))
+
+	def testFeed(self):
+		self.replaceFeed(FEED)
+		# Files that are not feeds do not count
+		self.replaceFeed('oci.com.ubuntu.jammy.usn.oval.xml.meta')
+		self.assertChanges(self.watcher.wait(5), feeds=[FEED])
+
+	def testRequest(self):
+		with open(os.path.join(self.feedDir, REQUEST), 'w') as request:
+			request.write('1\n')
+		self.assertChanges(self.watcher.wait(5), requested=True)
+
+	# Events less than DEBOUNCE apart are one change
+	def testBurst(self):
+		def later():
+			self.refreshSnap('core22', '2')
+			time.sleep(0.1)
+			self.replaceFeed(FEED)
+		self.refreshSnap('pc-kernel', '2')
+		thread = threading.Timer(0.1, later)
+		thread.start()
+		changes = self.watcher.wait(5)
+		thread.join()
+		self.assertChanges(changes, snaps=['core22', 'pc-kernel'], feeds=[FEED])
+		self.assertFalse(self.watcher.wait(0.1))
+
+	def testDrain(self):
+		self.refreshSnap('core22', '2')
+		time.sleep(0.1)
+		self.watcher.drain()
+		self.assertFalse(self.watcher.wait(0.1))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,40 +1,68 @@
 #!/bin/env python3
 
+import argparse
 import glob
 import gzip
+import itertools
+import json
 import os
 import re
+import shutil
+import subprocess
 import sys
+import tempfile
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 
 SNAPDIR = "/snap/"
 bases = []
 
-def read_snap_manifest(snap_name):
-    manifest = "snap/manifest.yaml"
-    dpkg = "usr/share/snappy/dpkg.yaml"
-    changelog = "doc/linux-modules-*/changelog.Debian.gz"
+# Where the package lists are in a snap, in the order they are looked for
+DPKG_YAML = "usr/share/snappy/dpkg.yaml"
+MANIFEST_YAML = "snap/manifest.yaml"
+KERNEL_CHANGELOG = "doc/linux-modules-*/changelog.Debian.gz"
+SNAP_YAML = "meta/snap.yaml"
+UNSQUASHFS = "unsquashfs"
+
+# The libyaml loader is an order of magnitude faster, when it is available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed package lists, keyed by the revision `current` points to: revisions never change
+# once installed, so only the snaps that were refreshed need to be parsed again
+CACHE_FILE = "snap_manifest_cache.json"
+CACHE_VERSION = 1
+
+# Marks a directory written by an audit of .snap files, see audit_output_dir
+AUDIT_MARKER = ".snap_files_audit"
+
+# Reads the package list of a snap from its files, under root
+# (the installed revision by default, /snap/<snap_name>/current/)
+def read_snap_manifest(snap_name, root=None):
+    manifest = MANIFEST_YAML
+    dpkg = DPKG_YAML
+    changelog = KERNEL_CHANGELOG
     man_yaml = None
     section = None
 
-    fn = os.path.join(SNAPDIR, snap_name, "current/")
+    fn = root or os.path.join(SNAPDIR, snap_name, "current/")
 
     if os.path.exists(os.path.join(fn, dpkg)):
         with open(os.path.join(fn, dpkg), 'r') as fd:
-            man_yaml = yaml.safe_load(fd)
+            man_yaml = yaml.load(fd, Loader=YAML_LOADER)
         section = "packages"
     elif os.path.exists(os.path.join(fn, manifest)):
         with open(os.path.join(fn, manifest), 'r') as fd:
-            man_yaml = yaml.safe_load(fd)
+            man_yaml = yaml.load(fd, Loader=YAML_LOADER)
         section = "primed-stage-packages"
     else:
         for filename in glob.glob(os.path.join(fn, changelog)):
+            # Only the beginning of the changelog is needed, read it line by line
             with gzip.open(filename, 'rt') as fd:
-                lines = fd.readlines()
-                release = lines[0].split(' ')[2]
+                first_line = fd.readline()
+                release = first_line.split(' ')[2]
                 base_kernel_entry = release.replace(';', '/') + 'linux:'
-                kernel_major_version = re.search(r'([\d|\.]+)-\d+[\.|\d]+', lines[0])[1]
-                for line in lines:
+                kernel_major_version = re.search(r'([\d|\.]+)-\d+[\.|\d]+', first_line)[1]
+                for line in itertools.chain([first_line], fd):
                     if base_kernel_entry in line:
                         matched_version = re.search(r'(' + kernel_major_version + r'-\d+)[\.|\d]+', line)
                         base_kernel_version = matched_version[1]
@@ -46,10 +74,10 @@ def read_snap_manifest(snap_name):
 
     return (man_yaml, section)
 
-def parse_snap_manifest(snap_name):
+def parse_snap_manifest(snap_name, root=None):
     data = {}
     base = snap_name
-    man_yaml, section = read_snap_manifest(snap_name)
+    man_yaml, section = read_snap_manifest(snap_name, root)
 
     if man_yaml:
         if "base" in man_yaml:
@@ -67,8 +95,107 @@ def parse_snap_manifest(snap_name):
 
     return (data, base)
 
-def generate_manifest(snap_name):
-    (data, base) = parse_snap_manifest(snap_name)
+def snap_revision(snap_name):
+    current = os.path.join(SNAPDIR, snap_name, "current")
+    if not os.path.islink(current):
+        return None
+    return os.readlink(current)
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE, 'r') as fd:
+            cache = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache["snaps"]
+
+
+def save_cache(cache):
+    with open(CACHE_FILE + ".tmp", 'w') as fd:
+        json.dump({"version": CACHE_VERSION, "snaps": cache}, fd)
+    os.replace(CACHE_FILE + ".tmp", CACHE_FILE)
+
+
+def collect_manifests(snap_names, jobs=None):
+    cache = load_cache()
+    revisions = dict((snap_name, snap_revision(snap_name)) for snap_name in snap_names)
+    parsed = {}
+    changed = []
+    unchanged = 0
+    for snap_name in snap_names:
+        entry = cache.get(snap_name)
+        if revisions[snap_name] is None:
+            # Not a snap (README, bin...), there is nothing to read
+            parsed[snap_name] = ({}, snap_name)
+        elif entry and entry["revision"] == revisions[snap_name]:
+            parsed[snap_name] = (entry["data"], entry["base"])
+            unchanged += 1
+        else:
+            changed.append(snap_name)
+
+    if changed:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for snap_name, result in zip(changed, executor.map(parse_snap_manifest, changed)):
+                parsed[snap_name] = result
+    print("%d snaps unchanged, %d parsed" % (unchanged, len(changed)))
+
+    save_cache(dict((snap_name, {"revision": revisions[snap_name], "data": parsed[snap_name][0],
+                                 "base": parsed[snap_name][1]})
+                    for snap_name in snap_names if revisions[snap_name] is not None))
+    return parsed
+
+
+# Reads the package list of a .snap file without mounting it: unsquashfs only extracts the
+# files read_snap_manifest looks for (and meta/snap.yaml, for the name of the snap), so the
+# cost is that of the manifest, not of the snap
+# Returns (snap_name, (data, base)) like parse_snap_manifest
+def parse_snap_file(snap_file):
+    workdir = tempfile.mkdtemp(prefix="snap_manifest.")
+    try:
+        root = os.path.join(workdir, "root")
+        # Many snaps are read at the same time, one thread each is enough
+        result = subprocess.run([UNSQUASHFS, "-n", "-p", "1", "-d", root, snap_file,
+                                 SNAP_YAML, DPKG_YAML, MANIFEST_YAML, KERNEL_CHANGELOG],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        # A snap only has some of the files asked for (a kernel has no dpkg.yaml, ...): whatever
+        # unsquashfs says of the others, the snap is read if meta/snap.yaml was extracted
+        if not os.path.exists(os.path.join(root, SNAP_YAML)):
+            print("Could not read %s: %s" % (snap_file, result.stderr.strip()))
+            return (None, ({}, None))
+        if result.returncode != 0:
+            print("%s: %s" % (snap_file, result.stderr.strip()))
+        # name_revision.snap, unless meta/snap.yaml says otherwise
+        snap_name = os.path.basename(snap_file).split("_")[0]
+        with open(os.path.join(root, SNAP_YAML), 'r') as fd:
+            snap_name = (yaml.load(fd, Loader=YAML_LOADER) or {}).get("name", snap_name)
+        return (snap_name, parse_snap_manifest(snap_name, root + "/"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Reads all the .snap files of snaps_dir, several at a time, returns snap_name -> (data, base)
+def collect_snap_files(snaps_dir, jobs=None):
+    if shutil.which(UNSQUASHFS) is None:
+        sys.exit("%s was not found: install squashfs-tools to read .snap files" % UNSQUASHFS)
+    snap_files = sorted(glob.glob(os.path.join(snaps_dir, "*.snap")))
+    parsed = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for snap_file, (snap_name, result) in zip(snap_files, executor.map(parse_snap_file, snap_files)):
+            if snap_name is None:
+                continue
+            if snap_name in parsed:
+                print("%s: %s is already read from another file, skipping" % (snap_file, snap_name))
+                continue
+            parsed[snap_name] = result
+    print("%d snap files read from %s" % (len(parsed), snaps_dir))
+    return parsed
+
+
+def generate_manifest(snap_name, parsed=None):
+    (data, base) = parsed or parse_snap_manifest(snap_name)
 
     if not data:
         return
@@ -83,11 +210,52 @@ def generate_manifest(snap_name):
             fd.write(f"{pkg} {ver} {snap_name}\n")
 
 
-def main():
-    for d in os.listdir(SNAPDIR):
-        generate_manifest(d)
+# Checks that output can hold the manifests (and reports) of an audit of .snap files, and
+# creates it. Audits rename the manifests they did not write and replace the reports: they
+# must not run where the ones of the installed snaps are ($SNAP_DATA), nor in any directory
+# that holds something else than an earlier audit
+def audit_output_dir(output):
+    if not output:
+        sys.exit("Reading .snap files needs an output directory of its own (--output)")
+    live = os.getenv("SNAP_DATA")
+    if live and os.path.realpath(output) == os.path.realpath(live):
+        sys.exit("%s holds the reports of the installed snaps, choose another output directory" % output)
+    if os.path.isdir(output) and os.listdir(output) and not os.path.exists(os.path.join(output, AUDIT_MARKER)):
+        sys.exit("%s is not empty and was not written by an audit of .snap files, choose another output directory" % output)
+    os.makedirs(output, exist_ok=True)
+    open(os.path.join(output, AUDIT_MARKER), 'a').close()
+    return output
+
+
+# Writes the manifest.<base> files of the snaps installed, or of the .snap files of snaps_dir
+# The manifests are written in the current directory, see audit_output_dir for snaps_dir
+def main(snaps_dir=None, jobs=None):
+    bases.clear()
+    if snaps_dir:
+        parsed = collect_snap_files(snaps_dir, jobs)
+        snap_names = sorted(parsed.keys())
+    else:
+        snap_names = os.listdir(SNAPDIR)
+        parsed = collect_manifests(snap_names, jobs)
+    for d in snap_names:
+        generate_manifest(d, parsed[d])
+    if snaps_dir:
+        # The manifests of bases the snap files do not have would be scanned along with theirs
+        for filename in glob.glob("manifest.*"):
+            if filename[len("manifest."):] not in bases and not filename.endswith(".old"):
+                os.rename(filename, filename + ".old")
 
     print("REMEMBER TO RENAME THE FILE TO 'manifest'")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Write the manifest.<base> files of the snaps of this system")
+    parser.add_argument("--snaps-dir", help="read the .snap files of this directory instead of the installed snaps")
+    parser.add_argument("-o", "--output", help="where to write the manifests of the .snap files (required with --snaps-dir)")
+    parser.add_argument("-j", "--jobs", type=int, help="number of snaps read at the same time (default: number of CPUs)")
+    args = parser.parse_args()
+    if args.snaps_dir:
+        snaps_dir = os.path.abspath(args.snaps_dir)
+        os.chdir(audit_output_dir(args.output))
+        main(snaps_dir, args.jobs)
+    else:
+        main(None, args.jobs)
@@ -0,0 +1,114 @@
+#!/bin/env python3
+
+# Tests of the reading of .snap files (parse_snap_file, collect_snap_files) on small
+# squashfs images built with mksquashfs: a base with usr/share/snappy/dpkg.yaml, an app with
+# snap/manifest.yaml, a kernel whose changelog is found through the doc/linux-modules-*
+# wildcard, and snaps that have none of these files, or are not squashfs images at all.
+# Skipped when squashfs-tools is not installed.
+#
+#   python3 -m pytest -q tests
+
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import snap_manifest
+from snap_manifest import collect_snap_files, parse_snap_file
+
+KERNEL_CHANGELOG = """linux (5.15.0-91.101) jammy; urgency=medium
+
+  * jammy/linux: 5.15.0-91.101 -proposed tracker (LP: #2045562)
+
+  * Packaging resync (LP: #1786013)
+
+ -- Ubuntu Kernel Team <kernel-team@lists.ubuntu.com>  Fri, 01 Dec 2023 10:00:00 +0100
+"""
+
+SNAPS = {
+    "core22": {
+        "meta/snap.yaml": "name: core22\ntype: base\n",
+        "usr/share/snappy/dpkg.yaml": "packages:\n- libc6=2.35-0ubuntu3.1\n- openssl=3.0.2-0ubuntu1.10\n",
+        "usr/lib/os-release": "NAME=\"Ubuntu Core\"\n",
+    },
+    "lxd": {
+        "meta/snap.yaml": "name: lxd\nbase: core22\n",
+        "snap/manifest.yaml": "base: core22\nprimed-stage-packages:\n- liblz4-1=1.9.3-2build2\n",
+    },
+    "pc-kernel": {
+        "meta/snap.yaml": "name: pc-kernel\ntype: kernel\n",
+        "doc/linux-modules-5.15.0-91-generic/changelog.Debian.gz": gzip.compress(KERNEL_CHANGELOG.encode()),
+        "doc/linux-modules-5.15.0-91-generic/copyright": "Copyright\n",
+        "lib/modules/5.15.0-91-generic/modules.dep": "\n",
+    },
+    "hello": {
+        "meta/snap.yaml": "name: hello-world\nbase: core22\n",
+        "bin/hello": "#!/bin/sh\necho hello\n",
+    },
+}
+
+
+@unittest.skipUnless(shutil.which("mksquashfs") and shutil.which(snap_manifest.UNSQUASHFS),
+                     "squashfs-tools is not installed")
+class SnapFilesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.snapsDir = os.path.join(cls.workdir.name, "snaps")
+        os.makedirs(cls.snapsDir)
+        for snap_name, files in SNAPS.items():
+            cls.build(snap_name, files)
+        with open(os.path.join(cls.snapsDir, "broken_1.snap"), 'wb') as fd:
+            fd.write(b"not a squashfs image\n")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    # Builds <snap_name>_1.snap out of files: path -> contents
+    @classmethod
+    def build(cls, snap_name, files):
+        source = os.path.join(cls.workdir.name, "source", snap_name)
+        for path, contents in files.items():
+            os.makedirs(os.path.dirname(os.path.join(source, path)), exist_ok=True)
+            with open(os.path.join(source, path), 'wb') as fd:
+                fd.write(contents if isinstance(contents, bytes) else contents.encode())
+        subprocess.run(["mksquashfs", source, os.path.join(cls.snapsDir, "%s_1.snap" % snap_name),
+                        "-noappend", "-all-root"], stdout=subprocess.DEVNULL, check=True)
+
+    def parse(self, snap_name):
+        return parse_snap_file(os.path.join(self.snapsDir, "%s_1.snap" % snap_name))
+
+    def testDpkgYaml(self):
+        self.assertEqual(self.parse("core22"),
+                         ("core22", ({"libc6": "2.35-0ubuntu3.1", "openssl": "3.0.2-0ubuntu1.10"}, "core22")))
+
+    def testManifestYaml(self):
+        self.assertEqual(self.parse("lxd"), ("lxd", ({"liblz4-1": "1.9.3-2build2"}, "core22")))
+
+    # Only found through the wildcard, the snap having neither dpkg.yaml nor manifest.yaml
+    def testKernelChangelog(self):
+        self.assertEqual(self.parse("pc-kernel"),
+                         ("pc-kernel", ({"linux-image-5.15.0-91-generic": "5.15.0-91.101"}, "pc-kernel")))
+
+    # None of the package lists: the snap is still read, under the name of its snap.yaml
+    def testNoPackageList(self):
+        self.assertEqual(self.parse("hello"), ("hello-world", ({}, "hello-world")))
+
+    def testNotSquashfs(self):
+        self.assertEqual(self.parse("broken"), (None, ({}, None)))
+
+    def testCollect(self):
+        parsed = collect_snap_files(self.snapsDir, 2)
+        self.assertEqual(sorted(parsed.keys()), ["core22", "hello-world", "lxd", "pc-kernel"])
+        self.assertEqual(parsed["pc-kernel"], ({"linux-image-5.15.0-91-generic": "5.15.0-91.101"}, "pc-kernel"))
+
+
+if __name__ == "__main__":
+    unittest.main()